@@ -0,0 +1,71 @@
+""" betweenness centrality with Brandes' algorithm over a process pool
+
+each worker runs the single source searches of a share of the sources and
+returns the sum of their dependencies as one array, indexed by a node
+order fixed by the parent, which the parent adds up
+"""
+from __future__ import division
+
+import multiprocessing
+
+import numpy as np
+
+from app import sampling
+
+# below this many nodes starting a pool costs more than it saves
+SERIAL_BELOW = 500
+
+# per worker process state, see init_worker
+_graph = None
+_index = None
+
+
+def init_worker(gr, nodes):
+    global _graph, _index
+    _graph = gr.graph
+    _index = {node: i for i, node in enumerate(nodes)}
+
+
+def dependencies(sources):
+    """ summed dependencies of every node on sources in the worker's
+    graph
+    """
+    N = len(_index)
+    dependency = np.zeros(N)
+    # the inverse distances sampling.accumulate also adds up are unused
+    inverse = np.zeros(N)
+    for source in sources:
+        sampling.accumulate(_graph, _index, source, inverse, dependency)
+    return dependency
+
+
+def betweenness(gr, processes=None, chunks_per_process=4):
+    """ {node: betweenness} of gr, normalised as networkx's
+    """
+    nodes = gr.graph.nodes()
+    N = len(nodes)
+    if N < 3:
+        return dict.fromkeys(nodes, 0.)
+
+    if N < SERIAL_BELOW or multiprocessing.current_process().daemon:
+        # small, or already in a pool worker which can't start its own
+        init_worker(gr, nodes)
+        total = dependencies(nodes)
+    else:
+        processes = processes or multiprocessing.cpu_count()
+        chunks = np.array_split(
+            np.arange(N), processes * chunks_per_process
+        )
+        pool = multiprocessing.Pool(processes, init_worker, (gr, nodes))
+        try:
+            total = np.zeros(N)
+            for partial in pool.imap_unordered(dependencies, [
+                    [nodes[i] for i in chunk] for chunk in chunks
+            ]):
+                total += partial
+        finally:
+            pool.terminate()
+            pool.join()
+
+    total /= (N - 1) * (N - 2)
+    return dict(zip(nodes, total.tolist()))
@@ -0,0 +1,90 @@
+import threading
+
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """ a small thread safe least recently used mapping
+    """
+    def __init__(self, maxsize=32):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.lock = threading.RLock()
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.data
+
+    def __len__(self):
+        with self.lock:
+            return len(self.data)
+
+    def get(self, key, default=None):
+        with self.lock:
+            try:
+                value = self.data.pop(key)
+            except KeyError:
+                return default
+            self.data[key] = value
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.data.pop(key, None)
+            self.data[key] = value
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+        return value
+
+    def pop(self, key, default=None):
+        with self.lock:
+            return self.data.pop(key, default)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+
+class BytesCache(LRUCache):
+    """ LRU cache bounded by the total size of its values, their length
+    unless a size function is given
+
+    maxbytes may be a function, read on every set, for a limit that is
+    only known once the app is configured
+    """
+    def __init__(self, maxbytes=64 * 1024 * 1024, maxsize=4096, size=len):
+        super(BytesCache, self).__init__(maxsize)
+        self.maxbytes = maxbytes
+        self.size = size
+        self.nbytes = 0
+
+    def set(self, key, value):
+        with self.lock:
+            self.pop(key)
+            maxbytes = self.maxbytes
+            if callable(maxbytes):
+                maxbytes = maxbytes()
+            if self.size(value) > maxbytes:
+                return value
+            self.data[key] = value
+            self.nbytes += self.size(value)
+            while (
+                    self.nbytes > maxbytes or
+                    len(self.data) > self.maxsize
+            ):
+                _, old = self.data.popitem(last=False)
+                self.nbytes -= self.size(old)
+        return value
+
+    def pop(self, key, default=None):
+        with self.lock:
+            value = self.data.pop(key, None)
+            if value is None:
+                return default
+            self.nbytes -= self.size(value)
+            return value
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+            self.nbytes = 0
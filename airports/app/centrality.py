@@ -0,0 +1,79 @@
+from collections import OrderedDict
+from operator import itemgetter
+
+from app.cache import LRUCache
+
+
+class Ranking(object):
+    """ a centrality of every node and the nodes ordered by it
+    """
+    def __init__(self, values):
+        self.values = values
+        self.order = sorted(
+            values.iteritems(), key=itemgetter(1), reverse=True
+        )
+
+    def __getitem__(self, node):
+        return self.values[node]
+
+    def __contains__(self, node):
+        return node in self.values
+
+    def get(self, node, default=None):
+        return self.values.get(node, default)
+
+    def top(self, limit=None):
+        return OrderedDict(self.order[:limit])
+
+
+class CentralityCache(object):
+    """ rankings cached per (graph version, metric)
+
+    a failure, eigenvector centrality not converging, is cached too so
+    that it is not retried on every request
+    """
+    metrics = ('degree', 'eigenvector', 'betweenness')
+
+    def __init__(self, maxsize=64):
+        self.rankings = LRUCache(maxsize)
+
+    def get(self, gr, metric):
+        if metric not in self.metrics:
+            raise ValueError('unknown centrality %s' % metric)
+
+        ranking = self.rankings.get((gr.version, metric))
+        if ranking is None:
+            try:
+                ranking = Ranking(getattr(self, metric)(gr))
+            except Exception as e:
+                ranking = e
+            self.rankings.set((gr.version, metric), ranking)
+        if isinstance(ranking, Exception):
+            raise ranking
+        return ranking
+
+    def degree(self, gr):
+        return gr.degree_centrality()
+
+    def eigenvector(self, gr):
+        return gr.eigenvector_centrality(nstart=self.warm_start(gr))
+
+    def betweenness(self, gr):
+        return gr.betweenness_centrality()
+
+    def warm_start(self, gr):
+        """ the eigenvector of a cached version one removal away from
+        gr, restricted to gr's nodes
+        """
+        for version, node, _ in gr.lineage():
+            parent = self.rankings.get((version, 'eigenvector'))
+            if isinstance(parent, Ranking):
+                nstart = {
+                    n: parent.get(n, 0.) for n in gr.graph
+                }
+                if sum(nstart.itervalues()) > 0:
+                    return nstart
+        return None
+
+
+cache = CentralityCache()
@@ -0,0 +1,38 @@
+""" column oriented payloads for the big tables
+
+a table is sent as one list per column rather than one object per row,
+{key: {column: [values]}}, as compact JSON or as MessagePack when it is
+installed
+"""
+import json
+
+from flask import Response, abort
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+FORMATS = ('columnar', 'msgpack')
+
+
+def available(fmt):
+    return fmt != 'msgpack' or msgpack is not None
+
+
+def response(key, columns, fmt='columnar'):
+    """ a response holding the columns of a BaseGraph.columns table
+    """
+    if not available(fmt):
+        abort(406)
+    payload = {
+        key: {name: column.tolist() for name, column in columns.iteritems()}
+    }
+    if fmt == 'msgpack':
+        return Response(
+            msgpack.packb(payload), mimetype='application/x-msgpack'
+        )
+    return Response(
+        json.dumps(payload, separators=(',', ':')),
+        mimetype='application/json'
+    )
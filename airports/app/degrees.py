@@ -0,0 +1,155 @@
+""" degree distributions and power law fits, cached per graph version
+
+the histogram of a graph one node removal away from a cached version is
+updated from the removed node's neighbours rather than recounted, and the
+power law exponent is the maximum likelihood estimate of Clauset, Shalizi
+and Newman (2009) with x_min chosen by the Kolmogorov-Smirnov distance
+"""
+from __future__ import division
+
+import numpy as np
+
+from app.cache import LRUCache
+
+
+def degree_array(gr):
+    """ degree of every node of gr
+    """
+    if gr.backend == 'sparse':
+        csr = gr.csr
+        return csr.degree()[csr.alive]
+    degree = gr.degree()
+    return np.fromiter(
+        degree.itervalues(), dtype=np.int64, count=len(degree)
+    )
+
+
+def histogram_without(counts, gr, node, neighbours):
+    """ counts of the graph one removal before gr, adjusted for node's
+    removal from it
+
+    neighbours are node's neighbours in the base graph, those still in gr
+    lose the edges they had to node
+    """
+    counts = counts.copy()
+    multigraph = gr.graph.is_multigraph()
+    lost = 0
+    for nbr, edges in neighbours.iteritems():
+        m = len(edges) if multigraph else 1
+        if nbr == node:
+            lost += 2 * m
+            continue
+        if nbr not in gr.graph:
+            continue
+        lost += m
+        k = gr.graph.degree(nbr)
+        counts[k + m] -= 1
+        counts[k] += 1
+    counts[lost] -= 1
+    return np.trim_zeros(counts, 'b')
+
+
+def loglog_fit(counts):
+    """ [(degree, fitted count)] of a least squares line through the log
+    of the counts against the log of the degrees
+    """
+    x = np.flatnonzero(counts)
+    x = x[x > 0]
+    if len(x) < 2:
+        return []
+    grad, inter = np.polyfit(np.log(x), np.log(counts[x]), 1)
+    y = np.exp(inter + grad * np.log(x))
+    return [
+        (int(a), float(b)) for a, b in zip(x, y) if np.isfinite(b)
+    ]
+
+
+def powerlaw_mle(counts, min_tail=10, chunk=256):
+    """ the discrete power law p(k) ~ k^-alpha, k >= xmin, that best fits
+    the degree counts
+
+    every degree with at least min_tail nodes at or above it is tried as
+    xmin, alpha is its maximum likelihood estimate and the xmin kept is
+    the one whose fit has the smallest Kolmogorov-Smirnov distance to the
+    data. Works on the distinct degrees, in chunks of xmins, so the cost
+    doesn't grow with the number of nodes.
+    """
+    values = np.flatnonzero(counts)
+    values = values[values > 0]
+    if len(values) < 2:
+        return None
+    c = counts[values].astype(float)
+    # nodes and sum of c log k at or above each distinct degree
+    tail = np.cumsum(c[::-1])[::-1]
+    logs = np.cumsum((c * np.log(values))[::-1])[::-1]
+
+    # the last degree can't make a tail with a slope
+    candidates = np.flatnonzero(tail[:-1] >= min_tail)
+    if not len(candidates):
+        candidates = np.arange(len(values) - 1)
+    xmins = values[candidates] - 0.5
+    alphas = 1 + tail[candidates] / (
+        logs[candidates] - tail[candidates] * np.log(xmins)
+    )
+
+    best = None
+    for start in xrange(0, len(candidates), chunk):
+        rows = candidates[start:start + chunk]
+        alpha = alphas[start:start + chunk, None]
+        xmin = xmins[start:start + chunk, None]
+        # compare complementary cdfs at the degrees at or above each xmin
+        empirical = tail[None, :] / tail[rows, None]
+        model = ((values[None, :] - 0.5) / xmin) ** (1 - alpha)
+        distance = np.abs(empirical - model)
+        distance[np.arange(len(values))[None, :] < rows[:, None]] = 0
+        ks = distance.max(axis=1)
+        i = int(np.argmin(ks))
+        if best is None or ks[i] < best[0]:
+            best = (ks[i], start + i)
+
+    ks, i = best
+    n = tail[candidates[i]]
+    alpha = alphas[i]
+    return {
+        'alpha': float(alpha),
+        'xmin': int(values[candidates[i]]),
+        'ks': float(ks),
+        'n_tail': int(n),
+        'sigma': float((alpha - 1) / np.sqrt(n)),
+    }
+
+
+class DegreeCache(object):
+    """ degree histograms and fits keyed on (graph version, kind)
+    """
+    def __init__(self, maxsize=64):
+        self.items = LRUCache(maxsize)
+
+    def histogram(self, gr):
+        """ counts[k] is the number of nodes of degree k
+        """
+        counts = self.items.get((gr.version, 'histogram'))
+        if counts is not None:
+            return counts
+        for version, node, neighbours in gr.lineage():
+            parent = self.items.get((version, 'histogram'))
+            if parent is not None:
+                counts = histogram_without(parent, gr, node, neighbours)
+                break
+        else:
+            counts = np.bincount(degree_array(gr))
+        return self.items.set((gr.version, 'histogram'), counts)
+
+    def fit(self, gr, kind):
+        """ loglog_fit or powerlaw_mle of gr's histogram
+        """
+        fits = {'loglog': loglog_fit, 'mle': powerlaw_mle}
+        if kind not in fits:
+            raise ValueError('unknown fit %s' % kind)
+        key = (gr.version, kind)
+        if key in self.items:
+            return self.items.get(key)
+        return self.items.set(key, fits[kind](self.histogram(gr)))
+
+
+cache = DegreeCache()
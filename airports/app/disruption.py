@@ -0,0 +1,124 @@
+""" what-if removal of many nodes at once
+
+the global efficiency after each removal comes from the previous step's
+efficiency table, only re-searching the sources whose shortest paths went
+through the removed node, and the largest component sizes from adding the
+nodes back in reverse order to a union find
+"""
+import numpy as np
+
+from app import efficiency, utils
+
+STRATEGIES = ('degree', 'vulnerability', 'random')
+MAX_STEPS = 500
+
+
+class DisjointSets(object):
+    def __init__(self):
+        self.parent = {}
+        self.size = {}
+
+    def add(self, node):
+        self.parent[node] = node
+        self.size[node] = 1
+
+    def find(self, node):
+        root = node
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[node] != root:
+            self.parent[node], node = root, self.parent[node]
+        return root
+
+    def union(self, a, b):
+        """ size of the merged set
+        """
+        a, b = self.find(a), self.find(b)
+        if a != b:
+            if self.size[a] < self.size[b]:
+                a, b = b, a
+            self.parent[b] = a
+            self.size[a] += self.size[b]
+        return self.size[a]
+
+
+def resolve(gr, node):
+    """ the graph node for node or for a node named node, None if there
+    is neither
+    """
+    if node in gr.graph:
+        return node
+    for n, data in gr.graph.nodes_iter(data=True):
+        if data.get('name') == node:
+            return n
+    return None
+
+
+def order(gr, strategy, steps, network=None, seed=None):
+    """ the first steps nodes to remove by a strategy
+    """
+    if strategy not in STRATEGIES:
+        raise ValueError('unknown strategy %s' % strategy)
+    if strategy == 'degree':
+        return [node for node, _ in gr.centrality('degree').order[:steps]]
+    if strategy == 'vulnerability':
+        _, V = utils.vulnerability(gr, key=network, limit=steps)
+        return V.keys()
+    rng = np.random.RandomState(seed)
+    nodes = gr.graph.nodes()
+    return [nodes[i] for i in rng.permutation(len(nodes))[:steps]]
+
+
+def largest_components(gr, nodes):
+    """ size of the largest component of gr and of gr after removing
+    each of nodes in turn
+    """
+    removed = set(nodes)
+    sets = DisjointSets()
+    largest = 0
+    for node in gr.graph:
+        if node not in removed:
+            sets.add(node)
+            largest = max(largest, 1)
+    for u, v in gr.graph.edges_iter():
+        if u not in removed and v not in removed:
+            largest = max(largest, sets.union(u, v))
+
+    sizes = [largest]
+    for node in reversed(nodes):
+        sets.add(node)
+        largest = max(largest, 1)
+        removed.discard(node)
+        for nbr in gr.graph[node]:
+            if nbr not in removed:
+                largest = max(largest, sets.union(node, nbr))
+        sizes.append(largest)
+    return sizes[::-1]
+
+
+def simulate(gr, nodes):
+    """ [{removed, efficiency, largest_component}] for gr and after each
+    removal of nodes, gr itself is unchanged
+
+    the tables of the intermediate graphs are kept out of the engine's
+    cache, only the first is looked up in it
+    """
+    table = efficiency.engine.table(gr)
+    base = gr.base or gr
+    sizes = largest_components(gr, nodes)
+
+    steps = [{
+        'removed': None,
+        'efficiency': table.global_efficiency(),
+        'largest_component': sizes[0]
+    }]
+    overlay = gr
+    for node, size in zip(nodes, sizes[1:]):
+        overlay = overlay.without([node])
+        table = table.without(overlay, node, base.graph[node])
+        steps.append({
+            'removed': node,
+            'efficiency': table.global_efficiency(),
+            'largest_component': size
+        })
+    return steps
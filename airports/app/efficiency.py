@@ -0,0 +1,157 @@
+from __future__ import division
+
+import networkx as nx
+import numpy as np
+
+from app.cache import LRUCache
+
+
+class EfficiencyTable(object):
+    """ shortest path lengths between every pair of nodes of one graph
+    version, indexed by the nodes of the base graph
+
+    lengths[i, j] is zero when j is i, unreachable or removed
+    """
+    dtype = np.uint16
+
+    def __init__(self, nodes, index, lengths, alive):
+        self.nodes = nodes
+        self.index = index
+        self.lengths = lengths
+        self.alive = alive
+        self.totals = None
+        self.effs = None
+
+    @classmethod
+    def build(cls, gr):
+        nodes = (gr.base or gr).graph.nodes()
+        index = {node: i for i, node in enumerate(nodes)}
+        N = len(nodes)
+        table = cls(
+            nodes,
+            index,
+            np.zeros((N, N), dtype=cls.dtype),
+            np.zeros(N, dtype=bool)
+        )
+        for node in gr.graph:
+            table.alive[index[node]] = True
+        table.search(gr, np.flatnonzero(table.alive))
+        table.totals = table.inverse_sums()
+        return table
+
+    def search(self, gr, rows):
+        """ refill rows with the path lengths from their nodes in gr
+        """
+        if gr.backend == 'sparse':
+            self.lengths[rows] = gr.csr.shortest_path_lengths(rows)
+            return
+
+        for i in rows:
+            lengths = nx.single_source_shortest_path_length(
+                gr.graph, self.nodes[i]
+            )
+            row = self.lengths[i]
+            row[:] = 0
+            row[[self.index[node] for node in lengths]] = lengths.values()
+
+    def inverse_sums(self, rows=None, chunk=1024):
+        """ sum of 1/length over each row
+        """
+        if rows is None:
+            rows = np.arange(len(self.nodes))
+        totals = np.zeros(len(rows))
+        with np.errstate(divide='ignore'):
+            for start in xrange(0, len(rows), chunk):
+                lengths = self.lengths[rows[start:start + chunk]]
+                totals[start:start + chunk] = np.where(
+                    lengths > 0, 1. / lengths, 0.
+                ).sum(axis=1)
+        return totals
+
+    def without(self, gr, node, neighbours):
+        """ the table of gr, which is this table's graph minus node
+
+        only sources with a shortest path through node are searched
+        again, all other rows just lose their length to node
+        """
+        i = self.index[node]
+        column = self.lengths[:, i].astype(np.int32)
+        nbrs = [self.index[nbr] for nbr in neighbours]
+        through = (
+            (self.lengths[:, nbrs] == (column + 1)[:, None]).any(axis=1) &
+            (column > 0)
+        )
+
+        table = EfficiencyTable(
+            self.nodes,
+            self.index,
+            self.lengths.copy(),
+            self.alive.copy()
+        )
+        table.alive[i] = False
+        table.lengths[i, :] = 0
+        table.lengths[:, i] = 0
+
+        with np.errstate(divide='ignore'):
+            table.totals = self.totals - np.where(
+                column > 0, 1. / column, 0.
+            )
+        table.totals[i] = 0.
+
+        rows = np.flatnonzero(through & table.alive)
+        if len(rows):
+            table.search(gr, rows)
+            table.totals[rows] = table.inverse_sums(rows)
+        return table
+
+    def norm(self):
+        """ 1/(N(N-1)) for the N nodes left
+        """
+        N = int(self.alive.sum())
+        return 1./(N * (N - 1)) if N > 1 else 0.
+
+    def global_efficiency(self):
+        """ sum of the per node efficiencies
+        """
+        return float(self.totals[self.alive].sum() * self.norm())
+
+    def efficiencies(self):
+        """ per node efficiency, the global efficiency is their sum
+        """
+        if self.effs is None:
+            norm = self.norm()
+            self.effs = {
+                self.nodes[i]: float(self.totals[i] * norm)
+                for i in np.flatnonzero(self.alive)
+            }
+        return dict(self.effs)
+
+
+class EfficiencyEngine(object):
+    """ efficiency tables cached per graph version
+
+    a graph that is one node removal away from a cached version is
+    updated incrementally rather than searched from every node
+    """
+    def __init__(self, maxsize=8):
+        self.tables = LRUCache(maxsize)
+
+    def table(self, gr):
+        table = self.tables.get(gr.version)
+        if table is not None:
+            return table
+
+        for version, node, neighbours in gr.lineage():
+            parent = self.tables.get(version)
+            if parent is not None:
+                table = parent.without(gr, node, neighbours)
+                break
+        else:
+            table = EfficiencyTable.build(gr)
+        return self.tables.set(gr.version, table)
+
+    def efficiencies(self, gr):
+        return self.table(gr).efficiencies()
+
+
+engine = EfficiencyEngine()
@@ -1,17 +1,27 @@
+import copy
 import csv
+import hashlib
 import itertools
 import json
+import logging
+import time
 
-import math
-import random
-
-from itertools import chain
 from collections import OrderedDict
 from operator import itemgetter
 
 import networkx as nx
+import numpy as np
+
+from app import (
+    app, betweenness, centrality, degrees, efficiency, hublabels,
+    instrument, journey, layout, projection, routing, sampling, snapshot,
+    spatial, sparse, vulnerability
+)
 from config import get_network_data as get
 
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
 
 def pairwise(iterable):
     "s -> (s0,s1), (s1,s2), (s2, s3), ..."
@@ -20,33 +30,376 @@ def pairwise(iterable):
     return itertools.izip(a, b)
 
 
+def bernoulli_indices(rng, n, p):
+    """ sorted indices in range(n) each picked with chance p, drawn as
+    geometric gaps between picks rather than one draw per index
+    """
+    if p >= 1:
+        return np.arange(n)
+    picks = []
+    last = -1
+    while last < n - 1:
+        size = int((n - last) * p * 1.1) + 16
+        steps = last + np.cumsum(rng.geometric(p, size))
+        picks.append(steps[steps < n])
+        last = steps[-1]
+    return np.concatenate(picks or [[]]).astype(np.int64)
+
+
+def fingerprint(*parts):
+    """ short stable hash of the repr of each part
+    """
+    h = hashlib.sha1()
+    for part in parts:
+        h.update(repr(part))
+    return h.hexdigest()[:16]
+
+
 class BaseGraph(object):
     d3 = False
-
-    def __init__(self):
-        self.build_graph()
+    # set on copy-on-write overlays, see without()
+    base = None
+    removed = frozenset()
+    _csr = None
+    _coordinates = None
+    _spatial = None
+    _hub_labels = None
+    _columns = None
+    # utils.NETWORKS key and the data files the graph is built from
+    network = None
+    sources = ()
+    # {table: node columns}, an overlay drops the rows of removed nodes
+    tables = {}
+
+    def __init__(self, use_snapshot=True):
+        start = time.time()
+        if not (use_snapshot and self.sources and snapshot.load(self)):
+            self.build_graph()
+            self.touch()
+        logger.info(
+            '%s loaded in %.3fs: %d nodes, %d edges',
+            self.__class__.__name__,
+            time.time() - start,
+            self.graph.number_of_nodes(),
+            self.graph.number_of_edges()
+        )
 
     def build_graph(self):
         raise NotImplementedError
 
-    def calculate_global_efficiencies(self):
-        E = {}
-        N = self.graph.number_of_nodes()
-        norm = 1./(N * (N - 1))
+    def touch(self):
+        """ give the graph a new version from its nodes and edges
+        call this after changing self.graph in place
+        """
+        h = hashlib.sha1(self.__class__.__name__)
+        for node in self.graph.nodes_iter():
+            h.update(repr(node))
+        for edge in self.graph.edges_iter(data=True):
+            h.update(repr(edge))
+        self.version = h.hexdigest()[:16]
+        self.clear_caches()
+
+    def clear_caches(self):
+        """ forget everything derived from the current graph
+        """
+        self._csr = None
+        self._coordinates = None
+        self._spatial = None
+        self._hub_labels = {}
+        self._columns = {}
+
+    def version_without(self, nodes):
+        """ version of the overlay of the base graph without nodes
+        """
+        base = self.base or self
+        nodes = frozenset(nodes)
+        if not nodes:
+            return base.version
+        return fingerprint(base.version, sorted(nodes))
+
+    def without(self, nodes):
+        """ copy-on-write overlay of the base graph with nodes removed
+
+        the base graph is shared and never modified, the overlay only
+        holds a node filtered subgraph and the set of removed nodes
+        """
+        base = self.base or self
+        removed = frozenset(
+            node for node in self.removed.union(nodes)
+            if node in base.graph
+        )
+        if not removed:
+            return base
+        overlay = copy.copy(base)
+        overlay.base = base
+        overlay.removed = removed
+        overlay.graph = base.graph.subgraph(
+            node for node in base.graph if node not in removed
+        )
+        overlay.version = base.version_without(removed)
+        overlay._csr = None
+        overlay._columns = {}
+        return overlay
+
+    def lineage(self):
+        """ (parent version, node, node neighbours) for each overlay
+        one node removal away from this graph
+        """
+        if self.base is None:
+            return
+        for node in self.removed:
+            yield (
+                self.version_without(self.removed - set([node])),
+                node,
+                self.base.graph[node]
+            )
+
+    @property
+    def backend(self):
+        """ 'sparse' or 'networkx', see GRAPH_BACKEND
+        """
+        if (
+                app.config.get('GRAPH_BACKEND') == 'sparse' and
+                sparse.available()
+        ):
+            return 'sparse'
+        return 'networkx'
+
+    @property
+    def csr(self):
+        """ CSR copy of the graph, overlays mask their base's copy
+        """
+        if self._csr is None:
+            if self.base is None:
+                self._csr = sparse.CSRGraph.from_graph(self.graph)
+            else:
+                self._csr = self.base.csr.without(self.removed)
+        return self._csr
+
+    def columns(self, table):
+        """ OrderedDict of column name: array for one of the tables,
+        built once per version
+        """
+        if table not in self.tables:
+            raise ValueError('unknown table %s' % table)
+        columns = self._columns.get(table)
+        if columns is None:
+            if self.base is None:
+                columns = self.build_columns(table)
+            else:
+                columns = self.base.columns(table)
+                removed = np.array(list(self.removed), dtype=object)
+                keep = np.ones(len(next(columns.itervalues())), dtype=bool)
+                for name in self.tables[table]:
+                    keep &= ~np.in1d(columns[name], removed)
+                columns = OrderedDict(
+                    (name, column[keep])
+                    for name, column in columns.iteritems()
+                )
+            self._columns[table] = columns
+        return columns
+
+    def build_columns(self, table):
+        raise NotImplementedError
+
+    @instrument.timed('degree')
+    def degree(self):
+        if self.backend == 'sparse':
+            csr = self.csr
+            degree = csr.degree()
+            return {
+                csr.nodes[i]: int(degree[i])
+                for i in np.flatnonzero(csr.alive)
+            }
+        return nx.degree(self.graph)
+
+    @instrument.timed('degree_histogram')
+    def degree_histogram(self):
+        """ array of the number of nodes of each degree, cached per
+        version
+        """
+        return degrees.cache.histogram(self)
+
+    @instrument.timed('degree_fit')
+    def degree_fit(self, kind='loglog'):
+        """ fit of the degree distribution, see degrees
+        """
+        return degrees.cache.fit(self, kind)
+
+    @instrument.timed('degree_centrality')
+    def degree_centrality(self):
+        if self.backend == 'sparse':
+            return self.csr.degree_centrality()
+        return nx.degree_centrality(self.graph)
+
+    @instrument.timed('eigenvector_centrality')
+    def eigenvector_centrality(self, nstart=None):
+        if self.backend == 'sparse':
+            return self.csr.eigenvector_centrality(nstart=nstart)
+        return nx.eigenvector_centrality(self.graph, nstart=nstart)
+
+    @instrument.timed('betweenness_centrality')
+    def betweenness_centrality(self, processes=None):
+        """ Brandes' betweenness with the sources spread over a pool
+        """
+        return betweenness.betweenness(self, processes=processes)
+
+    @property
+    def coordinates(self):
+        """ {node: (latitude, longitude)} as floats for the nodes of the
+        base graph that have them, parsed once
+        """
+        base = self.base or self
+        if base._coordinates is None:
+            coordinates = {}
+            for node, data in base.graph.nodes_iter(data=True):
+                try:
+                    coordinates[node] = (
+                        float(data['latitude']), float(data['longitude'])
+                    )
+                except (KeyError, TypeError, ValueError):
+                    pass
+            base._coordinates = coordinates
+        return base._coordinates
+
+    @property
+    def spatial(self):
+        """ spatial.SpatialIndex of the base graph's coordinates
+        """
+        base = self.base or self
+        if base._spatial is None:
+            base._spatial = spatial.SpatialIndex(self.coordinates)
+        return base._spatial
+
+    @instrument.timed('nearby')
+    def nearby(self, lat, lon, radius=None, k=None):
+        """ [(km, node)] of the nodes within radius km of a point, or
+        the k nearest, nearest first
+        """
+        if radius is not None:
+            found = self.spatial.within(lat, lon, radius, self.removed)
+            return found[:k] if k else found
+        return self.spatial.nearest(lat, lon, k or 1, self.removed)
 
-        nodes = nx.shortest_path_length(self.graph)
-        for node, paths in nodes.iteritems():
-            E[node] = sum(
-                [1./v for k, v in paths.iteritems() if k != node]
-            )*norm
-        return E
+    def within_bbox(self, bbox):
+        """ nodes inside a (west, south, east, north) viewport
+        """
+        return self.spatial.bbox(*bbox, removed=self.removed)
+
+    @instrument.timed('project')
+    def project(self, name, scale, translate, bbox=None, resolution=None):
+        """ [(node, x, y)] of the nodes a projection places, inside bbox
+        and, with a resolution, only the highest degree node of each
+        resolution pixel square
+
+        the base graph's nodes are projected once per projection
+        """
+        index = self.spatial
+        base = self.base or self
+        key = (base.version, name, scale, translate)
+        xy = projection.projected.get(key)
+        if xy is None:
+            xy = projection.projected.set(
+                key, projection.project(index, name, scale, translate)
+            )
+        x, y = xy
+
+        if bbox is None:
+            indices = np.arange(len(index.nodes))
+        else:
+            indices = index.bbox_indices(*bbox)
+        indices = indices[np.isfinite(x[indices])]
+        if self.removed:
+            indices = indices[np.array([
+                index.nodes[i] not in self.removed for i in indices
+            ], dtype=bool)]
+        if resolution and len(indices):
+            degree = np.array([
+                self.graph.degree(index.nodes[i]) for i in indices
+            ])
+            indices = indices[projection.thin(
+                x[indices], y[indices], degree, resolution
+            )]
+        return [
+            (index.nodes[i], float(x[i]), float(y[i])) for i in indices
+        ]
+
+    def hub_labels(self, cost='distance'):
+        """ the base graph's saved hublabels.HubLabels or None
+        """
+        base = self.base or self
+        if cost not in base._hub_labels:
+            base._hub_labels[cost] = None
+            if base.network:
+                base._hub_labels[cost] = hublabels.load(base, cost)
+        return base._hub_labels[cost]
+
+    def router(self, cost='distance'):
+        key = (self.version, cost)
+        router = routing.routers.get(key)
+        if router is None:
+            router = routing.routers.set(key, routing.Router(
+                self.graph,
+                self.coordinates,
+                cost,
+                labels=self.hub_labels(cost),
+                removed=self.removed
+            ))
+        return router
+
+    @instrument.timed('routes')
+    def routes(self, source, target, k=1, max_hops=None,
+               algorithm=None, cost='distance'):
+        """ list of (cost, path) from source to target, see routing
+        """
+        return self.router(cost).routes(
+            source, target, k=k, max_hops=max_hops, algorithm=algorithm
+        )
 
+    @instrument.timed('centrality')
+    def centrality(self, metric):
+        """ cached centrality.Ranking, metric is degree, eigenvector or
+        betweenness
+        """
+        return centrality.cache.get(self, metric)
+
+    @instrument.timed('calculate_global_efficiencies')
+    def calculate_global_efficiencies(self):
+        """ per node efficiency, cached per version by the engine
+        """
+        return efficiency.engine.efficiencies(self)
+
+    @instrument.timed('global_efficiency')
     def global_efficiency(self):
         E = self.calculate_global_efficiencies()
         return sum([eff for node, eff in E.iteritems()])
 
-    def vulnerability(self, limit=None):
-        effs = self.calculate_global_efficiencies()
+    @instrument.timed('estimate')
+    def estimate(self, epsilon=None, confidence=0.95, budget=None,
+                 seed=None):
+        """ sampling.Estimate of the efficiency, closeness and
+        betweenness, cached per version
+        """
+        return sampling.cached(self, epsilon, confidence, budget, seed)
+
+    @instrument.timed('vulnerability')
+    def vulnerability(self, limit=None, exact=False, network=None,
+                      deadline=None, efficiencies=None):
+        """ returns (most vulnerable node, vulnerabilities)
+
+        exact removes each node in turn, using the table precomputed
+        for network when there is one and cached per version, otherwise
+        the nodes are ranked by their own share of the global efficiency,
+        which can be given, as estimated ones. The most vulnerable node
+        is None when the deadline passed before any node was done
+        """
+        if exact:
+            V = vulnerability.rank(
+                vulnerability.cached(self, network, deadline), limit
+            )
+            return (V.items()[0] if V else None), V
+
+        effs = efficiencies or self.calculate_global_efficiencies()
         E = sum([eff for node, eff in effs.iteritems()])
         V = {node: ((E-eff)/E) for node, eff in effs.iteritems()}
 
@@ -77,9 +430,20 @@ class BaseGraph(object):
             )
         self.d3 = True
         self.graph = ngr
+        self.touch()
+
+    @instrument.timed('spring_layout')
+    def spring_layout(self, iterations=50):
+        """ {node: (x, y)} in the unit square, cached per version
+        """
+        return layout.spring_layout(self, iterations)
 
-    def d3_forced_layout(self, data=[]):
+    @instrument.timed('d3_forced_layout')
+    def d3_forced_layout(self, data=[], size=None):
         """ extra data is a list of data keys
+
+        with a (width, height) size the nodes carry the server side
+        layout as layout_x and layout_y
         """
         if not self.d3:
             raise NotImplementedError
@@ -97,32 +461,54 @@ class BaseGraph(object):
             })
             edge_ids.extend([edge[0], edge[1]])
         edge_ids = sorted(list(set(edge_ids)))
+        if size:
+            positions = self.spring_layout()
+            width, height = size
         for edge_id in edge_ids:
-            nodes.append(self.graph.node[edge_id])
+            node = self.graph.node[edge_id]
+            if size:
+                # node data is shared with the base graph
+                node = dict(node)
+                x, y = positions[edge_id]
+                node['layout_x'] = x * width
+                node['layout_y'] = y * height
+            nodes.append(node)
         return edges, nodes
 
 
 class Graph(BaseGraph):
+    network = 'network'
+    sources = ('flights', 'airports')
+    tables = {'flights': ('origin', 'destination'), 'airports': ('code',)}
+    airport_fields = (
+        'code', 'name', 'city', 'state', 'country', 'latitude', 'longitude'
+    )
+
     def build_graph(self):
         with open(get('flights')) as f:
             self.graph = nx.read_weighted_edgelist(f, delimiter=',')
 
+        codes = set(self.graph)
         with open(get('airports')) as fcsv:
             next(fcsv)
             reader = csv.reader(fcsv, delimiter=',')
 
-            for row in reader:
-                if row[0] in self.graph.nodes():
-                    self.graph.add_node(
-                        row[0],
-                        code=row[0],
-                        name=row[1],
-                        city=row[2],
-                        state=row[3],
-                        country=row[4],
-                        latitude=row[5],
-                        longitude=row[6]
-                    )
+            self.graph.add_nodes_from(
+                (
+                    row[0],
+                    {
+                        'code': row[0],
+                        'name': row[1],
+                        'city': row[2],
+                        'state': row[3],
+                        'country': row[4],
+                        'latitude': row[5],
+                        'longitude': row[6]
+                    }
+                )
+                for row in reader
+                if row[0] in codes
+            )
 
     @property
     def get_current_nodes(self):
@@ -131,6 +517,28 @@ class Graph(BaseGraph):
             node_list[node] = self.graph.node[node]
         return node_list
 
+    def build_columns(self, table):
+        def column(values):
+            values = list(values)
+            array = np.empty(len(values), dtype=object)
+            array[:] = values
+            return array
+
+        if table == 'flights':
+            edges = self.graph.edges(data=True)
+            return OrderedDict([
+                ('origin', column(edge[0] for edge in edges)),
+                ('destination', column(edge[1] for edge in edges)),
+                ('count', np.array(
+                    [edge[2]['weight'] for edge in edges], dtype=float
+                ))
+            ])
+        nodes = self.get_current_nodes.values()
+        return OrderedDict(
+            (field, column(node.get(field) for node in nodes))
+            for field in self.airport_fields
+        )
+
 
 class Random(BaseGraph):
     def build_graph(self):
@@ -139,6 +547,7 @@ class Random(BaseGraph):
 
 
 class N_degree_partition(BaseGraph):
+    network = 'random'
     prune = True
     p = 0.1
     nodes = [50, 50, 50]
@@ -152,59 +561,111 @@ class N_degree_partition(BaseGraph):
                 except:
                     pass
 
+    def __init__(self, seed=None, **kwargs):
+        self.seed = seed
+        if seed is None:
+            self.seed = app.config.get('RANDOM_SEED')
+        super(N_degree_partition, self).__init__(**kwargs)
+
     def build_graph(self):
         # make a partite network
-        self.graph = nx.random_partition_graph(self.nodes, 0, 0)
+        rng = np.random.RandomState(self.seed)
+        sizes = np.array(self.nodes)
+        offsets = np.concatenate([[0], np.cumsum(sizes)])
+        N = int(offsets[-1])
+        part = np.repeat(np.arange(len(sizes)), sizes)
 
         if self.p == 0:
+            self.graph = nx.Graph()
+            self.graph.add_nodes_from(xrange(N))
+            self.graph.graph['partition'] = [
+                set(xrange(offsets[i], offsets[i + 1]))
+                for i in xrange(len(sizes))
+            ]
             return
-        lp = math.log(self.p)
-
-        for p1, p2 in pairwise(self.graph.graph['partition']):
-            p1 = sorted(p1)
-            p2 = sorted(p2)
-            for i in p1:
-                for j in p2:
-                    if int(self.p) == 1:
-                        self.graph.add_edge(i, j)
-                        continue
-                    lr = math.log(1.0 - random.random())
-                    if lr/lp >= 1:
-                        self.graph.add_edge(i, j)
-
-        # prune unnconnected nodes
+
+        # each pair across adjacent partitions is an edge with chance p
+        sources, targets = [], []
+        for i in xrange(len(sizes) - 1):
+            a, b = sizes[i], sizes[i + 1]
+            pairs = bernoulli_indices(rng, a * b, self.p)
+            sources.append(offsets[i] + pairs // b)
+            targets.append(offsets[i + 1] + pairs % b)
+        sources = np.concatenate(sources or [[]]).astype(np.int64)
+        targets = np.concatenate(targets or [[]]).astype(np.int64)
+
+        # prune unnconnected nodes and number the rest from zero
+        keep = np.ones(N, dtype=bool)
         if self.prune:
-            for node in self.graph.nodes():
-                if nx.is_isolate(self.graph, node):
-                    self.graph.remove_node(node)
-        self.node_labels_to_ints()
-        self.colour()
+            keep = np.bincount(
+                np.concatenate([sources, targets]), minlength=N
+            ) > 0
+        labels = np.cumsum(keep) - 1
+        nodes = labels[keep].tolist()
+        colours = part[keep].tolist()
+
+        self.graph = nx.Graph()
+        self.graph.add_nodes_from(
+            (node, {'nodeID': node, 'colour': colour})
+            for node, colour in itertools.izip(nodes, colours)
+        )
+        self.graph.add_edges_from(
+            itertools.izip(labels[sources].tolist(), labels[targets].tolist())
+        )
+        self.graph.graph['partition'] = [set() for _ in sizes]
+        for node, colour in itertools.izip(nodes, colours):
+            self.graph.graph['partition'][colour].add(node)
+        self.d3 = True
 
 
 class Underground(BaseGraph):
+    network = 'underground'
+    sources = ('lines', 'stations')
+
     def build_graph(self):
         self.graph = nx.MultiGraph()
         with open(get('lines')) as f:
             fread = csv.reader(f)
-            for edge in fread:
-                self.graph.add_edge(edge[0], edge[1], line=edge[2])
+            self.graph.add_edges_from(
+                (edge[0], edge[1], {'line': edge[2]}) for edge in fread
+            )
 
+        # every node so far is on a line
+        connected = set(self.graph)
         with open(get('stations')) as fs:
             stations = json.load(fs)
-            for station in stations:
-                # ignore unnconnect stations
-                if station['name'] in list(
-                        chain.from_iterable(self.graph.edges())
-                ):
-                    self.graph.add_node(
-                        station['name'],
-                        name=station["name"],
-                        longitude=station["coordinates"][0],
-                        latitude=station["coordinates"][1],
-                        colour=0
-                    )
+            # ignore unnconnect stations
+            self.graph.add_nodes_from(
+                (
+                    station['name'],
+                    {
+                        'name': station["name"],
+                        'longitude': station["coordinates"][0],
+                        'latitude': station["coordinates"][1],
+                        'colour': 0
+                    }
+                )
+                for station in stations
+                if station['name'] in connected
+            )
         self.node_labels_to_ints()
 
+    @property
+    def planner(self):
+        """ journey.Planner shared by the base graph and its overlays
+        """
+        return journey.planner(self)
+
+    @instrument.timed('journey')
+    def journey(self, source, target,
+                penalty=journey.INTERCHANGE_PENALTY):
+        """ cheapest journey between two stations avoiding the removed
+        ones, see journey.Planner.journey
+        """
+        return self.planner.journey(
+            source, target, penalty, removed=self.removed
+        )
+
     @property
     def get_current_lines(self):
         return list(
@@ -0,0 +1,183 @@
+""" 2-hop hub labels for repeat route queries
+
+every node keeps the distances to a few hubs, and the next node towards
+each of them, so that the shortest path between two nodes passes through
+a hub both have in their labels (pruned landmark labelling). Labels are
+built offline and saved next to the graph data:
+
+    python -m app.hublabels network
+"""
+import argparse
+import heapq
+import json
+import logging
+import os
+import time
+
+from itertools import count
+
+import numpy as np
+
+from config import get_network_data as get
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+INF = float('inf')
+
+
+def meet(a, b):
+    """ (distance, hub) of the closest hub common to labels a and b
+    """
+    if len(a) > len(b):
+        a, b = b, a
+    best, hub = INF, None
+    for h, (d, _) in a.iteritems():
+        other = b.get(h)
+        if other is not None and d + other[0] < best:
+            best, hub = d + other[0], h
+    return best, hub
+
+
+class HubLabels(object):
+    def __init__(self, version, cost, labels):
+        self.version = version
+        self.cost = cost
+        # {node: {hub: (distance, next node towards hub)}}
+        self.labels = labels
+
+    @classmethod
+    def build(cls, gr, cost='distance'):
+        router = gr.router(cost)
+        graph = gr.graph
+        # well connected nodes make the best hubs
+        order = sorted(graph, key=lambda node: (-graph.degree(node), node))
+        labels = {node: {} for node in graph}
+
+        for hub in order:
+            hub_label = labels[hub]
+            dists = {hub: 0}
+            parents = {hub: None}
+            done = set()
+            c = count()
+            heap = [(0, next(c), hub)]
+            while heap:
+                d, _, node = heapq.heappop(heap)
+                if node in done:
+                    continue
+                done.add(node)
+                # an earlier hub already covers this pair
+                if meet(hub_label, labels[node])[0] <= d:
+                    continue
+                labels[node][hub] = (d, parents[node])
+                for nbr in graph[node]:
+                    nd = d + router.edge_cost(node, nbr)
+                    if nd < dists.get(nbr, INF):
+                        dists[nbr] = nd
+                        parents[nbr] = node
+                        heapq.heappush(heap, (nd, next(c), nbr))
+        return cls(gr.version, cost, labels)
+
+    def path_to_hub(self, node, hub):
+        path = [node]
+        while node != hub:
+            node = self.labels[node][hub][1]
+            path.append(node)
+        return path
+
+    def query(self, source, target):
+        """ (cost, path) or None when the nodes are not connected
+        """
+        cost, hub = meet(self.labels[source], self.labels[target])
+        if hub is None:
+            return None
+        return cost, (
+            self.path_to_hub(source, hub)[:-1] +
+            self.path_to_hub(target, hub)[::-1]
+        )
+
+    def save(self, path):
+        nodes = self.labels.keys()
+        index = {node: i for i, node in enumerate(nodes)}
+        offsets = np.zeros(len(nodes) + 1, dtype=np.int64)
+        hubs, dists, nexts = [], [], []
+        for i, node in enumerate(nodes):
+            for hub, (d, nxt) in self.labels[node].iteritems():
+                hubs.append(index[hub])
+                dists.append(d)
+                nexts.append(-1 if nxt is None else index[nxt])
+            offsets[i + 1] = len(hubs)
+        meta = {'version': self.version, 'cost': self.cost, 'nodes': nodes}
+        with open(path, 'wb') as f:
+            np.savez(
+                f,
+                meta=np.array(json.dumps(meta)),
+                offsets=offsets,
+                hubs=np.array(hubs, dtype=np.int32),
+                dists=np.array(dists, dtype=np.float64),
+                nexts=np.array(nexts, dtype=np.int32)
+            )
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        meta = json.loads(str(data['meta']))
+        nodes = meta['nodes']
+        offsets = data['offsets']
+        hubs = data['hubs'].tolist()
+        dists = data['dists'].tolist()
+        nexts = data['nexts'].tolist()
+        labels = {}
+        for i, node in enumerate(nodes):
+            labels[node] = {
+                nodes[hubs[j]]: (
+                    dists[j], None if nexts[j] < 0 else nodes[nexts[j]]
+                )
+                for j in xrange(offsets[i], offsets[i + 1])
+            }
+        return cls(meta['version'], meta['cost'], labels)
+
+
+def index_path(network):
+    return get('routing_%s' % network)
+
+
+def load(gr, cost='distance'):
+    """ the saved labels of gr's network if they match gr, else None
+    """
+    path = index_path(gr.network)
+    if not os.path.exists(path):
+        return None
+    labels = HubLabels.load(path)
+    if labels.version != gr.version or labels.cost != cost:
+        logger.info('%s is out of date', path)
+        return None
+    return labels
+
+
+def main(argv=None):
+    from app import utils
+
+    parser = argparse.ArgumentParser(
+        description='build hub labels for route queries'
+    )
+    parser.add_argument('networks', nargs='+', choices=['network'])
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    for network in args.networks:
+        start = time.time()
+        gr = utils.get_base_graph(network)
+        labels = HubLabels.build(gr)
+        labels.save(index_path(network))
+        logger.info(
+            '%s: %d label entries in %.1fs -> %s',
+            network,
+            sum(len(label) for label in labels.labels.itervalues()),
+            time.time() - start,
+            index_path(network)
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,230 @@
+""" timings of the hot paths and per request profiles
+
+spans around get_graph, the graph metrics and the jsonify and
+render_template calls are aggregated per process into histograms served,
+with INTERNAL_METRICS set, at /internal/metrics in the Prometheus text
+format. With PROFILE_REQUESTS set, ?profile=1 returns a cProfile listing
+of the request instead of its response and ?profile=flamegraph its
+collapsed stacks, the input of flamegraph.pl.
+
+Python 2 has no tracemalloc so allocation is counted as the growth of
+the process's peak resident memory during a span.
+"""
+import cProfile
+import functools
+import pstats
+import resource
+import sys
+import threading
+import time
+
+from collections import defaultdict
+from StringIO import StringIO
+
+import flask
+
+from flask import Response, g, request
+
+from app import app
+
+# upper bounds in seconds
+BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5, 5.,
+    10.
+)
+
+
+def peak_rss():
+    """ bytes, ru_maxrss is in kilobytes on Linux
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Histogram(object):
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.
+        self.rss = 0
+
+    def observe(self, seconds, rss=0):
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += seconds
+        self.rss += rss
+
+
+class Registry(object):
+    """ histograms keyed on (family, label value)
+    """
+    families = {
+        'span': (
+            'airports_span_seconds', 'span',
+            'Time spent in instrumented code'
+        ),
+        'request': (
+            'airports_request_seconds', 'endpoint',
+            'Time spent handling requests'
+        ),
+    }
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+
+    def observe(self, family, name, seconds, rss=0):
+        with self.lock:
+            histogram = self.histograms.get((family, name))
+            if histogram is None:
+                histogram = Histogram()
+                self.histograms[(family, name)] = histogram
+            histogram.observe(seconds, rss)
+
+    def clear(self):
+        with self.lock:
+            self.histograms.clear()
+
+    def exposition(self):
+        """ the histograms in the Prometheus text format
+        """
+        lines = []
+        with self.lock:
+            for family in sorted(self.families):
+                metric, label, text = self.families[family]
+                names = sorted(
+                    name for f, name in self.histograms if f == family
+                )
+                lines.append('# HELP %s %s' % (metric, text))
+                lines.append('# TYPE %s histogram' % metric)
+                for name in names:
+                    h = self.histograms[(family, name)]
+                    labels = '%s="%s"' % (label, name)
+                    total = 0
+                    for bound, count in zip(h.buckets, h.counts):
+                        total += count
+                        lines.append('%s_bucket{%s,le="%s"} %d' % (
+                            metric, labels, bound, total
+                        ))
+                    lines.append('%s_bucket{%s,le="+Inf"} %d' % (
+                        metric, labels, h.count
+                    ))
+                    lines.append('%s_sum{%s} %r' % (metric, labels, h.sum))
+                    lines.append('%s_count{%s} %d' % (
+                        metric, labels, h.count
+                    ))
+                rss = metric.replace('_seconds', '_rss_growth_bytes_total')
+                lines.append(
+                    '# HELP %s Growth of the peak resident memory' % rss
+                )
+                lines.append('# TYPE %s counter' % rss)
+                for name in names:
+                    lines.append('%s{%s="%s"} %d' % (
+                        rss, label, name,
+                        self.histograms[(family, name)].rss
+                    ))
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+def timed(name):
+    """ decorator recording each call of the function as a span
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            rss = peak_rss()
+            start = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                registry.observe(
+                    'span', name, time.time() - start, peak_rss() - rss
+                )
+        return wrapper
+    return decorator
+
+
+jsonify = timed('jsonify')(flask.jsonify)
+render_template = timed('render_template')(flask.render_template)
+
+
+class StackProfiler(object):
+    """ seconds spent in each call stack, as collapsed stacks
+    """
+    def __init__(self):
+        self.stacks = defaultdict(float)
+        self.stack = []
+        self.last = None
+
+    def trace(self, frame, event, arg):
+        now = time.time()
+        if self.stack:
+            self.stacks[tuple(self.stack)] += now - self.last
+        if event == 'call':
+            code = frame.f_code
+            self.stack.append('%s (%s:%d)' % (
+                code.co_name, code.co_filename, code.co_firstlineno
+            ))
+        elif event == 'c_call':
+            self.stack.append(getattr(arg, '__name__', repr(arg)))
+        elif self.stack:
+            # returns of frames entered before the profile started are
+            # ignored
+            self.stack.pop()
+        self.last = now
+
+    def enable(self):
+        self.last = time.time()
+        sys.setprofile(self.trace)
+
+    def disable(self):
+        sys.setprofile(None)
+
+    def collapsed(self):
+        return ''.join(
+            '%s %d\n' % (';'.join(stack), seconds * 1e6)
+            for stack, seconds in sorted(self.stacks.iteritems())
+            if seconds * 1e6 >= 1
+        )
+
+
+@app.before_request
+def start_request():
+    g.request_start = time.time()
+    g.profiler = None
+    mode = request.args.get('profile')
+    if mode and app.config.get('PROFILE_REQUESTS'):
+        if mode == 'flamegraph':
+            g.profiler = StackProfiler()
+        else:
+            g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+
+@app.after_request
+def finish_request(response):
+    profiler = getattr(g, 'profiler', None)
+    if profiler is not None:
+        if response.is_streamed:
+            # the body is made as it is sent, profile making it too
+            response.get_data()
+        profiler.disable()
+        if isinstance(profiler, StackProfiler):
+            return Response(profiler.collapsed(), mimetype='text/plain')
+        out = StringIO()
+        stats = pstats.Stats(profiler, stream=out)
+        stats.sort_stats('cumulative').print_stats(50)
+        return Response(out.getvalue(), mimetype='text/plain')
+
+    start = getattr(g, 'request_start', None)
+    if start is not None:
+        registry.observe(
+            'request', request.endpoint or 'unmatched', time.time() - start
+        )
+    return response
@@ -0,0 +1,158 @@
+""" page metrics computed in a background process pool
+
+with BACKGROUND_METRICS set a handler never computes a metric itself: it
+gets the cached value for its graph version or, while a job computes that
+in the pool, the latest value of the same network (stale while
+revalidate). The front end polls /jobs/<id> for the pending jobs.
+
+jobs live in the process that submitted them, so polling needs a single
+server worker or sticky sessions, other workers answer 404.
+"""
+import logging
+import multiprocessing
+import threading
+import time
+import uuid
+
+from app.cache import LRUCache
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+def run(network, removed, metric, limit, version):
+    """ a metric of the network without the removed nodes, in a worker
+
+    the worker builds the network itself, which must be the graph of
+    version the handler asked about and not, say, another random one
+
+    returns (ok, value or error message)
+    """
+    from app import utils
+
+    try:
+        gr = utils.get_base_graph(network).without(removed)
+        if gr.version != version:
+            return False, 'graph version %s is not %s' % (
+                gr.version, version
+            )
+        return True, utils.compute_metric(gr, network, metric, limit)
+    except Exception as e:
+        return False, '%s: %s' % (e.__class__.__name__, e)
+
+
+class Job(object):
+    def __init__(self, network, metric):
+        # unique across workers, another one's job is never answered
+        self.id = uuid.uuid4().hex
+        self.network = network
+        self.metric = metric
+        self.state = 'running'
+        self.submitted = time.time()
+        self.finished = None
+        self.error = None
+
+    def as_dict(self):
+        return {
+            'id': self.id,
+            'network': self.network,
+            'metric': self.metric,
+            'state': self.state,
+            'submitted': self.submitted,
+            'finished': self.finished,
+            'error': self.error
+        }
+
+
+class JobManager(object):
+    """ metric values keyed on (graph version, metric, limit) and the
+    jobs computing them
+    """
+    def __init__(self, processes=None, maxsize=256):
+        self.processes = processes
+        self.pool = None
+        self.lock = threading.RLock()
+        self.jobs = LRUCache(maxsize)
+        self.results = LRUCache(maxsize)
+        # the key of the latest value per (network, metric, limit)
+        self.latest = {}
+        # job per result key while it is running
+        self.pending = {}
+        # failed jobs aren't retried, eigenvector centrality may never
+        # converge for a graph
+        self.failures = LRUCache(maxsize)
+
+    def start(self):
+        with self.lock:
+            if self.pool is None:
+                self.pool = multiprocessing.Pool(self.processes)
+        return self.pool
+
+    def stop(self):
+        with self.lock:
+            if self.pool is not None:
+                self.pool.terminate()
+                self.pool.join()
+                self.pool = None
+            self.pending.clear()
+
+    def submit(self, gr, network, metric, limit):
+        key = (gr.version, metric, limit)
+        with self.lock:
+            job = self.pending.get(key)
+            if job is not None:
+                return job
+            job = Job(network, metric)
+            self.jobs.set(job.id, job)
+            self.pending[key] = job
+
+        def done(result):
+            self.finish(key, job, result)
+        self.start().apply_async(
+            run,
+            (network, sorted(gr.removed), metric, limit, gr.version),
+            callback=done
+        )
+        return job
+
+    def finish(self, key, job, result):
+        ok, value = result
+        with self.lock:
+            self.pending.pop(key, None)
+            job.finished = time.time()
+            if ok:
+                job.state = 'done'
+                self.results.set(key, value)
+                self.latest[(job.network,) + key[1:]] = key
+            else:
+                job.state = 'failed'
+                job.error = value
+                self.failures.set(key, job)
+                logger.warning('job %s failed: %s', job.id, value)
+
+    def get(self, gr, network, metric, limit=5, default=None):
+        """ (value, job) of a metric of gr
+
+        job is None when the value is gr's own, otherwise it is the job
+        computing that and the value is the latest of the network, or
+        default when there isn't one yet
+        """
+        key = (gr.version, metric, limit)
+        value = self.results.get(key)
+        if value is not None:
+            return value, None
+        if key in self.failures:
+            return default, None
+        # read before submitting, a quick job could otherwise replace it
+        # with gr's own value before this returns
+        stale = self.latest.get((network, metric, limit))
+        if stale is not None:
+            value = self.results.get(stale)
+        job = self.submit(gr, network, metric, limit)
+        return (default if value is None else value), job
+
+    def status(self, job_id):
+        return self.jobs.get(job_id)
+
+
+manager = JobManager()
@@ -0,0 +1,140 @@
+""" Underground journeys between stations
+
+the line MultiGraph is expanded once per base graph into a state graph
+of (station, line) pairs: riding a line one stop is an edge between the
+states of the two stations on that line and changing line an edge
+between two states of one station. A journey is the cheapest path in
+stops plus a penalty per change, searched with Dijkstra over a binary
+heap. Overlays skip the states of their removed stations rather than
+building a state graph of their own.
+"""
+import heapq
+
+from itertools import count
+
+from app.cache import LRUCache
+from app.routing import NoRoute
+
+# stops a change of line is worth
+INTERCHANGE_PENALTY = 3
+
+# planners keyed on base graph version
+planners = LRUCache(maxsize=8)
+
+
+class Planner(object):
+    """ journey searches on one base graph
+    """
+    def __init__(self, graph):
+        self.states = []
+        # state ids of each station
+        self.stations = {}
+        for u, v, line in graph.edges_iter(data='line'):
+            for node in (u, v):
+                lines = self.stations.setdefault(node, {})
+                if line not in lines:
+                    lines[line] = len(self.states)
+                    self.states.append((node, line))
+        self.rides = [[] for _ in self.states]
+        for u, v, line in graph.edges_iter(data='line'):
+            if u == v:
+                continue
+            a, b = self.stations[u][line], self.stations[v][line]
+            self.rides[a].append(b)
+            self.rides[b].append(a)
+        self.names = {
+            data['name']: node
+            for node, data in graph.nodes_iter(data=True) if 'name' in data
+        }
+        self.labels = {
+            node: name for name, node in self.names.iteritems()
+        }
+
+    def resolve(self, station):
+        """ node of a station name or id, None if there is neither
+        """
+        if station in self.stations:
+            return station
+        if station in self.names:
+            return self.names[station]
+        try:
+            station = int(station)
+        except (TypeError, ValueError):
+            return None
+        return station if station in self.stations else None
+
+    def search(self, source, target, penalty=INTERCHANGE_PENALTY,
+               removed=()):
+        """ (cost, [state ids]) of the cheapest journey
+        """
+        if source in removed or target in removed:
+            raise NoRoute
+        c = count()
+        costs = {}
+        parents = {}
+        heap = []
+        for state in self.stations[source].itervalues():
+            costs[state] = 0
+            parents[state] = None
+            heap.append((0, next(c), state))
+        heapq.heapify(heap)
+        done = set()
+        while heap:
+            cost, _, state = heapq.heappop(heap)
+            if state in done:
+                continue
+            done.add(state)
+            station, line = self.states[state]
+            if station == target:
+                path = []
+                while state is not None:
+                    path.append(state)
+                    state = parents[state]
+                return cost, path[::-1]
+            steps = [(nbr, 1) for nbr in self.rides[state]]
+            steps.extend(
+                (other, penalty)
+                for other in self.stations[station].itervalues()
+                if other != state
+            )
+            for nbr, step in steps:
+                if nbr in done or self.states[nbr][0] in removed:
+                    continue
+                ncost = cost + step
+                if ncost < costs.get(nbr, float('inf')):
+                    costs[nbr] = ncost
+                    parents[nbr] = state
+                    heapq.heappush(heap, (ncost, next(c), nbr))
+        raise NoRoute
+
+    def journey(self, source, target, penalty=INTERCHANGE_PENALTY,
+                removed=()):
+        """ {stops, changes, cost, legs} of the cheapest journey, legs
+        being the stations ridden on each line
+        """
+        cost, path = self.search(source, target, penalty, removed)
+        legs = []
+        for state in path:
+            station, line = self.states[state]
+            name = self.labels.get(station, station)
+            if legs and legs[-1]['line'] == line:
+                legs[-1]['stations'].append(name)
+            else:
+                # a change starts the next leg where the last one ended
+                legs.append({'line': line, 'stations': [name]})
+        return {
+            'stops': sum(len(leg['stations']) - 1 for leg in legs),
+            'changes': len(legs) - 1,
+            'cost': cost,
+            'legs': legs,
+        }
+
+
+def planner(gr):
+    """ the Planner of gr's base graph
+    """
+    base = gr.base or gr
+    result = planners.get(base.version)
+    if result is None:
+        result = planners.set(base.version, Planner(base.graph))
+    return result
@@ -0,0 +1,76 @@
+""" server side force directed layout
+
+a vectorised Fruchterman-Reingold spring layout, computed once per graph
+version so browsers don't have to run the force simulation themselves
+"""
+from __future__ import division
+
+import numpy as np
+
+from app.cache import LRUCache
+
+# layouts keyed on (graph version, iterations)
+layouts = LRUCache(maxsize=16)
+
+
+def fruchterman_reingold(N, edges, iterations=50, seed=0, chunk=512):
+    """ (N, 2) positions in the unit square for nodes 0..N-1 joined by
+    an (E, 2) array of edges
+    """
+    rng = np.random.RandomState(seed)
+    pos = rng.rand(N, 2)
+    if N < 2:
+        return pos
+    edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+    # optimal distance between nodes
+    k = np.sqrt(1. / N)
+    t = 0.1
+    dt = t / (iterations + 1)
+
+    for _ in xrange(iterations):
+        disp = np.zeros((N, 2))
+        # every node pushes every other away with k^2 / d, done in row
+        # chunks to bound the N x N block
+        for start in xrange(0, N, chunk):
+            delta = pos[start:start + chunk, None, :] - pos[None, :, :]
+            dist2 = np.maximum((delta ** 2).sum(axis=2), 1e-4)
+            disp[start:start + chunk] = (
+                delta * (k * k / dist2)[:, :, None]
+            ).sum(axis=1)
+
+        # edges pull their ends together with d^2 / k
+        if len(edges):
+            delta = pos[edges[:, 0]] - pos[edges[:, 1]]
+            dist = np.sqrt((delta ** 2).sum(axis=1))[:, None]
+            force = delta * dist / k
+            np.add.at(disp, edges[:, 0], -force)
+            np.add.at(disp, edges[:, 1], force)
+
+        # move each node by at most the temperature
+        length = np.maximum(np.sqrt((disp ** 2).sum(axis=1)), 1e-9)
+        pos += disp * (np.minimum(length, t) / length)[:, None]
+        t -= dt
+
+    pos -= pos.min(axis=0)
+    scale = pos.max(axis=0)
+    scale[scale == 0] = 1.
+    return pos / scale
+
+
+def spring_layout(gr, iterations=50):
+    """ {node: (x, y)} in the unit square, cached per graph version
+    """
+    key = (gr.version, iterations)
+    layout = layouts.get(key)
+    if layout is None:
+        nodes = gr.graph.nodes()
+        index = {node: i for i, node in enumerate(nodes)}
+        pos = fruchterman_reingold(
+            len(nodes),
+            [(index[u], index[v]) for u, v in gr.graph.edges_iter()],
+            iterations
+        )
+        layout = layouts.set(key, {
+            node: (float(x), float(y)) for node, (x, y) in zip(nodes, pos)
+        })
+    return layout
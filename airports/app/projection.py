@@ -0,0 +1,168 @@
+""" map projections of node coordinates done on the server
+
+the same projections, with the same parameters, as the d3 ones the vega
+geo transform uses in the browser, vectorised over every node of a base
+graph and cached per version so a map's points arrive already placed.
+Points albersUsa has no place for are NaN.
+"""
+from __future__ import division
+
+import numpy as np
+
+from app.cache import LRUCache
+
+# (x, y) arrays keyed on (graph version, projection, scale, translate)
+projected = LRUCache(maxsize=32)
+
+# d3's epsilon, the insets' extents are shrunk by it
+EPSILON = 1e-6
+
+
+def conic_equal_area(phi0, phi1):
+    """ d3.geo.conicEqualArea's raw projection for standard parallels
+    in radians
+    """
+    sin0 = np.sin(phi0)
+    n = (sin0 + np.sin(phi1)) / 2
+    C = 1 + sin0 * (2 * n - sin0)
+    rho0 = np.sqrt(C) / n
+
+    def forward(lam, phi):
+        rho = np.sqrt(C - 2 * n * np.sin(phi)) / n
+        return rho * np.sin(lam * n), rho0 - rho * np.cos(lam * n)
+    return forward
+
+
+def mercator_raw(lam, phi):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return lam, np.log(np.tan(np.pi / 4 + phi / 2))
+
+
+def projector(raw, scale, translate, rotate=0., center=(0., 0.)):
+    """ a d3 v3 projection of a raw one, taking degrees to pixels
+    """
+    k = scale
+    cx, cy = raw(*np.radians(center))
+    dx = translate[0] - cx * k
+    dy = translate[1] + cy * k
+
+    def project(lon, lat):
+        lam = np.radians(lon + rotate)
+        lam = np.where(
+            lam > np.pi, lam - 2 * np.pi,
+            np.where(lam < -np.pi, lam + 2 * np.pi, lam)
+        )
+        x, y = raw(lam, np.radians(lat))
+        return x * k + dx, dy - y * k
+    return project
+
+
+def mercator(lon, lat, scale=150., translate=(480., 250.)):
+    return projector(mercator_raw, scale, translate)(lon, lat)
+
+
+def albers_usa(lon, lat, scale=1070., translate=(480., 250.)):
+    """ d3.geo.albersUsa, the lower 48 with Alaska and Hawaii insets
+    """
+    k = scale
+    x, y = translate
+    insets = [
+        # (projection, clip extent)
+        (
+            projector(
+                conic_equal_area(*np.radians([29.5, 45.5])), k, translate,
+                rotate=96., center=(-.6, 38.7)
+            ),
+            (x - .455 * k, y - .238 * k, x + .455 * k, y + .238 * k)
+        ),
+        (
+            projector(
+                conic_equal_area(*np.radians([55., 65.])), k * .35,
+                (x - .307 * k, y + .201 * k), rotate=154.,
+                center=(-2., 58.5)
+            ),
+            (
+                x - .425 * k + EPSILON, y + .120 * k + EPSILON,
+                x - .214 * k - EPSILON, y + .234 * k - EPSILON
+            )
+        ),
+        (
+            projector(
+                conic_equal_area(*np.radians([8., 18.])), k,
+                (x - .205 * k, y + .212 * k), rotate=157.,
+                center=(-3., 19.9)
+            ),
+            (
+                x - .214 * k + EPSILON, y + .166 * k + EPSILON,
+                x - .115 * k - EPSILON, y + .234 * k - EPSILON
+            )
+        ),
+    ]
+
+    px = np.full(len(lon), np.nan)
+    py = np.full(len(lon), np.nan)
+    todo = np.ones(len(lon), dtype=bool)
+    for project, (x0, y0, x1, y1) in insets:
+        with np.errstate(invalid='ignore'):
+            ix, iy = project(lon, lat)
+            inside = todo & (ix >= x0) & (ix <= x1) & (iy >= y0) & (iy <= y1)
+        px[inside] = ix[inside]
+        py[inside] = iy[inside]
+        todo &= ~inside
+    return px, py
+
+
+PROJECTIONS = {
+    'albersUsa': albers_usa,
+    'mercator': mercator,
+}
+
+
+def parse(name, scale=None, translate=None):
+    """ (name, scale, (x, y)) of query arguments, d3's defaults for
+    those not given
+
+    raises ValueError for anything else, scales must be finite and
+    positive and translates two finite numbers
+    """
+    if name not in PROJECTIONS:
+        raise ValueError('unknown projection %s' % (name,))
+    if scale is None:
+        scale = 1070. if name == 'albersUsa' else 150.
+    scale = float(scale)
+    if not (np.isfinite(scale) and scale > 0):
+        raise ValueError('bad scale %s' % (scale,))
+    if translate is None:
+        translate = (480., 250.)
+    else:
+        parts = translate.split(',')
+        if len(parts) != 2:
+            raise ValueError('bad translate %s' % (translate,))
+        translate = tuple(float(t) for t in parts)
+        if not np.isfinite(translate).all():
+            raise ValueError('bad translate %s' % (translate,))
+    return name, scale, translate
+
+
+def project(index, name, scale, translate):
+    """ (x, y) arrays of a spatial.SpatialIndex's nodes
+    """
+    return PROJECTIONS[name](
+        index.lon, index.lat, scale=scale, translate=translate
+    )
+
+
+def thin(x, y, priority, resolution):
+    """ indices of the points to draw, the highest priority one in each
+    resolution pixel square
+    """
+    order = np.argsort(-priority, kind='mergesort')
+    cells = np.column_stack([
+        np.floor(x[order] / resolution), np.floor(y[order] / resolution)
+    ])
+    # np.unique keeps the first, highest priority, point of each cell
+    _, first = np.unique(
+        cells.view([('x', cells.dtype), ('y', cells.dtype)]).ravel(),
+        return_index=True
+    )
+    return np.sort(order[first])
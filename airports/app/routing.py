@@ -0,0 +1,268 @@
+""" weighted route search between two nodes
+
+edge costs are the great circle distance between the two ends, the edge
+weight or one per hop. Distance searches use A* with the great circle
+distance to the destination as the heuristic. Edges with an end without
+coordinates cost the mean length of the others instead, and as that is
+no lower bound the heuristic is then dropped.
+"""
+import heapq
+import logging
+import math
+
+from itertools import count
+
+from app.cache import LRUCache
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+EARTH_RADIUS = 6371.0
+# most paths the k shortest paths search returns
+MAX_K = 10
+COSTS = ('distance', 'weight', 'hops')
+ALGORITHMS = ('astar', 'bidirectional', 'labels')
+
+# routers keyed on (graph version, cost)
+routers = LRUCache(maxsize=32)
+
+
+def great_circle(a, b):
+    """ km between two (latitude, longitude) pairs in radians
+    """
+    dlat = b[0] - a[0]
+    dlon = b[1] - a[1]
+    h = (
+        math.sin(dlat / 2) ** 2 +
+        math.cos(a[0]) * math.cos(b[0]) * math.sin(dlon / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS * math.asin(min(1., math.sqrt(h)))
+
+
+class NoRoute(Exception):
+    pass
+
+
+class Router(object):
+    """ route searches on one graph version
+
+    labels are the hub labels of the base graph, they answer queries
+    directly unless the path they give goes through a removed node
+    """
+    def __init__(self, graph, coordinates, cost='distance', labels=None,
+                 removed=()):
+        if cost not in COSTS:
+            raise ValueError('unknown cost %s' % cost)
+        self.graph = graph
+        self.cost = cost
+        self.labels = labels
+        self.removed = removed
+        self.coords = {
+            node: (math.radians(lat), math.radians(lon))
+            for node, (lat, lon) in coordinates.iteritems()
+        }
+        # km of an edge with an end without coordinates, None if there
+        # are none
+        self.fallback = None
+        if cost == 'distance':
+            missing = sum(1 for node in graph if node not in self.coords)
+            if missing:
+                lengths = [
+                    great_circle(self.coords[u], self.coords[v])
+                    for u, v in graph.edges_iter()
+                    if u in self.coords and v in self.coords
+                ]
+                self.fallback = (
+                    sum(lengths) / len(lengths) if lengths else 1.
+                )
+                logger.warning(
+                    '%d of %d nodes have no coordinates, their edges '
+                    'cost %.1f km', missing, len(graph), self.fallback
+                )
+
+    def edge_cost(self, u, v):
+        if self.cost == 'distance':
+            if u in self.coords and v in self.coords:
+                return great_circle(self.coords[u], self.coords[v])
+            return self.fallback
+        if self.cost == 'weight':
+            return self.graph[u][v].get('weight', 1)
+        return 1
+
+    def heuristic(self, node, target):
+        if self.cost == 'distance' and self.fallback is None:
+            return great_circle(self.coords[node], self.coords[target])
+        return 0
+
+    def path_cost(self, path):
+        return sum(self.edge_cost(u, v) for u, v in zip(path, path[1:]))
+
+    def astar(self, source, target, max_hops=None, banned_nodes=(),
+              banned_edges=()):
+        """ (cost, path) of the cheapest path with at most max_hops
+        edges, avoiding the banned nodes and (u, v) edges
+        """
+        if source in banned_nodes:
+            raise NoRoute
+        # with a hop limit a node reached in fewer hops is a different
+        # state, it may still reach the target where a cheaper one can't
+
+        def state(node, hops):
+            return (node, hops) if max_hops is not None else node
+
+        c = count()
+        heap = [(self.heuristic(source, target), next(c), 0, source, 0)]
+        parents = {state(source, 0): None}
+        costs = {state(source, 0): 0}
+        done = set()
+        while heap:
+            _, _, cost, node, hops = heapq.heappop(heap)
+            key = state(node, hops)
+            if key in done:
+                continue
+            done.add(key)
+            if node == target:
+                path = []
+                while key is not None:
+                    path.append(key[0] if max_hops is not None else key)
+                    key = parents[key]
+                return cost, path[::-1]
+            if max_hops is not None and hops >= max_hops:
+                continue
+            for nbr in self.graph[node]:
+                if nbr in banned_nodes or (node, nbr) in banned_edges:
+                    continue
+                nkey = state(nbr, hops + 1)
+                ncost = cost + self.edge_cost(node, nbr)
+                if nkey in done or ncost >= costs.get(nkey, float('inf')):
+                    continue
+                costs[nkey] = ncost
+                parents[nkey] = key
+                heapq.heappush(heap, (
+                    ncost + self.heuristic(nbr, target),
+                    next(c), ncost, nbr, hops + 1
+                ))
+        raise NoRoute
+
+    def bidirectional(self, source, target):
+        """ (cost, path) from Dijkstra searches grown from both ends
+        """
+        if source == target:
+            return 0, [source]
+        dists = [{source: 0}, {target: 0}]
+        parents = [{source: None}, {target: None}]
+        done = [set(), set()]
+        c = count()
+        heaps = [[(0, next(c), source)], [(0, next(c), target)]]
+        best, meet = float('inf'), None
+
+        while heaps[0] and heaps[1]:
+            if heaps[0][0][0] + heaps[1][0][0] >= best:
+                break
+            side = 0 if heaps[0][0][0] <= heaps[1][0][0] else 1
+            cost, _, node = heapq.heappop(heaps[side])
+            if node in done[side]:
+                continue
+            done[side].add(node)
+            for nbr in self.graph[node]:
+                ncost = cost + self.edge_cost(node, nbr)
+                if ncost < dists[side].get(nbr, float('inf')):
+                    dists[side][nbr] = ncost
+                    parents[side][nbr] = node
+                    heapq.heappush(heaps[side], (ncost, next(c), nbr))
+                if nbr in dists[1 - side]:
+                    total = dists[side][nbr] + dists[1 - side][nbr]
+                    if total < best:
+                        best, meet = total, nbr
+
+        if meet is None:
+            raise NoRoute
+        path = []
+        node = meet
+        while node is not None:
+            path.append(node)
+            node = parents[0][node]
+        path.reverse()
+        node = parents[1][meet]
+        while node is not None:
+            path.append(node)
+            node = parents[1][node]
+        return best, path
+
+    def k_shortest(self, source, target, k=1, max_hops=None):
+        """ up to k loopless paths in order of cost, Yen's algorithm
+        """
+        k = max(1, min(k, MAX_K))
+        try:
+            paths = [self.astar(source, target, max_hops)]
+        except NoRoute:
+            return []
+        candidates = []
+        seen = set([tuple(paths[0][1])])
+        c = count()
+
+        while len(paths) < k:
+            last = paths[-1][1]
+            for i in xrange(len(last) - 1):
+                root = last[:i + 1]
+                banned_edges = set()
+                for _, path in paths:
+                    if path[:i + 1] == root:
+                        banned_edges.add((path[i], path[i + 1]))
+                        banned_edges.add((path[i + 1], path[i]))
+                hops = None
+                if max_hops is not None:
+                    hops = max_hops - i
+                try:
+                    _, spur = self.astar(
+                        root[-1], target, hops,
+                        banned_nodes=set(root[:-1]),
+                        banned_edges=banned_edges
+                    )
+                except NoRoute:
+                    continue
+                path = root[:-1] + spur
+                if tuple(path) not in seen:
+                    seen.add(tuple(path))
+                    heapq.heappush(
+                        candidates, (self.path_cost(path), next(c), path)
+                    )
+            if not candidates:
+                break
+            cost, _, path = heapq.heappop(candidates)
+            paths.append((cost, path))
+        return paths
+
+    def labelled(self, source, target):
+        """ (cost, path) from the hub labels, None when they can't tell
+        """
+        if self.labels is None:
+            return None
+        route = self.labels.query(source, target)
+        if route is None:
+            # not connected in the base graph so not connected now
+            raise NoRoute
+        if self.removed and not self.removed.isdisjoint(route[1]):
+            return None
+        return route
+
+    def routes(self, source, target, k=1, max_hops=None, algorithm=None):
+        """ list of (cost, path), the cheapest first
+
+        algorithm None uses the hub labels when there are some and A*
+        otherwise
+        """
+        if algorithm is not None and algorithm not in ALGORITHMS:
+            raise ValueError('unknown algorithm %s' % algorithm)
+        if k > 1:
+            return self.k_shortest(source, target, k, max_hops)
+        try:
+            if algorithm in (None, 'labels') and max_hops is None:
+                route = self.labelled(source, target)
+                if route is not None:
+                    return [route]
+            if algorithm == 'bidirectional' and max_hops is None:
+                return [self.bidirectional(source, target)]
+            return [self.astar(source, target, max_hops)]
+        except NoRoute:
+            return []
@@ -0,0 +1,187 @@
+""" efficiency, closeness and betweenness estimated from a sample of
+breadth first search sources
+
+on an undirected graph a node's sum of 1/d over every other node is also
+the sum over every source of 1/d to it, and its betweenness the sum of
+each source's Brandes dependency on it, so k sources drawn at random give
+unbiased estimates of all three. Each source contributes a value in
+[0, 1] per node, so by Hoeffding's inequality the mean of k of them is
+within sqrt(ln(2n/delta)/2k) of the mean over all n sources for every
+node at once with confidence 1 - delta.
+"""
+from __future__ import division
+
+import math
+import time
+
+from collections import deque
+
+import numpy as np
+
+from app.cache import LRUCache
+from app.centrality import Ranking
+
+# estimates keyed on (graph version, epsilon, confidence, budget, seed)
+estimates = LRUCache(maxsize=16)
+
+
+def hoeffding(samples, confidence, tests=1):
+    """ half width of the interval around a mean of samples values in
+    [0, 1] holding for tests means at once with confidence
+    """
+    return math.sqrt(
+        math.log(2 * tests / (1 - confidence)) / (2 * samples)
+    )
+
+
+def sample_size(epsilon, confidence, n):
+    """ sources needed for every per node estimate of n nodes to be
+    within epsilon
+    """
+    return min(n, int(math.ceil(
+        math.log(2 * n / (1 - confidence)) / (2 * epsilon ** 2)
+    )))
+
+
+class Estimate(object):
+    """ per node efficiency, closeness and betweenness from samples of
+    n sources, with the error bounds achieved
+
+    efficiency is as calculate_global_efficiencies, summing to the global
+    efficiency, closeness the harmonic closeness 1/(n-1) sum 1/d and
+    betweenness normalised as networkx's
+    """
+    def __init__(self, efficiencies, closeness, betweenness, samples, n,
+                 confidence, bounds):
+        self.efficiencies = efficiencies
+        self.closeness = closeness
+        self.betweenness = betweenness
+        self.samples = samples
+        self.n = n
+        self.confidence = confidence
+        self.bounds = bounds
+
+    @property
+    def exact(self):
+        return self.samples >= self.n
+
+    @property
+    def global_efficiency(self):
+        return sum(self.efficiencies.itervalues())
+
+    def as_dict(self, limit=None):
+        """ the estimate with the top limit nodes of each metric
+        """
+        return {
+            'global_efficiency': self.global_efficiency,
+            'samples': self.samples,
+            'nodes': self.n,
+            'exact': self.exact,
+            'confidence': self.confidence,
+            'bounds': self.bounds,
+            'efficiency': Ranking(self.efficiencies).top(limit),
+            'closeness': Ranking(self.closeness).top(limit),
+            'betweenness': Ranking(self.betweenness).top(limit),
+        }
+
+
+def accumulate(graph, index, source, inverse, dependency):
+    """ add source's 1/d and Brandes dependencies to every node it
+    reaches
+    """
+    dist = {source: 0}
+    sigma = {source: 1.}
+    preds = {source: []}
+    order = []
+    queue = deque([source])
+    while queue:
+        v = queue.popleft()
+        order.append(v)
+        for w in graph[v]:
+            if w not in dist:
+                dist[w] = dist[v] + 1
+                sigma[w] = 0.
+                preds[w] = []
+                queue.append(w)
+            if dist[w] == dist[v] + 1:
+                sigma[w] += sigma[v]
+                preds[w].append(v)
+
+    delta = dict.fromkeys(order, 0.)
+    for w in reversed(order):
+        for v in preds[w]:
+            delta[v] += sigma[v] / sigma[w] * (1 + delta[w])
+        if w != source:
+            i = index[w]
+            inverse[i] += 1. / dist[w]
+            dependency[i] += delta[w]
+
+
+def estimate(gr, epsilon=None, confidence=0.95, budget=None, seed=None):
+    """ Estimate of gr from enough sources for epsilon, or as many as
+    budget seconds allow, whichever comes first
+
+    with neither, epsilon is 0.1
+    """
+    if epsilon is None and budget is None:
+        epsilon = 0.1
+    nodes = gr.graph.nodes()
+    n = len(nodes)
+    index = {node: i for i, node in enumerate(nodes)}
+    k = n if epsilon is None else sample_size(epsilon, confidence, n)
+
+    rng = np.random.RandomState(seed)
+    inverse = np.zeros(n)
+    dependency = np.zeros(n)
+    deadline = budget and time.time() + budget
+    samples = 0
+    for i in rng.permutation(n)[:k]:
+        accumulate(gr.graph, index, nodes[i], inverse, dependency)
+        samples += 1
+        if deadline and time.time() > deadline:
+            break
+
+    if samples == 0 or n < 2:
+        zeros = dict.fromkeys(nodes, 0.)
+        return Estimate(zeros, dict(zeros), dict(zeros), samples, n,
+                        confidence, {})
+
+    # per source means of values in [0, 1], scaled
+    closeness = inverse / samples * n / (n - 1)
+    efficiencies = closeness / n
+    if n > 2:
+        betweenness = dependency / samples / (n - 2) * n / (n - 1)
+    else:
+        betweenness = np.zeros(n)
+
+    if samples >= n:
+        bounds = dict.fromkeys(
+            ('global_efficiency', 'efficiency', 'closeness', 'betweenness'),
+            0.
+        )
+    else:
+        node = hoeffding(samples, confidence, n) * n / (n - 1)
+        bounds = {
+            'global_efficiency': hoeffding(samples, confidence),
+            'efficiency': node / n,
+            'closeness': node,
+            'betweenness': node,
+        }
+    return Estimate(
+        dict(zip(nodes, efficiencies.tolist())),
+        dict(zip(nodes, closeness.tolist())),
+        dict(zip(nodes, betweenness.tolist())),
+        samples, n, confidence, bounds
+    )
+
+
+def cached(gr, epsilon=None, confidence=0.95, budget=None, seed=None):
+    """ estimate cached per graph version and parameters
+    """
+    key = (gr.version, epsilon, confidence, budget, seed)
+    result = estimates.get(key)
+    if result is None:
+        result = estimates.set(
+            key, estimate(gr, epsilon, confidence, budget, seed)
+        )
+    return result
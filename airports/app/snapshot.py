@@ -0,0 +1,306 @@
+""" pre-built binary snapshots of the airport and underground graphs
+
+a snapshot is a directory of .npy arrays, the edge list, node and edge
+attribute columns and a string table, that workers memory map instead of
+parsing the csv and json sources. Snapshots remember the size, mtime
+and a hash of their sources and are ignored once the sources change, the
+hash is only read when a size or mtime differs. Compile them with:
+
+    python -m app.snapshot network underground
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+from itertools import izip
+
+import networkx as nx
+import numpy as np
+
+from config import get_network_data as get
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# bump when the layout of a snapshot changes
+FORMAT = 1
+
+KINDS = [
+    (bool, 'int'),
+    ((int, long), 'int'),
+    (float, 'float'),
+    (str, 'bytes'),
+    (unicode, 'text'),
+]
+
+
+def kind_of(value):
+    for types, kind in KINDS:
+        if isinstance(value, types):
+            return kind
+    raise ValueError('can not snapshot %r' % (value,))
+
+
+class StringTable(object):
+    """ every string of a snapshot stored once as utf-8
+    """
+    def __init__(self, strings=None):
+        self.strings = strings or []
+        self.ids = {s: i for i, s in enumerate(self.strings)}
+
+    def id(self, s):
+        if isinstance(s, unicode):
+            s = s.encode('utf-8')
+        if s not in self.ids:
+            self.ids[s] = len(self.strings)
+            self.strings.append(s)
+        return self.ids[s]
+
+    def arrays(self):
+        lengths = [len(s) for s in self.strings]
+        offsets = np.zeros(len(self.strings) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(lengths)
+        blob = np.frombuffer(
+            ''.join(self.strings) or '\0', dtype=np.uint8
+        )
+        return blob, offsets
+
+    @classmethod
+    def from_arrays(cls, blob, offsets):
+        data = blob.tostring()
+        offsets = np.asarray(offsets).tolist()
+        return cls([
+            data[start:end] for start, end in izip(offsets, offsets[1:])
+        ])
+
+
+def encode(values, strings):
+    """ (kind, array) for a column of values, None is missing
+    """
+    kinds = set(kind_of(value) for value in values if value is not None)
+    if len(kinds) > 1:
+        raise ValueError('column has kinds %s' % sorted(kinds))
+    kind = kinds.pop() if kinds else 'float'
+
+    if kind in ('int', 'float'):
+        column = np.array(
+            [np.nan if value is None else value for value in values],
+            dtype=np.float64
+        )
+    else:
+        column = np.array(
+            [
+                -1 if value is None else strings.id(value)
+                for value in values
+            ],
+            dtype=np.int32
+        )
+    return kind, column
+
+
+def decode(kind, column, strings):
+    """ the values of an encoded column, converted a whole array at a
+    time rather than an element at a time
+    """
+    column = np.asarray(column)
+    if kind in ('int', 'float'):
+        missing = np.isnan(column)
+        if kind == 'int':
+            values = np.where(missing, 0, column).astype(np.int64).tolist()
+        else:
+            values = column.tolist()
+        if missing.any():
+            for i in np.flatnonzero(missing).tolist():
+                values[i] = None
+        return values
+    values = strings.strings
+    if kind == 'text':
+        values = [s.decode('utf-8') for s in values]
+    # -1, missing, picks the None at the end
+    values = values + [None]
+    return [values[i] for i in column.tolist()]
+
+
+def sources_stat(gr):
+    """ [[source, size, mtime]] of gr's sources
+    """
+    stats = []
+    for source in gr.sources:
+        st = os.stat(get(source))
+        stats.append([source, st.st_size, st.st_mtime])
+    return stats
+
+
+def sources_hash(gr):
+    h = hashlib.sha1(str(FORMAT))
+    for source in gr.sources:
+        h.update(source)
+        with open(get(source), 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), ''):
+                h.update(chunk)
+    return h.hexdigest()
+
+
+def fresh(gr, meta):
+    """ whether a snapshot's meta matches gr's sources, only hashing
+    them when their sizes or mtimes differ
+    """
+    if meta['format'] != FORMAT:
+        return False
+    if meta.get('stats') == sources_stat(gr):
+        return True
+    return meta['sources'] == sources_hash(gr)
+
+
+def path(gr):
+    return get('snapshot_%s' % gr.network)
+
+
+def save(gr):
+    """ write the snapshot of gr next to its sources
+    """
+    graph = gr.graph
+    strings = StringTable()
+    meta = {
+        'format': FORMAT,
+        'sources': sources_hash(gr),
+        'stats': sources_stat(gr),
+        'version': gr.version,
+        'd3': gr.d3,
+        'multigraph': graph.is_multigraph(),
+        'nodes': None,
+        'node_columns': {},
+        'edge_columns': {},
+    }
+    arrays = {}
+
+    nodes = graph.nodes()
+    index = {node: i for i, node in enumerate(nodes)}
+    meta['nodes'], arrays['nodes'] = encode(nodes, strings)
+    attrs = set(key for data in graph.node.itervalues() for key in data)
+    for attr in sorted(attrs):
+        meta['node_columns'][attr], arrays['node_' + attr] = encode(
+            [graph.node[node].get(attr) for node in nodes], strings
+        )
+
+    edges = graph.edges(data=True)
+    arrays['edges'] = np.array(
+        [(index[u], index[v]) for u, v, _ in edges], dtype=np.int32
+    ).reshape(-1, 2)
+    attrs = set(key for _, _, data in edges for key in data)
+    for attr in sorted(attrs):
+        meta['edge_columns'][attr], arrays['edge_' + attr] = encode(
+            [data.get(attr) for _, _, data in edges], strings
+        )
+
+    arrays['strings'], arrays['offsets'] = strings.arrays()
+
+    target = path(gr)
+    parent = os.path.dirname(target)
+    if not os.path.isdir(parent):
+        os.makedirs(parent)
+    tmp = tempfile.mkdtemp(dir=parent)
+    for name, array in arrays.iteritems():
+        np.save(os.path.join(tmp, name + '.npy'), array)
+    with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+
+    # swap the new snapshot in so readers never see half of one
+    if os.path.exists(target):
+        old = tempfile.mkdtemp(dir=parent)
+        os.rename(target, os.path.join(old, 'snapshot'))
+        os.rename(tmp, target)
+        shutil.rmtree(old)
+    else:
+        os.rename(tmp, target)
+    return target
+
+
+def load(gr):
+    """ fill gr from its snapshot, False if there is no fresh one
+    """
+    target = path(gr)
+    try:
+        with open(os.path.join(target, 'meta.json')) as f:
+            meta = json.load(f)
+    except IOError:
+        return False
+    if not fresh(gr, meta):
+        logger.info('%s is out of date, loading the sources', target)
+        return False
+
+    def array(name):
+        return np.load(
+            os.path.join(target, name + '.npy'), mmap_mode='r'
+        )
+
+    strings = StringTable.from_arrays(array('strings'), array('offsets'))
+    nodes = decode(meta['nodes'], array('nodes'), strings)
+
+    def rows(prefix, n):
+        """ a data dict, without the missing values, for each of the n
+        rows of the node_ or edge_ columns
+        """
+        kinds = meta[prefix + 'columns']
+        if not kinds:
+            return [{} for _ in xrange(n)]
+        names = [str(attr) for attr in kinds]
+        columns = [
+            decode(kind, array(prefix + attr), strings)
+            for attr, kind in kinds.iteritems()
+        ]
+        return [
+            {
+                name: value for name, value in izip(names, row)
+                if value is not None
+            }
+            for row in izip(*columns)
+        ]
+
+    edges = np.asarray(array('edges'))
+    us = [nodes[u] for u in edges[:, 0].tolist()]
+    vs = [nodes[v] for v in edges[:, 1].tolist()]
+
+    graph = nx.MultiGraph() if meta['multigraph'] else nx.Graph()
+    graph.add_nodes_from(
+        izip(nodes, rows('node_', len(nodes)))
+    )
+    graph.add_edges_from(
+        izip(us, vs, rows('edge_', len(us)))
+    )
+
+    gr.graph = graph
+    gr.d3 = meta['d3']
+    gr.version = str(meta['version'])
+    gr.clear_caches()
+    return True
+
+
+def main(argv=None):
+    from app import utils
+
+    parser = argparse.ArgumentParser(
+        description='compile binary snapshots of the graphs'
+    )
+    parser.add_argument(
+        'networks', nargs='+', choices=['network', 'underground']
+    )
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    for network in args.networks:
+        start = time.time()
+        gr = utils.NETWORKS[network](use_snapshot=False)
+        logger.info(
+            '%s: compiled in %.3fs -> %s',
+            network, time.time() - start, save(gr)
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+""" CSR backed copies of a graph with vectorised metrics
+
+scipy is optional, without it the networkx backend is always used
+"""
+from __future__ import division
+
+import networkx as nx
+import numpy as np
+
+try:
+    import scipy.sparse as sp
+    from scipy.sparse import csgraph
+except ImportError:
+    sp = None
+
+
+def available():
+    return sp is not None
+
+
+class CSRGraph(object):
+    """ adjacency of a graph as two CSR matrices indexed by nodes
+
+    counts holds the number of (parallel) edges between nodes and
+    weights their weight attribute, as networkx sees them
+    """
+    # sources per batched search, bounds the dense result block
+    batch = 256
+
+    def __init__(self, nodes, index, counts, weights, alive, multigraph):
+        self.nodes = nodes
+        self.index = index
+        self.counts = counts
+        self.weights = weights
+        self.alive = alive
+        self.multigraph = multigraph
+
+    @classmethod
+    def from_graph(cls, graph, weight='weight'):
+        nodes = graph.nodes()
+        index = {node: i for i, node in enumerate(nodes)}
+        multigraph = graph.is_multigraph()
+
+        rows, cols, counts, weights = [], [], [], []
+        for node, nbrs in graph.adjacency_iter():
+            i = index[node]
+            for nbr, data in nbrs.iteritems():
+                rows.append(i)
+                cols.append(index[nbr])
+                if multigraph:
+                    counts.append(len(data))
+                    weights.append(1)
+                else:
+                    counts.append(1)
+                    weights.append(data.get(weight, 1))
+
+        N = len(nodes)
+        return cls(
+            nodes,
+            index,
+            sp.csr_matrix((counts, (rows, cols)), shape=(N, N)),
+            sp.csr_matrix(
+                (np.array(weights, dtype=float), (rows, cols)),
+                shape=(N, N)
+            ),
+            np.ones(N, dtype=bool),
+            multigraph
+        )
+
+    def without(self, nodes):
+        """ the same index with nodes and their edges masked out
+        """
+        alive = self.alive.copy()
+        alive[[self.index[node] for node in nodes]] = False
+        mask = sp.diags(alive.astype(float), 0)
+        return CSRGraph(
+            self.nodes,
+            self.index,
+            (mask * self.counts * mask).tocsr(),
+            (mask * self.weights * mask).tocsr(),
+            alive,
+            self.multigraph
+        )
+
+    def to_dict(self, values):
+        return {
+            self.nodes[i]: float(values[i])
+            for i in np.flatnonzero(self.alive)
+        }
+
+    def degree(self):
+        """ degree of every node, self loops count twice
+        """
+        counts = self.counts
+        return (
+            np.asarray(counts.sum(axis=1)).ravel() + counts.diagonal()
+        ).astype(int)
+
+    def degree_centrality(self):
+        N = int(self.alive.sum())
+        if N <= 1:
+            return self.to_dict(self.alive.astype(float))
+        return self.to_dict(self.degree() * (1.0 / (N - 1)))
+
+    def eigenvector_centrality(self, max_iter=100, tol=1.0e-6,
+                               nstart=None):
+        """ power iteration as networkx.eigenvector_centrality, nstart
+        is a dict of starting values
+        """
+        if self.multigraph:
+            raise nx.NetworkXException("Not defined for multigraphs.")
+        N = int(self.alive.sum())
+        if N == 0:
+            raise nx.NetworkXException("Empty graph.")
+
+        if nstart is None:
+            x = self.alive / N
+        else:
+            x = np.zeros(len(self.nodes))
+            for node, value in nstart.iteritems():
+                x[self.index[node]] = value
+            x /= x.sum()
+        A = self.weights.T.tocsr()
+        for i in xrange(max_iter):
+            xlast = x
+            x = A.dot(xlast)
+            norm = np.sqrt((x ** 2).sum())
+            if norm:
+                x = x / norm
+            if np.abs(x - xlast).sum() < N * tol:
+                return self.to_dict(x)
+        raise nx.NetworkXError(
+            "eigenvector_centrality(): power iteration failed to "
+            "converge in %d iterations." % (i + 1)
+        )
+
+    def shortest_path_lengths(self, sources):
+        """ hop counts from each source to every node, one row per
+        source, zero for the source itself and unreachable nodes
+        """
+        sources = np.asarray(sources)
+        lengths = np.zeros(
+            (len(sources), len(self.nodes)), dtype=np.uint16
+        )
+        for start in xrange(0, len(sources), self.batch):
+            batch = sources[start:start + self.batch]
+            dist = csgraph.shortest_path(
+                self.counts,
+                method='D',
+                directed=False,
+                unweighted=True,
+                indices=batch
+            )
+            dist[np.isinf(dist)] = 0
+            lengths[start:start + len(batch)] = dist
+        return lengths
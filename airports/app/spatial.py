@@ -0,0 +1,216 @@
+""" nearest and within radius lookups of nodes by coordinates
+
+nodes are points on the unit sphere in a k-d tree, built once per base
+graph from the parsed coordinates, so the straight line distances the
+tree compares order the same as great circle ones and nothing is special
+at the poles or the antimeridian. Leaves hold up to leaf_size points and
+are searched as arrays. Viewport queries use the nodes sorted by
+latitude instead.
+"""
+from __future__ import division
+
+import heapq
+import math
+
+import numpy as np
+
+from app.routing import EARTH_RADIUS
+
+
+def unit_vectors(lat, lon):
+    """ (N, 3) points on the unit sphere of latitudes and longitudes in
+    degrees
+    """
+    lat = np.radians(lat)
+    lon = np.radians(lon)
+    return np.column_stack([
+        np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)
+    ])
+
+
+def chord(km):
+    """ straight line length on the unit sphere of a great circle
+    distance, which is at most half way round
+    """
+    return 2 * math.sin(min(km / EARTH_RADIUS, math.pi) / 2)
+
+
+def great_circle(chords):
+    """ km of straight line lengths on the unit sphere
+    """
+    return 2 * EARTH_RADIUS * np.arcsin(np.minimum(chords / 2, 1.))
+
+
+def tile_bbox(z, x, y):
+    """ (west, south, east, north) of a z/x/y web map tile
+    """
+    n = 2 ** z
+    if not (0 <= x < n and 0 <= y < n):
+        raise ValueError('no tile %d/%d/%d' % (z, x, y))
+
+    def lat(row):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / n))))
+    return x / n * 360 - 180, lat(y + 1), (x + 1) / n * 360 - 180, lat(y)
+
+
+def parse_tile(value):
+    """ tile_bbox of 'z/x/y'
+    """
+    z, x, y = [int(part) for part in value.split('/')]
+    if not 0 <= z <= 30:
+        raise ValueError('bad zoom %d' % z)
+    return tile_bbox(z, x, y)
+
+
+def parse_bbox(value):
+    """ (west, south, east, north) from 'west,south,east,north' in
+    degrees, west greater than east crosses the antimeridian
+    """
+    west, south, east, north = [float(part) for part in value.split(',')]
+    if not (-90 <= south <= north <= 90):
+        raise ValueError('bad bounding box %s' % value)
+    return west, south, east, north
+
+
+class SpatialIndex(object):
+    """ k-d tree of the nodes of a {node: (latitude, longitude)}
+    """
+    leaf_size = 16
+
+    def __init__(self, coordinates):
+        self.nodes = list(coordinates)
+        self.position = {node: i for i, node in enumerate(self.nodes)}
+        latlon = np.array(
+            [coordinates[node] for node in self.nodes], dtype=float
+        ).reshape(-1, 2)
+        self.lat = latlon[:, 0]
+        self.lon = (latlon[:, 1] + 180) % 360 - 180
+        self.points = unit_vectors(self.lat, self.lon)
+
+        self.by_lat = np.argsort(self.lat, kind='mergesort')
+        self.sorted_lat = self.lat[self.by_lat]
+
+        # each tree node is (start, end, lo, hi, left, right) over the
+        # points order[start:end], leaves have no children
+        self.order = np.arange(len(self.nodes))
+        self.tree = []
+        if len(self.nodes):
+            self.build(0, len(self.nodes))
+
+    def build(self, start, end):
+        index = len(self.tree)
+        points = self.points[self.order[start:end]]
+        lo, hi = points.min(axis=0), points.max(axis=0)
+        self.tree.append([start, end, lo, hi, None, None])
+        if end - start > self.leaf_size:
+            # split the widest dimension at its median
+            dim = int(np.argmax(hi - lo))
+            mid = (end - start) // 2
+            part = np.argpartition(points[:, dim], mid)
+            self.order[start:end] = self.order[start:end][part]
+            self.tree[index][4] = self.build(start, start + mid)
+            self.tree[index][5] = self.build(start + mid, end)
+        return index
+
+    def box_distance(self, node, q):
+        _, _, lo, hi, _, _ = self.tree[node]
+        return float(np.sqrt(
+            (np.maximum(np.maximum(lo - q, q - hi), 0) ** 2).sum()
+        ))
+
+    def leaf(self, node, q, removed):
+        """ (indices, chord lengths) of the points of a leaf
+        """
+        start, end = self.tree[node][:2]
+        indices = self.order[start:end]
+        if removed:
+            indices = np.array([
+                i for i in indices if self.nodes[i] not in removed
+            ], dtype=np.int64)
+        chords = np.sqrt(((self.points[indices] - q) ** 2).sum(axis=1))
+        return indices, chords
+
+    def within(self, lat, lon, km, removed=()):
+        """ [(km, node)] of the nodes within km of a point, nearest first
+        """
+        if not self.tree:
+            return []
+        q = unit_vectors([lat], [lon])[0]
+        limit = chord(km)
+        found = []
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            if self.box_distance(node, q) > limit:
+                continue
+            left, right = self.tree[node][4:]
+            if left is not None:
+                stack.extend((left, right))
+                continue
+            indices, chords = self.leaf(node, q, removed)
+            keep = chords <= limit
+            found.extend(zip(chords[keep], indices[keep]))
+        found.sort()
+        return self.result(found)
+
+    def nearest(self, lat, lon, k=1, removed=()):
+        """ [(km, node)] of the k nodes nearest a point, nearest first
+        """
+        if not self.tree or k < 1:
+            return []
+        q = unit_vectors([lat], [lon])[0]
+        # best k so far as a max heap of (-chord, index)
+        best = []
+        heap = [(0., 0)]
+        while heap:
+            distance, node = heapq.heappop(heap)
+            if len(best) == k and distance > -best[0][0]:
+                break
+            left, right = self.tree[node][4:]
+            if left is not None:
+                for child in (left, right):
+                    heapq.heappush(
+                        heap, (self.box_distance(child, q), child)
+                    )
+                continue
+            indices, chords = self.leaf(node, q, removed)
+            for c, i in zip(chords, indices):
+                if len(best) < k:
+                    heapq.heappush(best, (-c, i))
+                elif c < -best[0][0]:
+                    heapq.heapreplace(best, (-c, i))
+        return self.result(sorted((-c, i) for c, i in best))
+
+    def result(self, found):
+        if not found:
+            return []
+        chords, indices = zip(*found)
+        return zip(
+            great_circle(np.array(chords)).tolist(),
+            [self.nodes[i] for i in indices]
+        )
+
+    def bbox(self, west, south, east, north, removed=()):
+        """ nodes inside a viewport, see parse_bbox
+        """
+        return [
+            self.nodes[i]
+            for i in self.bbox_indices(west, south, east, north)
+            if self.nodes[i] not in removed
+        ]
+
+    def bbox_indices(self, west, south, east, north):
+        """ sorted indices of the nodes inside a viewport
+        """
+        start = np.searchsorted(self.sorted_lat, south, side='left')
+        end = np.searchsorted(self.sorted_lat, north, side='right')
+        indices = self.by_lat[start:end]
+        if east - west < 360:
+            lon = self.lon[indices]
+            west = (west + 180) % 360 - 180
+            east = (east + 180) % 360 - 180
+            if west <= east:
+                indices = indices[(lon >= west) & (lon <= east)]
+            else:
+                indices = indices[(lon >= west) | (lon <= east)]
+        return np.sort(indices)
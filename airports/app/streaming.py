@@ -0,0 +1,70 @@
+""" streamed JSON for responses too big to build in one go
+
+rows are encoded in batches as the graph is walked, either into one JSON
+object holding a list or as newline delimited JSON, and gzipped when the
+client accepts it
+"""
+import json
+import zlib
+
+from itertools import islice
+
+from flask import Response, request
+
+# rows encoded per chunk
+BATCH = 512
+
+
+def batches(rows, size=BATCH):
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+def json_list(key, rows, size=BATCH):
+    """ chunks of {key: [rows]}
+    """
+    yield '{%s:[' % json.dumps(key)
+    sep = ''
+    for batch in batches(rows, size):
+        yield sep + ','.join(json.dumps(row) for row in batch)
+        sep = ','
+    yield ']}'
+
+
+def ndjson(rows, size=BATCH):
+    """ chunks of one JSON row per line
+    """
+    for batch in batches(rows, size):
+        yield ''.join(json.dumps(row) + '\n' for row in batch)
+
+
+def gzipped(chunks, level=6):
+    # wbits over 16 writes a gzip header and trailer
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def response(key, rows):
+    """ a streamed response of rows, newline delimited when asked for
+    with ?format=ndjson
+    """
+    if request.args.get('format') == 'ndjson':
+        chunks, mimetype = ndjson(rows), 'application/x-ndjson'
+    else:
+        chunks, mimetype = json_list(key, rows), 'application/json'
+
+    headers = {}
+    if 'gzip' in request.accept_encodings:
+        chunks = gzipped(chunks)
+        headers['Content-Encoding'] = 'gzip'
+    response = Response(chunks, mimetype=mimetype, headers=headers)
+    response.vary.add('Accept-Encoding')
+    return response
@@ -1,9 +1,22 @@
 from __future__ import division
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
 import unittest
+import zlib
 
-from app import app, graph
+from app import (
+    app, betweenness, centrality, degrees, disruption, efficiency, graph,
+    hublabels, jobs, journey, projection, routing, sampling, snapshot,
+    sparse, spatial, utils, vega, vulnerability
+)
 from flask import session
 import networkx as nx
+import numpy as np
+from benchmarks import networks, run
 from session import session_setup
 
 app = session_setup(app)
@@ -34,6 +47,23 @@ class ViewTestCase(unittest.TestCase):
             resp = c.get('/london')
             self.assertEqual(resp.status_code, 200)
 
+    def test_map_viewport(self):
+        # the pages ask their maps for the nodes they show
+        with app.test_client() as c:
+            for page in ('/', '/route', '/london'):
+                self.assertIn('bbox=', c.get(page).data, page)
+
+            bbox = vega.LondonMap.viewport
+            spec = json.loads(c.get('/london_map?bbox=' + bbox).data)
+            marks = [
+                d for d in spec['spec']['data']
+                if d['name'] == 'station_marks'
+            ]
+            resp = c.get(marks[0]['url'])
+            names = [s['name'] for s in json.loads(resp.data)['stations']]
+            self.assertIn('Bank', names)
+            self.assertNotIn('Nowhere', names)
+
     def test_map(self):
         with app.test_client() as c:
             resp = c.get('/map')
@@ -94,6 +124,245 @@ class ViewTestCase(unittest.TestCase):
             resp = c.get('/flights/AAA/BBC')
             self.assertEqual(resp.status_code, 404)
 
+    def test_streamed_edges(self):
+        with app.test_client() as c:
+            resp = c.get('/flights')
+            flights = json.loads(resp.data)['flight_data']
+
+            resp = c.get('/flights?format=ndjson')
+            rows = [json.loads(line) for line in resp.data.splitlines()]
+            self.assertEqual(rows, flights)
+
+            resp = c.get(
+                '/flights', headers={'Accept-Encoding': 'gzip'}
+            )
+            self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+            self.assertEqual(
+                json.loads(zlib.decompress(resp.data, 16 + zlib.MAX_WBITS)),
+                {'flight_data': flights}
+            )
+
+            resp = c.get('/lines')
+            self.assertIn('lines', json.loads(resp.data))
+
+    def test_columnar(self):
+        with app.test_client() as c:
+            c.delete('/airports/BBB')
+            flights = json.loads(c.get('/flights').data)['flight_data']
+            resp = c.get('/flights?format=columnar')
+            columns = json.loads(resp.data)['flight_data']
+            self.assertEqual(
+                zip(columns['origin'], columns['destination']),
+                [(f['origin'], f['destination']) for f in flights]
+            )
+            self.assertNotIn('BBB', columns['origin'])
+
+            airports = json.loads(c.get('/airports').data)['airport_data']
+            resp = c.get('/airports?format=columnar')
+            columns = json.loads(resp.data)['airport_data']
+            self.assertEqual(
+                columns['code'], [a['code'] for a in airports]
+            )
+            c.post('/airports')
+
+    def test_background_metrics(self):
+        app.config['BACKGROUND_METRICS'] = True
+        manager = jobs.manager
+        jobs.manager = jobs.JobManager(processes=1)
+        try:
+            with app.test_client() as c:
+                c.get('/route')
+                gr = utils.get_graph(session)
+                value, job = jobs.manager.get(gr, 'network', 'degree')
+                self.assertIsNone(value)
+
+                for _ in xrange(100):
+                    state = json.loads(c.get('/jobs/' + job.id).data)
+                    if state['state'] != 'running':
+                        break
+                    time.sleep(0.05)
+                self.assertEqual(state['state'], 'done')
+                self.assertEqual(
+                    jobs.manager.get(gr, 'network', 'degree'),
+                    (utils.compute_metric(gr, 'network', 'degree'), None)
+                )
+
+                # a new version gets the stale value while it runs
+                c.delete('/airports/BBB')
+                gr = utils.get_graph(session)
+                value, job = jobs.manager.get(gr, 'network', 'degree')
+                self.assertIn('BBB', value)
+                self.assertIsNotNone(job)
+                c.post('/airports')
+
+                resp = c.get('/')
+                self.assertEqual(resp.status_code, 200)
+
+                # an airport's own values, never a placeholder
+                data = json.loads(c.get('/airports/CCC').data)
+                self.assertEqual(
+                    data['degree'],
+                    utils.get_graph(session).centrality('degree')['CCC']
+                )
+                self.assertGreater(data['degree'], 0)
+
+            # a worker refuses a graph other than the one asked about
+            base = utils.get_base_graph()
+            version = base.without(['BBB']).version
+            ok, _ = jobs.run('network', ['BBB'], 'degree', 5, version)
+            self.assertTrue(ok)
+            ok, error = jobs.run('network', ['BBB'], 'degree', 5, base.version)
+            self.assertFalse(ok)
+            self.assertIn(base.version, error)
+
+            self.assertEqual(self.client.get('/jobs/0').status_code, 404)
+            self.assertNotEqual(
+                jobs.Job('network', 'degree').id,
+                jobs.Job('network', 'degree').id
+            )
+        finally:
+            jobs.manager.stop()
+            jobs.manager = manager
+            app.config['BACKGROUND_METRICS'] = False
+
+    def test_instrumentation(self):
+        with app.test_client() as c:
+            c.get('/')
+            resp = c.get('/internal/metrics')
+            self.assertEqual(resp.status_code, 404)
+            app.config['INTERNAL_METRICS'] = True
+            try:
+                resp = c.get('/internal/metrics')
+            finally:
+                app.config['INTERNAL_METRICS'] = False
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn(
+                'airports_span_seconds_count{span="get_graph"}', resp.data
+            )
+            self.assertIn(
+                'airports_request_seconds_bucket{endpoint="index",le="+Inf"}',
+                resp.data
+            )
+
+            # profiles are off unless the app allows them
+            resp = c.get('/?profile=1')
+            self.assertIn('html', resp.data)
+
+            app.config['PROFILE_REQUESTS'] = True
+            try:
+                resp = c.get('/?profile=1')
+                self.assertIn('function calls', resp.data)
+                resp = c.get('/flights?profile=flamegraph')
+                self.assertIn('flights (', resp.data)
+            finally:
+                app.config['PROFILE_REQUESTS'] = False
+
+    def test_spec_single_fetch(self):
+        with app.test_client() as c:
+            resp = c.get('/map')
+            spec = json.loads(resp.data)['spec']
+            urls = [d['url'] for d in spec['data'] if 'url' in d]
+            self.assertEqual(urls.count('/flights'), 1)
+
+            resp = c.get('/forced/random?simulate=none')
+            spec = json.loads(resp.data)['spec']
+            urls = [d['url'] for d in spec['data'] if 'url' in d]
+            self.assertEqual(len(urls), 1)
+
+            resp = c.get(urls[0])
+            groups = set(
+                e['group'] for e in json.loads(resp.data)['elements']
+            )
+            self.assertEqual(groups, set(['nodes', 'edges']))
+
+            # the serialised spec matches the one built as a dict
+            resp = c.get('/histogram/network')
+            spec = vega.Scatter().get_json(network='network')
+            self.assertEqual(
+                json.loads(resp.data), json.loads(json.dumps(spec))
+            )
+
+    def test_loaders(self):
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        level = graph.logger.level
+        graph.logger.addHandler(handler)
+        graph.logger.setLevel(logging.INFO)
+        try:
+            gr = graph.Graph(use_snapshot=False)
+            ug = graph.Underground(use_snapshot=False)
+        finally:
+            graph.logger.removeHandler(handler)
+            graph.logger.setLevel(level)
+
+        # airports without flights and stations off every line are left out
+        self.assertItemsEqual(gr.graph, ['AAA', 'BBB', 'CCC', 'DDD', 'EEE'])
+        self.assertEqual(gr.graph.node['AAA']['name'], 'Alpha')
+        self.assertEqual(gr.graph['AAA']['BBB']['weight'], 10)
+        names = [data['name'] for data in ug.graph.node.itervalues()]
+        self.assertNotIn('Nowhere', names)
+        self.assertEqual(len(names), 5)
+        self.assertEqual(ug.graph.number_of_edges(), 6)
+
+        messages = [record.getMessage() for record in records]
+        self.assertEqual(len(messages), 2)
+        self.assertTrue(messages[0].startswith('Graph loaded in '))
+        self.assertTrue(messages[0].endswith(': 5 nodes, 5 edges'))
+        self.assertTrue(messages[1].startswith('Underground loaded in '))
+        self.assertTrue(messages[1].endswith(': 5 nodes, 6 edges'))
+
+    def test_random_network_seed(self):
+        # every worker builds the same random network by default
+        self.assertEqual(
+            utils.NETWORKS['random']().version,
+            utils.NETWORKS['random']().version
+        )
+
+    def test_forced_layout_size(self):
+        with app.test_client() as c:
+            resp = c.get('/forcedlayout/underground?width=300&height=200')
+            self.assertEqual(resp.status_code, 200)
+            for query in (
+                    'width=x&height=200', 'width=300', 'width=0&height=200',
+                    'width=300&height=-5'
+            ):
+                resp = c.get('/forcedlayout/underground?' + query)
+                self.assertEqual(resp.status_code, 400, query)
+
+    def test_conditional_get(self):
+        utils.responses.clear()
+        with app.test_client() as c:
+            resp = c.get('/flights')
+            self.assertEqual(resp.status_code, 200)
+            etag = resp.headers['ETag']
+            body = resp.data
+
+            resp = c.get('/flights', headers={'If-None-Match': etag})
+            self.assertEqual(resp.status_code, 304)
+
+            # the whole flight list is streamed and not kept, smaller
+            # bodies are served from the byte cache
+            self.assertEqual(len(utils.responses), 0)
+            resp = c.get('/flights/AAA')
+            self.assertEqual(len(utils.responses), 1)
+            key = next(iter(utils.responses.data))
+            self.assertEqual(utils.responses.get(key)[1], resp.data)
+            utils.responses.set(key, ('application/json', '{"cached":1}'))
+            cached = c.get('/flights/AAA')
+            self.assertEqual(cached.data, '{"cached":1}')
+            self.assertEqual(cached.headers['ETag'], resp.headers['ETag'])
+            resp = c.get('/flights')
+            self.assertEqual(resp.data, body)
+            self.assertEqual(resp.headers['ETag'], etag)
+
+            # a removal is a new graph version
+            c.delete('/airports/BBB')
+            resp = c.get('/flights', headers={'If-None-Match': etag})
+            self.assertEqual(resp.status_code, 200)
+            self.assertNotEqual(resp.headers['ETag'], etag)
+            c.post('/airports')
+
     def test_degree(self):
         with app.test_client() as c:
             resp = c.get('/degree')
@@ -108,6 +377,189 @@ class ViewTestCase(unittest.TestCase):
             resp = c.get('/degree/scatter/fail')
             self.assertEqual(resp.status_code, 404)
 
+            resp = c.get('/degree/distribution/network')
+            data = json.loads(resp.data)
+            self.assertEqual(
+                set(p['group'] for p in data['distribution']),
+                set(['points', 'bestfit'])
+            )
+            self.assertIn('powerlaw', data)
+
+    def test_disruption(self):
+        with app.test_client() as c:
+            resp = c.post(
+                '/disruption/network',
+                data=json.dumps({'strategy': 'degree', 'steps': 2}),
+                content_type='application/json'
+            )
+            self.assertEqual(resp.status_code, 200)
+            steps = json.loads(resp.data)['steps']
+            self.assertEqual(len(steps), 3)
+            self.assertIsNone(steps[0]['removed'])
+            # the session's graph is untouched
+            resp = c.get('/airports/%s' % steps[1]['removed'])
+            self.assertEqual(resp.status_code, 200)
+
+            resp = c.post(
+                '/disruption/network',
+                data=json.dumps({'nodes': ['nowhere']}),
+                content_type='application/json'
+            )
+            self.assertEqual(resp.status_code, 400)
+            resp = c.post(
+                '/disruption/network',
+                data=json.dumps({'strategy': 'fail'}),
+                content_type='application/json'
+            )
+            self.assertEqual(resp.status_code, 400)
+            for body in (
+                    {'steps': -2}, {'steps': 0}, {'steps': 'x'},
+                    {'steps': True}, {'steps': 2, 'seed': 'abc'},
+                    {'steps': 2, 'seed': 1.5}, [1, 2], 'AAA',
+                    {'nodes': 3}, {'nodes': 'AAA'}, {'nodes': [['AAA']]},
+                    {'nodes': [{'code': 'AAA'}]}
+            ):
+                resp = c.post(
+                    '/disruption/network', data=json.dumps(body),
+                    content_type='application/json'
+                )
+                self.assertEqual(resp.status_code, 400, body)
+            resp = c.post(
+                '/disruption/network',
+                data=json.dumps({'strategy': 'random', 'steps': 1, 'seed': 3}),
+                content_type='application/json'
+            )
+            self.assertEqual(len(json.loads(resp.data)['steps']), 2)
+
+    def test_betweenness(self):
+        with app.test_client() as c:
+            resp = c.get('/centrality/betweenness/underground?limit=2')
+            self.assertEqual(resp.status_code, 200)
+            nodes = json.loads(resp.data)['nodes']
+            self.assertEqual(len(nodes), 2)
+            self.assertIn('betweenness', nodes[0])
+
+            resp = c.get('/centrality/fail/underground')
+            self.assertEqual(resp.status_code, 404)
+            for limit in ('-1', '0'):
+                resp = c.get(
+                    '/centrality/betweenness/underground?limit=' + limit
+                )
+                self.assertEqual(resp.status_code, 400, limit)
+
+            resp = c.get('/london')
+            self.assertIn('tab_between', resp.data)
+
+    def test_nearby(self):
+        with app.test_client() as c:
+            resp = c.get('/nearby?lat=40&lon=-100&k=2')
+            self.assertEqual(resp.status_code, 200)
+            nodes = json.loads(resp.data)['nodes']
+            self.assertEqual([n['node'] for n in nodes], ['AAA', 'BBB'])
+            self.assertEqual(nodes[0]['distance'], 0)
+
+            resp = c.get('/nearby?lat=40&lon=-100&radius=150')
+            nodes = json.loads(resp.data)['nodes']
+            self.assertEqual(
+                set(n['node'] for n in nodes), set(['AAA', 'BBB'])
+            )
+
+            resp = c.get('/nearby?lat=40')
+            self.assertEqual(resp.status_code, 400)
+
+            resp = c.get('/airports?bbox=-100.5,39.5,-98.5,42.5')
+            self.assertEqual(
+                set(a['code'] for a in json.loads(resp.data)['airport_data']),
+                set(['AAA', 'CCC'])
+            )
+            resp = c.get('/airports?bbox=fail')
+            self.assertEqual(resp.status_code, 400)
+
+    def test_projected(self):
+        with app.test_client() as c:
+            resp = c.get(
+                '/airports?projection=albersUsa&scale=1200&translate=450,280'
+            )
+            self.assertEqual(resp.status_code, 200)
+            airports = json.loads(resp.data)['airport_data']
+            self.assertEqual(len(airports), 5)
+            self.assertTrue(all('layout_x' in a for a in airports))
+
+            # tile 1/0/0 is the north west quarter of the world
+            resp = c.get('/stations?projection=mercator&tile=1/0/0')
+            stations = json.loads(resp.data)['stations']
+            every = json.loads(c.get('/stations').data)['stations']
+            self.assertEqual(len(stations), len(every))
+            resp = c.get('/stations?projection=mercator&tile=1/1/0')
+            self.assertEqual(json.loads(resp.data)['stations'], [])
+
+            resp = c.get('/stations?projection=fail')
+            self.assertEqual(resp.status_code, 400)
+            resp = c.get('/stations?projection=mercator&tile=1/2/0')
+            self.assertEqual(resp.status_code, 400)
+            for query in (
+                    'translate=1,2,3', 'translate=1,nan', 'scale=nan',
+                    'scale=-1', 'resolution=-1', 'resolution=inf'
+            ):
+                resp = c.get('/stations?projection=mercator&' + query)
+                self.assertEqual(resp.status_code, 400, query)
+
+            # lines look up every station, only the marks are thinned
+            resp = c.get('/london_map')
+            spec = json.loads(resp.data)['spec']
+            data = {d['name']: d for d in spec['data']}
+            self.assertIn('projection=mercator', data['stations']['url'])
+            self.assertNotIn('resolution', data['stations']['url'])
+            self.assertIn('resolution=1', data['station_marks']['url'])
+
+    def test_journey(self):
+        with app.test_client() as c:
+            resp = c.get('/journey/Bank/Old Street')
+            self.assertEqual(resp.status_code, 200)
+            data = json.loads(resp.data)
+            self.assertEqual(data['changes'], 0)
+            self.assertEqual(data['legs'], [{
+                'line': 'Northern',
+                'stations': ['Bank', 'Moorgate', 'Old Street']
+            }])
+
+            resp = c.get('/journey/Bank/nowhere')
+            self.assertEqual(resp.status_code, 404)
+
+    def test_estimate(self):
+        with app.test_client() as c:
+            resp = c.get('/estimate/network?budget=1&limit=3')
+            self.assertEqual(resp.status_code, 200)
+            data = json.loads(resp.data)
+            self.assertEqual(len(data['betweenness']), 3)
+            self.assertIn('global_efficiency', data['bounds'])
+
+            resp = c.get('/estimate/network?epsilon=2')
+            self.assertEqual(resp.status_code, 400)
+
+            # APPROXIMATE_BUDGET caps sampling whatever the epsilon
+            app.config['APPROXIMATE_BUDGET'] = 1e-9
+            try:
+                resp = c.get('/estimate/network?epsilon=0.001')
+            finally:
+                app.config['APPROXIMATE_BUDGET'] = 2
+            self.assertEqual(json.loads(resp.data)['samples'], 1)
+
+            app.config['APPROXIMATE_ABOVE'] = 0
+            try:
+                resp = c.get('/')
+                self.assertEqual(resp.status_code, 200)
+                gr = utils.get_graph(session)
+                estimate = utils.approximate(gr, False)
+                self.assertIsNotNone(estimate)
+                # no exact Brandes run above the threshold
+                self.assertEqual(
+                    utils.compute_metric(gr, 'network', 'betweenness'),
+                    utils.sort_degrees(estimate.betweenness, 5)
+                )
+            finally:
+                app.config['APPROXIMATE_ABOVE'] = 2000
+
 
 class TestPairwise(unittest.TestCase):
     def test_pairwise(self):
@@ -157,6 +609,493 @@ class TestGraph(unittest.TestCase):
         # the middle node (2) is the most vulnerable
         self.assertEqual(mx, (2, v_min))
 
+    def test_exact_vulnerability(self):
+        # removing the middle node disconnects the network
+        mx, v = self.gr.vulnerability(exact=True)
+        self.assertEqual(mx, (2, 1.))
+        self.assertListEqual(v.keys()[1:], [1, 3])
+        self.assertAlmostEqual(v[1], -0.2)
+
+        v, complete = vulnerability.exact_vulnerability(
+            self.gr, limit=1, processes=2
+        )
+        self.assertTrue(complete)
+        self.assertListEqual(v.keys(), [2])
+
+        # past the deadline the partial table is returned
+        v, complete = vulnerability.exact_vulnerability(
+            self.gr, deadline=time.time() - 1
+        )
+        self.assertFalse(complete)
+        self.assertEqual(len(v), 0)
+
+    def test_exact_vulnerability_cached(self):
+        gr = GraphTest()
+        gr.graph.add_edge(3, 4)
+        gr.touch()
+        # nothing done before the deadline is an empty table
+        vulnerability.tables.clear()
+        mx, v = gr.vulnerability(exact=True, deadline=time.time() - 1)
+        self.assertIsNone(mx)
+        self.assertEqual(len(v), 0)
+        # and isn't kept, a caller with time gets every node
+        self.assertNotIn(gr.version, vulnerability.tables)
+        self.assertEqual(len(gr.vulnerability(exact=True)[1]), 4)
+
+        # the table is kept per version
+        vulnerability.tables.clear()
+        mx, v = gr.vulnerability(exact=True)
+        exact = vulnerability.exact_vulnerability
+        vulnerability.exact_vulnerability = None
+        try:
+            self.assertEqual(gr.vulnerability(exact=True), (mx, v))
+        finally:
+            vulnerability.exact_vulnerability = exact
+        self.assertIn(gr.version, vulnerability.tables)
+
+    def test_without(self):
+        overlay = self.gr.without([2])
+        # the base graph is shared and left untouched
+        self.assertListEqual(self.gr.graph.nodes(), [1, 2, 3])
+        self.assertListEqual(overlay.graph.nodes(), [1, 3])
+        self.assertIs(overlay.base, self.gr)
+        self.assertNotEqual(overlay.version, self.gr.version)
+        self.assertEqual(
+            overlay.version, self.gr.without([2]).version
+        )
+        self.assertEqual(
+            overlay.without([1]).removed, frozenset([1, 2])
+        )
+        # nothing removed is the base graph itself
+        self.assertIs(self.gr.without([4]), self.gr)
+
+    def test_incremental_efficiency(self):
+        gr = GraphTest()
+        gr.graph = nx.connected_watts_strogatz_graph(40, 4, 0.3, seed=1)
+        gr.touch()
+        gr.calculate_global_efficiencies()
+
+        overlay = gr.without([3])
+        table = efficiency.engine.tables.get(gr.version)
+        ans = efficiency.EfficiencyTable.build(overlay)
+        inc = table.without(overlay, 3, gr.graph[3])
+        self.assertEqual(
+            set(inc.efficiencies()), set(overlay.graph.nodes())
+        )
+        for node, eff in ans.efficiencies().iteritems():
+            self.assertAlmostEqual(inc.efficiencies()[node], eff)
+
+        # the engine picks up the cached parent version
+        effs = overlay.calculate_global_efficiencies()
+        self.assertAlmostEqual(
+            sum(effs.values()), sum(ans.efficiencies().values())
+        )
+
+    def test_disruption(self):
+        gr = GraphTest()
+        gr.graph = nx.connected_watts_strogatz_graph(40, 4, 0.3, seed=2)
+        gr.touch()
+        nodes = disruption.order(gr, 'random', 10, seed=0)
+        steps = disruption.simulate(gr, nodes)
+        self.assertEqual(len(steps), 11)
+        for n, step in enumerate(steps):
+            overlay = gr.without(nodes[:n])
+            self.assertAlmostEqual(
+                step['efficiency'],
+                sum(efficiency.EfficiencyTable.build(overlay)
+                    .efficiencies().values())
+            )
+            self.assertEqual(
+                step['largest_component'],
+                max(len(c) for c in nx.connected_components(overlay.graph))
+            )
+
+    def test_spatial_index(self):
+        rng = np.random.RandomState(0)
+        coordinates = {
+            i: (lat, lon) for i, (lat, lon) in enumerate(zip(
+                rng.uniform(-90, 90, 500), rng.uniform(-180, 180, 500)
+            ))
+        }
+        index = spatial.SpatialIndex(coordinates)
+        points = spatial.unit_vectors(index.lat, index.lon)
+
+        for lat, lon in [(51.5, -0.1), (-33.9, 151.2), (0., 179.9)]:
+            q = spatial.unit_vectors([lat], [lon])[0]
+            km = spatial.great_circle(
+                np.sqrt(((points - q) ** 2).sum(axis=1))
+            )
+            ans = [index.nodes[i] for i in np.argsort(km)]
+
+            nearest = index.nearest(lat, lon, k=5)
+            self.assertEqual([node for _, node in nearest], ans[:5])
+            within = index.within(lat, lon, 2000)
+            self.assertEqual(
+                [node for _, node in within],
+                ans[:int((km <= 2000).sum())]
+            )
+            removed = frozenset(ans[:2])
+            self.assertEqual(
+                index.nearest(lat, lon, k=1, removed=removed)[0][1], ans[2]
+            )
+
+        inside = index.bbox(170, -10, -170, 10)
+        self.assertEqual(inside, sorted(
+            node for node, (lat, lon) in coordinates.iteritems()
+            if -10 <= lat <= 10 and (lon >= 170 or lon <= -170)
+        ))
+
+    def test_projection(self):
+        # the centres of the projections land on the translate
+        x, y = projection.albers_usa(np.array([-96.6]), np.array([38.7]))
+        self.assertAlmostEqual(x[0], 480)
+        self.assertAlmostEqual(y[0], 250)
+        x, y = projection.mercator(
+            np.array([0., -0.1]), np.array([0., 51.5]), scale=41000,
+            translate=(480, 43350)
+        )
+        self.assertAlmostEqual(x[0], 480)
+        self.assertAlmostEqual(y[0], 43350)
+        self.assertAlmostEqual(x[1], 480 - np.radians(0.1) * 41000)
+
+        # Anchorage and Honolulu are in the insets, London nowhere
+        x, y = projection.albers_usa(
+            np.array([-149.9, -157.86, -0.1]), np.array([61.2, 21.3, 51.5])
+        )
+        self.assertTrue(np.isfinite(x[:2]).all())
+        self.assertTrue((x[:2] < 480).all() and (y[:2] > 250).all())
+        self.assertTrue(np.isnan(x[2]))
+
+        self.assertEqual(
+            projection.parse('mercator', '10', '1,2'),
+            ('mercator', 10., (1., 2.))
+        )
+        self.assertRaises(
+            ValueError, projection.parse, 'mercator', None, '1,2,3'
+        )
+
+        kept = projection.thin(
+            np.array([0.2, 0.7, 5.]), np.array([0.2, 0.6, 5.]),
+            np.array([1, 3, 2]), 1.
+        )
+        self.assertEqual(kept.tolist(), [1, 2])
+
+        west, south, east, north = spatial.tile_bbox(1, 0, 0)
+        self.assertEqual((west, south, east), (-180, 0, 0))
+        self.assertAlmostEqual(north, 85.0511, places=4)
+
+    def test_journey_planner(self):
+        gr = GraphTest()
+        gr.graph = nx.MultiGraph()
+        gr.graph.add_edges_from([
+            ('A', 'B', {'line': 'x'}), ('B', 'C', {'line': 'x'}),
+            ('C', 'D', {'line': 'x'}), ('A', 'E', {'line': 'y'}),
+            ('E', 'D', {'line': 'z'})
+        ])
+        gr.touch()
+        planner = journey.Planner(gr.graph)
+
+        # three stops on one line beat two with a change
+        result = planner.journey('A', 'D', penalty=3)
+        self.assertEqual((result['stops'], result['changes']), (3, 0))
+        result = planner.journey('A', 'D', penalty=0.5)
+        self.assertEqual((result['stops'], result['changes']), (2, 1))
+        self.assertEqual(
+            [leg['stations'] for leg in result['legs']],
+            [['A', 'E'], ['E', 'D']]
+        )
+
+        result = planner.journey('A', 'D', removed=frozenset(['B']))
+        self.assertEqual(result['legs'][0]['line'], 'y')
+        with self.assertRaises(routing.NoRoute):
+            planner.journey('A', 'D', removed=frozenset(['B', 'E']))
+
+    def test_betweenness(self):
+        gr = GraphTest()
+        gr.graph = nx.connected_watts_strogatz_graph(60, 4, 0.3, seed=4)
+        gr.touch()
+        ans = nx.betweenness_centrality(gr.graph)
+        serial = betweenness.betweenness(gr)
+        below = betweenness.SERIAL_BELOW
+        betweenness.SERIAL_BELOW = 0
+        try:
+            pooled = betweenness.betweenness(gr, processes=2)
+        finally:
+            betweenness.SERIAL_BELOW = below
+        for node, value in ans.iteritems():
+            self.assertAlmostEqual(serial[node], value)
+            self.assertAlmostEqual(pooled[node], value)
+
+        ranking = gr.centrality('betweenness')
+        self.assertIs(ranking, gr.centrality('betweenness'))
+
+    def test_estimate(self):
+        gr = GraphTest()
+        gr.graph = nx.connected_watts_strogatz_graph(60, 4, 0.3, seed=3)
+        gr.touch()
+        effs = gr.calculate_global_efficiencies()
+        between = nx.betweenness_centrality(gr.graph)
+
+        # every source sampled is exact
+        exact = sampling.estimate(gr, epsilon=1e-3)
+        self.assertTrue(exact.exact)
+        for node in gr.graph:
+            self.assertAlmostEqual(exact.efficiencies[node], effs[node])
+            self.assertAlmostEqual(exact.betweenness[node], between[node])
+
+        approx = sampling.estimate(gr, epsilon=0.3, seed=0)
+        self.assertLess(approx.samples, 60)
+        self.assertLess(
+            abs(approx.global_efficiency - sum(effs.values())),
+            approx.bounds['global_efficiency']
+        )
+        for node in gr.graph:
+            self.assertLess(
+                abs(approx.betweenness[node] - between[node]),
+                approx.bounds['betweenness']
+            )
+
+    @unittest.skipUnless(sparse.available(), 'needs scipy')
+    def test_sparse_backend(self):
+        gr = GraphTest()
+        gr.graph = nx.connected_watts_strogatz_graph(40, 4, 0.3, seed=1)
+        for i, (u, v) in enumerate(gr.graph.edges()):
+            gr.graph[u][v]['weight'] = 1 + i % 3
+        gr.touch()
+        overlay = gr.without([3])
+
+        ans = {}
+        for g in [gr, overlay]:
+            ans[g.version] = (
+                g.degree(),
+                g.degree_centrality(),
+                g.eigenvector_centrality(),
+                efficiency.EfficiencyTable.build(g).efficiencies()
+            )
+        app.config['GRAPH_BACKEND'] = 'sparse'
+        try:
+            for g in [gr, overlay]:
+                self.assertEqual(g.backend, 'sparse')
+                degree, degrees, eigens, effs = ans[g.version]
+                self.assertDictEqual(g.degree(), degree)
+                self.assertDictEqual(g.degree_centrality(), degrees)
+                for node, eig in g.eigenvector_centrality().iteritems():
+                    self.assertAlmostEqual(eig, eigens[node])
+                table = efficiency.EfficiencyTable.build(g)
+                for node, eff in table.efficiencies().iteritems():
+                    self.assertAlmostEqual(eff, effs[node])
+        finally:
+            app.config['GRAPH_BACKEND'] = 'networkx'
+
+    def test_centrality_cache(self):
+        gr = GraphTest()
+        gr.graph = nx.connected_watts_strogatz_graph(40, 4, 0.3, seed=1)
+        gr.touch()
+
+        degrees = gr.centrality('degree')
+        self.assertIs(degrees, gr.centrality('degree'))
+        self.assertEqual(
+            utils.sort_degrees(degrees, limit=5),
+            utils.sort_degrees(gr.degree_centrality(), limit=5)
+        )
+        self.assertRaises(ValueError, gr.centrality, 'closeness')
+
+        # eigenvector of an overlay starts from its parent's vector
+        gr.centrality('eigenvector')
+        overlay = gr.without([3])
+        self.assertIsNotNone(centrality.cache.warm_start(overlay))
+        eigens = nx.eigenvector_centrality(overlay.graph)
+        for node, eig in overlay.centrality('eigenvector').values.items():
+            self.assertAlmostEqual(eig, eigens[node], places=4)
+
+    def test_degree_distribution(self):
+        gr = GraphTest()
+        gr.graph = nx.MultiGraph(nx.barabasi_albert_graph(60, 2, seed=1))
+        gr.graph.add_edge(0, 1)
+        gr.touch()
+
+        counts = gr.degree_histogram()
+        self.assertEqual(counts.sum(), 60)
+        # one removal away is updated from the parent's histogram
+        overlay = gr.without([0]).without([1])
+        gr.without([0]).degree_histogram()
+        expected = np.bincount(nx.degree(overlay.graph).values())
+        self.assertListEqual(
+            list(overlay.degree_histogram()), list(expected)
+        )
+        self.assertIs(gr.degree_fit('loglog'), gr.degree_fit('loglog'))
+
+        # exponent of a sampled power law
+        rng = np.random.RandomState(0)
+        fit = degrees.powerlaw_mle(np.bincount(rng.zipf(2.5, 50000)))
+        self.assertAlmostEqual(fit['alpha'], 2.5, delta=0.1)
+        self.assertLess(fit['ks'], 0.05)
+
+    def test_routes(self):
+        """ 1-2-3 in a line along the equator with a 1-4-3 detour
+        """
+        gr = GraphTest()
+        gr.graph.add_edges_from([(1, 4), (4, 3)])
+        for node, lon in [(1, 0.), (2, 1.), (3, 2.)]:
+            gr.graph.node[node].update(latitude='0', longitude=str(lon))
+        gr.graph.node[4].update(latitude=1., longitude=1.)
+        gr.touch()
+
+        (cost, path), = gr.routes(1, 3)
+        self.assertListEqual(path, [1, 2, 3])
+        self.assertAlmostEqual(cost, 2 * 111.19, places=1)
+        (bcost, bpath), = gr.routes(1, 3, algorithm='bidirectional')
+        self.assertListEqual(bpath, path)
+        self.assertAlmostEqual(bcost, cost)
+
+        paths = gr.routes(1, 3, k=5)
+        self.assertListEqual([p for _, p in paths], [[1, 2, 3], [1, 4, 3]])
+        self.assertListEqual(gr.routes(1, 3, max_hops=1), [])
+        self.assertListEqual(
+            [p for _, p in gr.without([2]).routes(1, 3)], [[1, 4, 3]]
+        )
+        self.assertRaises(ValueError, gr.routes, 1, 3, cost='time')
+
+        # busy flights stay short when a node has no coordinates, its
+        # edges cost the mean length of the others
+        gr.graph.add_edges_from([(1, 5), (5, 3)], weight=1)
+        for u, v in [(1, 2), (2, 3)]:
+            gr.graph[u][v]['weight'] = 1000
+        gr.touch()
+        router = gr.router()
+        (cost, path), = router.routes(1, 3)
+        self.assertListEqual(path, [1, 2, 3])
+        self.assertAlmostEqual(cost, 2 * 111.19, places=1)
+        self.assertAlmostEqual(
+            router.edge_cost(1, 5),
+            (2 * 111.19 + 2 * router.edge_cost(1, 4)) / 4, places=1
+        )
+
+    def test_hub_labels(self):
+        gr = GraphTest()
+        gr.graph = nx.connected_watts_strogatz_graph(30, 4, 0.3, seed=2)
+        for i, (u, v) in enumerate(gr.graph.edges()):
+            gr.graph[u][v]['weight'] = 1 + (i * 7) % 5
+        gr.touch()
+        router = gr.router('weight')
+        labels = hublabels.HubLabels.build(gr, 'weight')
+
+        tmp = tempfile.mkdtemp()
+        try:
+            labels.save(os.path.join(tmp, 'labels.npz'))
+            labels = hublabels.HubLabels.load(
+                os.path.join(tmp, 'labels.npz')
+            )
+        finally:
+            shutil.rmtree(tmp)
+
+        for u in gr.graph:
+            for v in gr.graph:
+                cost, path = labels.query(u, v)
+                self.assertAlmostEqual(cost, router.astar(u, v)[0])
+                self.assertAlmostEqual(cost, router.path_cost(path))
+                self.assertListEqual([path[0], path[-1]], [u, v])
+
+        # paths through removed nodes are searched for again
+        overlay = gr.without([labels.query(0, 15)[1][1]])
+        router = routing.Router(
+            overlay.graph, {}, 'weight', labels, overlay.removed
+        )
+        self.assertIsNone(router.labelled(0, 15))
+        (cost, path), = router.routes(0, 15)
+        self.assertTrue(overlay.removed.isdisjoint(path))
+
+    def test_n_degree_partition(self):
+        gr = graph.N_degree_partition(seed=3)
+        self.assertEqual(gr.version, graph.N_degree_partition(seed=3).version)
+        self.assertTrue(gr.d3)
+        # pruned and numbered from zero
+        self.assertListEqual(
+            sorted(gr.graph.nodes()), range(gr.graph.number_of_nodes())
+        )
+        self.assertEqual(len(nx.isolates(gr.graph)), 0)
+        # edges only join adjacent partitions
+        for u, v in gr.graph.edges():
+            self.assertEqual(
+                abs(gr.graph.node[u]['colour'] - gr.graph.node[v]['colour']),
+                1
+            )
+        # 2 * 50 * 50 pairs with p = 0.1
+        self.assertTrue(400 < gr.graph.number_of_edges() < 600)
+
+        rng = np.random.RandomState(0)
+        picks = graph.bernoulli_indices(rng, 100000, 0.01)
+        self.assertEqual(len(picks), len(set(picks)))
+        self.assertTrue(900 < len(picks) < 1100)
+        self.assertTrue(picks.max() < 100000)
+
+    def test_snapshot(self):
+        gr = GraphTest()
+        gr.graph = nx.MultiGraph()
+        gr.graph.add_edge(1, 2, line='a', weight=2.5)
+        gr.graph.add_edge(1, 2, line='b')
+        gr.graph.add_node(1, name=u'K\xf6ln', code='KLN')
+        gr.graph.add_node(3, colour=0)
+        gr.touch()
+
+        tmp = tempfile.mkdtemp()
+        path = snapshot.path
+        snapshot.path = lambda gr: os.path.join(tmp, 'test')
+        try:
+            snapshot.save(gr)
+            loaded = GraphTest.__new__(GraphTest)
+            self.assertTrue(snapshot.load(loaded))
+        finally:
+            snapshot.path = path
+            shutil.rmtree(tmp)
+
+        self.assertEqual(loaded.version, gr.version)
+        self.assertTrue(loaded.graph.is_multigraph())
+        self.assertDictEqual(loaded.graph.node, gr.graph.node)
+        self.assertItemsEqual(
+            loaded.graph.edges(data=True), gr.graph.edges(data=True)
+        )
+
+    def test_snapshot_sources(self):
+        class Sourced(GraphTest):
+            sources = ('flights', 'airports')
+        gr = Sourced()
+        tmp = tempfile.mkdtemp()
+        path = snapshot.path
+        sources_hash = snapshot.sources_hash
+        snapshot.path = lambda gr: os.path.join(tmp, 'test')
+        meta = os.path.join(tmp, 'test', 'meta.json')
+        # the sources in data/test
+        testing = app.config['TESTING']
+        app.config['TESTING'] = True
+        try:
+            snapshot.save(gr)
+
+            # unchanged sizes and mtimes don't read the sources
+            def unread(gr):
+                raise AssertionError('sources read')
+            snapshot.sources_hash = unread
+            self.assertTrue(snapshot.load(Sourced.__new__(Sourced)))
+            snapshot.sources_hash = sources_hash
+
+            # a touched source with the same contents is still fresh
+            with open(meta) as f:
+                data = json.load(f)
+            data['stats'][0][2] -= 1
+            with open(meta, 'w') as f:
+                json.dump(data, f)
+            self.assertTrue(snapshot.load(Sourced.__new__(Sourced)))
+
+            data['sources'] = 'changed'
+            with open(meta, 'w') as f:
+                json.dump(data, f)
+            self.assertFalse(snapshot.load(Sourced.__new__(Sourced)))
+        finally:
+            app.config['TESTING'] = testing
+            snapshot.path = path
+            snapshot.sources_hash = sources_hash
+            shutil.rmtree(tmp)
+
     def test_d3_forced_layout(self):
         self.assertRaises(
             NotImplementedError,
@@ -168,6 +1107,14 @@ class TestGraph(unittest.TestCase):
         for node in self.gr.graph.nodes(data=True):
             self.assertEqual(node[0], node[1]['nodeID'])
 
+        # the server side layout is scaled to the size asked for
+        edges, nodes = self.gr.d3_forced_layout(size=(900, 560))
+        self.assertIs(self.gr.spring_layout(), self.gr.spring_layout())
+        for node in nodes:
+            self.assertTrue(0 <= node['layout_x'] <= 900)
+            self.assertTrue(0 <= node['layout_y'] <= 560)
+            self.assertNotIn('layout_x', self.gr.graph.node[node['nodeID']])
+
         # get d3 layout and check source and target are present
         # note I have set first label to zero
         edges, nodes = self.gr.d3_forced_layout()
@@ -182,5 +1129,28 @@ class TestGraph(unittest.TestCase):
             self.assertTrue(present)
 
 
+class TestBenchmarks(unittest.TestCase):
+    def test_networks(self):
+        path = tempfile.mkdtemp()
+        try:
+            codes = networks.write_airports(path, 30, seed=1)
+            self.assertEqual(len(set(codes)), 30)
+            with open(os.path.join(path, 'flights.csv')) as f:
+                self.assertEqual(len(f.readlines()), (30 - 2) * 2)
+            networks.write_underground(path, 20, lines=3, seed=1)
+            with open(os.path.join(path, 'stations.json')) as f:
+                self.assertEqual(len(json.load(f)), 20)
+        finally:
+            shutil.rmtree(path)
+
+    def test_compare(self):
+        baseline = {'a': {'p50': 1.}, 'b': {'p50': 1.}, 'c': {'p50': 1.}}
+        results = {'a': {'p50': 1.1}, 'b': {'p50': 1.5}, 'd': {'p50': 9.}}
+        self.assertEqual(
+            run.compare(results, baseline, threshold=0.2),
+            [('b', 1., 1.5)]
+        )
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,25 +1,214 @@
+import functools
+import time
+
 from collections import OrderedDict
 from operator import itemgetter
 
-from app import app
-from app.graph import Graph, N_degree_partition, Underground
+from flask import Response, g, request, session
+
+from app import app, instrument, jobs, sampling
+from app.cache import BytesCache, LRUCache
+from app.graph import Graph, N_degree_partition, Underground, fingerprint
+
+NETWORKS = {
+    'network': Graph,
+    'underground': Underground,
+    'random': N_degree_partition,
+}
+
+# one read-only graph per network shared by every session
+base_graphs = {}
+# session overlays keyed on version
+overlays = LRUCache(maxsize=64)
+# (mimetype, body) of responses keyed on (endpoint, arguments, graph
+# version)
+responses = BytesCache(
+    maxbytes=lambda: app.config.get(
+        'RESPONSE_CACHE_BYTES', 64 * 1024 * 1024
+    ),
+    size=lambda entry: len(entry[1])
+)
+
+
+def get_base_graph(key='network'):
+    if key not in base_graphs or app.debug:
+        gr = NETWORKS[key]()
+        if gr.backend == 'sparse':
+            # build the CSR copy at load time, overlays share it
+            gr.csr
+        base_graphs[key] = gr
+    return base_graphs[key]
+
 
+@instrument.timed('session')
+def get_removed(session, key='network'):
+    """ the nodes a session has removed from a network
+    """
+    removed = session.get(key)
+    if not isinstance(removed, list):
+        # sessions used to hold the whole graph
+        removed = []
+        session[key] = removed
+    return removed
 
+
+@instrument.timed('get_graph')
 def get_graph(session, key='network'):
-    if key not in session or app.debug:
-        if key == 'network':
-            gr = Graph()
-        elif key == 'underground':
-            gr = Underground()
-        elif key == 'random':
-            gr = N_degree_partition()
-        session[key] = gr
-        return gr
-    else:
-        return session[key]
+    """ the base graph with the session's removed nodes filtered out
+
+    the session only stores the list of removed nodes
+    """
+    base = get_base_graph(key)
+    removed = get_removed(session, key)
+    if not removed:
+        return base
+
+    version = base.version_without(removed)
+    gr = overlays.get(version)
+    if gr is None:
+        gr = overlays.set(version, base.without(removed))
+    return gr
+
+
+def remove_node(session, node, key='network'):
+    """ remove a node from the session's graph
+    returns False if the node is not in the graph
+    """
+    gr = get_graph(session, key)
+    if node not in gr.graph:
+        return False
+    session[key] = get_removed(session, key) + [node]
+    return True
+
+
+def cached_response(key='network'):
+    """ cache the body of a GET view per graph version and answer
+    If-None-Match requests with 304
+
+    the graph is the session's graph of key, or of the view's network
+    argument when it has one. A body with values of another graph, while
+    page_metrics jobs run, is neither kept nor tagged
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            network = kwargs.get('network', key)
+            if request.method != 'GET' or network not in NETWORKS:
+                return view(*args, **kwargs)
+
+            gr = get_graph(session, network)
+            cache_key = (
+                request.endpoint,
+                tuple(sorted(kwargs.items())),
+                tuple(sorted(request.args.items(multi=True))),
+                'gzip' in request.accept_encodings,
+                gr.version
+            )
+            etag = fingerprint(cache_key)
+            if request.if_none_match.contains(etag):
+                response = Response(status=304)
+            else:
+                entry = responses.get(cache_key)
+                if entry is not None:
+                    response = Response(entry[1], mimetype=entry[0])
+                else:
+                    response = view(*args, **kwargs)
+                    if response.status_code != 200 or g.get('pending'):
+                        return response
+                    # streamed bodies are sent as they are made, not kept
+                    if not response.is_streamed:
+                        responses.set(cache_key, (
+                            response.mimetype, response.get_data()
+                        ))
+            response.set_etag(etag)
+            # the body depends on the session's graph
+            response.headers['Cache-Control'] = 'private, no-cache'
+            response.vary.add('Cookie')
+            return response
+        return wrapper
+    return decorator
+
+
+def approximate(gr, compute=True):
+    """ the sampled estimate of gr pages use when it has more than
+    APPROXIMATE_ABOVE nodes, None otherwise or if not yet computed
+    """
+    threshold = app.config.get('APPROXIMATE_ABOVE')
+    if threshold is None or len(gr.graph) <= threshold:
+        return None
+    args = (
+        app.config.get('APPROXIMATE_EPSILON'),
+        app.config.get('APPROXIMATE_CONFIDENCE', 0.95),
+        app.config.get('APPROXIMATE_BUDGET'),
+        app.config.get('RANDOM_SEED')
+    )
+    if not compute:
+        return sampling.estimates.get((gr.version,) + args)
+    return gr.estimate(*args)
+
+
+def vulnerability(gr, key='network', limit=5):
+    """ vulnerability table for a page, exact if the app is set up to
+    and estimated on large graphs otherwise
+    """
+    if not app.config.get('EXACT_VULNERABILITY'):
+        estimate = approximate(gr)
+        if estimate is not None:
+            return gr.vulnerability(
+                limit=limit, efficiencies=estimate.efficiencies
+            )
+        return gr.vulnerability(limit=limit)
+    return gr.vulnerability(
+        limit=limit,
+        exact=True,
+        network=key,
+        deadline=time.time() + app.config['VULNERABILITY_TIMEOUT']
+    )
+
+
+def compute_metric(gr, key, metric, limit=5):
+    """ the top limit nodes of gr by 'degree', 'eigenvector',
+    'betweenness' or 'vulnerability', betweenness sampled on large graphs
+    """
+    if metric == 'vulnerability':
+        return vulnerability(gr, key, limit)[1]
+    if metric == 'betweenness':
+        estimate = approximate(gr)
+        if estimate is not None:
+            return sort_degrees(estimate.betweenness, limit)
+    return sort_degrees(gr.centrality(metric), limit)
+
+
+def page_metrics(gr, key='network', limit=5,
+                 metrics=('degree', 'eigenvector', 'vulnerability')):
+    """ ({metric: top limit nodes}, pending jobs) for a page
+
+    with BACKGROUND_METRICS the values come from the job pool and may be
+    those of an earlier graph while the jobs run. A metric that fails,
+    eigenvector centrality not converging, is empty
+    """
+    values = {}
+    pending = []
+    for metric in metrics:
+        if app.config.get('BACKGROUND_METRICS'):
+            value, job = jobs.manager.get(gr, key, metric, limit, {})
+            if job is not None:
+                pending.append(job)
+                # see cached_response
+                g.pending = True
+        else:
+            try:
+                value = compute_metric(gr, key, metric, limit)
+            except Exception:
+                value = {}
+        values[metric] = value
+    return values, pending
 
 
 def sort_degrees(V, limit=None):
+    if hasattr(V, 'top'):
+        # a centrality.Ranking is already in order
+        return V.top(limit)
     V = OrderedDict(
         sorted(
             V.iteritems(), key=itemgetter(1), reverse=True
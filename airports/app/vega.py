@@ -1,12 +1,19 @@
+import json
+
 from collections import OrderedDict
 
 from flask import url_for
 
 
+def dumps(obj):
+    return json.dumps(obj, separators=(',', ':'))
+
+
 class BaseAirPlot(object):
     width = 900
     height = 560
     padding = {"top": 25, "left": 0, "right": 0, "bottom": 0}
+    renderer = 'svg'
 
     def get_json(self, **kwargs):
         spec = OrderedDict()
@@ -23,11 +30,44 @@ class BaseAirPlot(object):
 
         response = OrderedDict({
             "spec": spec,
-            "renderer": 'svg'
+            "renderer": self.renderer
         })
 
         return response
 
+    def fragments(self):
+        """ the spec parts serialised once per class, None stands in for
+        the data which depends on the request
+        """
+        cls = type(self)
+        fragments = cls.__dict__.get('_fragments')
+        if fragments is None:
+            fragments = OrderedDict([
+                ('width', dumps(self.width)),
+                ('height', dumps(self.height)),
+                ('padding', dumps(self.padding)),
+                ('data', None),
+                ('scales', dumps(self.get_scales())),
+                ('signals', dumps(self.get_signals())),
+                ('predicates', dumps(self.get_predicates())),
+                ('marks', dumps(self.get_marks())),
+                ('axes', dumps(self.get_axes())),
+            ])
+            cls._fragments = fragments
+        return fragments
+
+    def to_json(self, **kwargs):
+        """ get_json serialised, only the data is encoded per call
+        """
+        spec = ','.join(
+            '%s:%s' % (
+                dumps(key),
+                dumps(self.get_data(**kwargs)) if value is None else value
+            )
+            for key, value in self.fragments().iteritems()
+        )
+        return '{"spec":{%s},"renderer":%s}' % (spec, dumps(self.renderer))
+
     def get_data(self):
         raise NotImplementedError
 
@@ -53,32 +93,34 @@ class Scatter(BaseAirPlot):
     padding = {"top": 0, "left": 25, "right": 0, "bottom": 25}
 
     def get_data(self, **kwargs):
+        # the points and the fit come in one list
         return [
             {
-                "name": "points",
+                "name": "distribution",
                 "url": url_for(
                     "degree",
-                    plot_type='scatter',
+                    plot_type='distribution',
                     network=kwargs['network']
                 ),
                 "format": {
                     "type": "json",
                     "parse": "auto",
-                    "property": "scatter_points"
+                    "property": "distribution"
                 },
             },
+            {
+                "name": "points",
+                "source": "distribution",
+                "transform": [
+                    {"type": "filter", "test": "datum.group == 'points'"}
+                ]
+            },
             {
                 "name": "bestfit",
-                "url": url_for(
-                    "degree",
-                    plot_type='powerlaw',
-                    network=kwargs['network']
-                ),
-                "format": {
-                    "type": "json",
-                    "parse": "auto",
-                    "property": "bestfit"
-                },
+                "source": "distribution",
+                "transform": [
+                    {"type": "filter", "test": "datum.group == 'bestfit'"}
+                ]
             }
         ]
 
@@ -164,19 +206,53 @@ class Scatter(BaseAirPlot):
 
 
 class BareMap(BaseAirPlot):
+    scaling = 1200
+    trans_x = 450
+    trans_y = 280
+    # ?bbox of what the map shows, the pages send it, Alaska's insets
+    # cross the antimeridian
+    viewport = '172,18,-66,72'
+
     def get_data(self, **kwargs):
         src = kwargs['src']
         dst = kwargs['dst']
 
         flight_url = url_for("flights")
 
-        routes_url = flight_url
+        # without a route the routes are every flight, which traffic
+        # has already fetched
+        routes = {"source": "flights"}
         if src and dst:
-            routes_url = url_for(
-                "flights",
-                departure_code=src,
-                destination_code=dst
-            )
+            routes = {
+                "url": url_for(
+                    "flights",
+                    departure_code=src,
+                    destination_code=dst
+                ),
+                "format": {
+                    "type": "json",
+                    "parse": "auto",
+                    "property": "flight_data"
+                }
+            }
+        routes["name"] = "routes"
+        routes["transform"] = [
+            {
+                "type": "lookup",
+                "on": "airports",
+                "onKey": "code",
+                "keys": ["origin", "destination"],
+                "as": ["_source", "_target"]
+            },
+            {
+                "type": "filter",
+                "test": "datum._source && datum._target"
+            },
+            {
+                "type": "linkpath",
+                "shape": "line"
+            }
+        ]
         return [
             {
                 "name": "states",
@@ -185,18 +261,23 @@ class BareMap(BaseAirPlot):
                 "transform": [
                     {
                         "type": "geopath", "projection": "albersUsa",
-                        "scale": 1200, "translate": [450, 280]
+                        "scale": self.scaling,
+                        "translate": [self.trans_x, self.trans_y]
                     }
                 ]
             },
             {
-                "name": "traffic",
+                "name": "flights",
                 "url": flight_url,
                 "format": {
                     "type": "json",
                     "parse": "auto",
                     "property": "flight_data"
-                },
+                }
+            },
+            {
+                "name": "traffic",
+                "source": "flights",
                 "transform": [
                     {
                         "type": "aggregate", "groupby": ["origin"],
@@ -212,59 +293,49 @@ class BareMap(BaseAirPlot):
             },
             {
                 "name": "airports",
-                "url": url_for("airports"),
+                # projected on the server, every one so that no route
+                # loses an end
+                "url": url_for(
+                    "airports",
+                    projection="albersUsa",
+                    scale=self.scaling,
+                    translate="%s,%s" % (self.trans_x, self.trans_y)
+                ),
                 "format": {
                     "type": "json",
                     "parse": "auto",
                     "property": "airport_data"
-                },
-                "transform": [
-                    {
-                        "type": "lookup", "on": "traffic", "onKey": "origin",
-                        "keys": ["code"], "as": ["traffic"]
-                    },
-                    {
-                        "type": "filter",
-                        "test": "datum.traffic != null"
-                    },
-                    {
-                        "type": "geo", "projection": "albersUsa",
-                        "scale": 1200, "translate": [450, 280],
-                        "lon": "longitude", "lat": "latitude"
-                    },
-                    {
-                        "type": "filter",
-                        "test": "datum.layout_x != null && datum.layout_y != null"
-                    },
-                    {"type": "sort", "by": "-traffic.flights"}
-                ]
+                }
             },
             {
-                "name": "routes",
-                "url": routes_url,
+                "name": "airport_marks",
+                # only those the map shows, one per pixel
+                "url": url_for(
+                    "airports",
+                    projection="albersUsa",
+                    scale=self.scaling,
+                    translate="%s,%s" % (self.trans_x, self.trans_y),
+                    resolution=1,
+                    bbox=kwargs.get('bbox')
+                ),
                 "format": {
                     "type": "json",
                     "parse": "auto",
-                    "property": "flight_data"
+                    "property": "airport_data"
                 },
                 "transform": [
                     {
-                        "type": "lookup",
-                        "on": "airports",
-                        "onKey": "code",
-                        "keys": ["origin", "destination"],
-                        "as": ["_source", "_target"]
+                        "type": "lookup", "on": "traffic", "onKey": "origin",
+                        "keys": ["code"], "as": ["traffic"]
                     },
                     {
                         "type": "filter",
-                        "test": "datum._source && datum._target"
+                        "test": "datum.traffic != null"
                     },
-                    {
-                        "type": "linkpath",
-                        "shape": "line"
-                    }
+                    {"type": "sort", "by": "-traffic.flights"}
                 ]
-            }
+            },
+            routes
         ]
 
     def get_marks(self):
@@ -282,7 +353,7 @@ class BareMap(BaseAirPlot):
             },
             {
                 "type": "symbol",
-                "from": {"data": "airports"},
+                "from": {"data": "airport_marks"},
                 "properties": {
                     "enter": {
                         "x": {"field": "layout_x"},
@@ -396,6 +467,8 @@ class LondonMap(BaseAirPlot):
     scaling = 41000
     trans_x = 480
     trans_y = 43350
+    # ?bbox of what the map shows, the pages send it
+    viewport = '-0.65,51.25,0.35,51.75'
 
     def get_data(self, **kwargs):
         line = None
@@ -424,22 +497,32 @@ class LondonMap(BaseAirPlot):
             },
             {
                 "name": "stations",
-                "url": url_for("stations"),
+                # projected on the server, every one so that no line
+                # loses an end
+                "url": url_for(
+                    "stations",
+                    projection="mercator",
+                    scale=self.scaling,
+                    translate="%s,%s" % (self.trans_x, self.trans_y)
+                ),
                 "format": {
                     "property": "stations"
-                },
-                "transform": [
-                    {
-                        "type": "geo", "projection": "mercator",
-                        "scale": self.scaling,
-                        "translate": [self.trans_x, self.trans_y],
-                        "lon": "longitude", "lat": "latitude"
-                    },
-                    {
-                        "type": "filter",
-                        "test": "datum.layout_x != null && datum.layout_y != null"
-                    },
-                ]
+                }
+            },
+            {
+                "name": "station_marks",
+                # only those the map shows, one per pixel
+                "url": url_for(
+                    "stations",
+                    projection="mercator",
+                    scale=self.scaling,
+                    translate="%s,%s" % (self.trans_x, self.trans_y),
+                    resolution=1,
+                    bbox=kwargs.get('bbox')
+                ),
+                "format": {
+                    "property": "stations"
+                }
             },
             {
                 "name": "lines",
@@ -484,7 +567,7 @@ class LondonMap(BaseAirPlot):
             },
             {
                 "type": "symbol",
-                "from": {"data": "stations"},
+                "from": {"data": "station_marks"},
                 "properties": {
                     "enter": {
                         "x": {"field": "layout_x"},
@@ -594,53 +677,68 @@ class LondonMap(BaseAirPlot):
 
 
 class LondonForced(BaseAirPlot):
+    # full runs the browser's force simulation from scratch, short runs a
+    # few ticks of it over the server layout and none draws that layout
+    simulations = ('full', 'short', 'none')
+    short_iterations = 30
+
     def get_data(self, **kwargs):
-        if 'url' in kwargs:
-            url = url_for(kwargs['url'], network=kwargs['network'])
-            if 'params' in kwargs:
-                url = url_for(
-                    kwargs['url'],
-                    network=kwargs['network'],
-                    params=kwargs['params']
-                )
-        else:
+        simulate = kwargs.get('simulate', 'full')
+        if 'url' not in kwargs:
             raise NotImplementedError
+        # nodes and edges come in one list and are split apart here
+        args = {
+            'network': kwargs['network'],
+            'params': kwargs.get('params'),
+            'format': 'elements'
+        }
+        if simulate != 'full':
+            # ask for the server side layout at the spec's size
+            args.update(width=self.width, height=self.height)
+        url = url_for(kwargs['url'], **args)
+
+        force = {
+            "type": "force",
+            "links": "edges",
+            "linkDistance": 100,
+            "linkStrength": 5,
+            "charge": -700,
+            "interactive": True
+        }
+        if simulate == 'short':
+            force["iterations"] = self.short_iterations
+
+        nodes = [{"type": "filter", "test": "datum.group == 'nodes'"}]
+        if simulate != 'none':
+            nodes.append(force)
 
         return [
             {
-                "name": "edges",
+                "name": "elements",
                 "url": url,
                 "format": {
                     "type": "json",
                     "parse": "auto",
-                    "property": "edges"
-                },
+                    "property": "elements"
+                }
+            },
+            {
+                "name": "edges",
+                "source": "elements",
                 "transform": [
                     {
                         "type": "filter",
-                        "test": "datum.source && datum.target"
+                        "test": (
+                            "datum.group == 'edges' && "
+                            "datum.source && datum.target"
+                        )
                     }
                 ]
-
             },
             {
                 "name": "nodes",
-                "url": url,
-                "format": {
-                    "type": "json",
-                    "parse": "auto",
-                    "property": "nodes"
-                },
-                "transform": [
-                    {
-                        "type": "force",
-                        "links": "edges",
-                        "linkDistance": 100,
-                        "linkStrength": 5,
-                        "charge": -700,
-                        "interactive": True
-                    }
-                ]
+                "source": "elements",
+                "transform": nodes
             }
         ]
 
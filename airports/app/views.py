@@ -1,10 +1,7 @@
-from collections import Counter
 import urllib
 import urlparse
 from flask import (
     abort,
-    jsonify,
-    render_template,
     request,
     Response,
     session,
@@ -13,7 +10,11 @@ from flask import (
 import networkx as nx
 import numpy as np
 
-from app import app, nav, utils, vega
+from app import (
+    app, columnar, disruption, instrument, jobs, nav, projection, routing,
+    spatial, streaming, utils, vega
+)
+from app.instrument import jsonify, render_template
 
 
 nav.Bar('top', [
@@ -29,27 +30,71 @@ def network_test(network):
     return False
 
 
+def viewport():
+    """ (west, south, east, north) of ?bbox=west,south,east,north or of
+    the web map ?tile=z/x/y, None without either
+    """
+    try:
+        if 'tile' in request.args:
+            return spatial.parse_tile(request.args['tile'])
+        if 'bbox' in request.args:
+            return spatial.parse_bbox(request.args['bbox'])
+    except ValueError:
+        abort(400)
+    return None
+
+
+def json_int(value):
+    """ whether a value of a JSON body is an integer, true and false
+    are not
+    """
+    return isinstance(value, (int, long)) and not isinstance(value, bool)
+
+
+def within_bbox(gr):
+    """ nodes of gr inside the viewport
+    """
+    return gr.within_bbox(viewport())
+
+
+def projected(gr):
+    """ [(node, x, y)] of the nodes of gr inside the viewport placed by
+    ?projection with ?scale and ?translate, one per ?resolution pixels
+    """
+    try:
+        name, scale, translate = projection.parse(
+            request.args['projection'],
+            request.args.get('scale'),
+            request.args.get('translate')
+        )
+        resolution = float(request.args.get('resolution', 0))
+        if not 0 <= resolution < float('inf'):
+            raise ValueError('bad resolution %s' % (resolution,))
+    except ValueError:
+        abort(400)
+    return gr.project(
+        name, scale, translate, bbox=viewport(), resolution=resolution
+    )
+
+
 @app.route('/')
 @app.route('/index')
 def index():
     gr = utils.get_graph(session)
-    _, v = gr.vulnerability(limit=5)
-    degrees = utils.sort_degrees(
-        nx.degree_centrality(gr.graph), limit=5
-    )
-    try:
-        eigens = utils.sort_degrees(
-            nx.eigenvector_centrality(gr.graph), limit=5
-        )
-    except:
-        eigens = {}
+    metrics, pending = utils.page_metrics(gr, metrics=(
+        'degree', 'eigenvector', 'betweenness', 'vulnerability'
+    ))
 
     return render_template(
         'home.html',
         airports=gr.get_current_nodes,
-        degrees=degrees,
-        eigens=eigens,
-        vulnerability=v
+        degrees=metrics['degree'],
+        eigens=metrics['eigenvector'],
+        betweenness=metrics['betweenness'],
+        vulnerability=metrics['vulnerability'],
+        estimate=utils.approximate(gr, compute=False),
+        viewport=vega.BareMap.viewport,
+        jobs=pending
     )
 
 
@@ -59,24 +104,29 @@ def route():
     return render_template(
         'route.html',
         airports=gr.get_current_nodes,
+        viewport=vega.BareMap.viewport
     )
 
 
 @app.route('/london')
 def london():
     gr = utils.get_graph(session, key='underground')
-    _, v = gr.vulnerability(limit=5)
+    metrics, pending = utils.page_metrics(
+        gr, key='underground',
+        metrics=('degree', 'betweenness', 'vulnerability')
+    )
     forced_list = ','.join(['line'])
 
     return render_template(
         'london.html',
         stations=gr.get_current_nodes,
         lines=gr.get_current_lines,
-        degrees=utils.sort_degrees(
-            nx.degree_centrality(gr.graph), limit=5
-        ),
-        vulnerability=v,
-        force=urllib.urlencode({'params': forced_list})
+        degrees=metrics['degree'],
+        betweenness=metrics['betweenness'],
+        vulnerability=metrics['vulnerability'],
+        force=urllib.urlencode({'params': forced_list}),
+        viewport=vega.LondonMap.viewport,
+        jobs=pending
     )
 
 
@@ -84,24 +134,16 @@ def london():
 @app.route('/random/<random_type>')
 def random():
     gr = utils.get_graph(session, key='random')
-    _, v = gr.vulnerability(limit=5)
-
-    degrees = utils.sort_degrees(
-        nx.degree_centrality(gr.graph), limit=5
-    )
-    try:
-        eigens = utils.sort_degrees(
-            nx.eigenvector_centrality(gr.graph), limit=5
-        )
-    except:
-        eigens = {}
+    metrics, pending = utils.page_metrics(gr, key='random')
 
     return render_template(
         'random.html',
         nodes=gr.graph.edges(),
-        degrees=degrees,
-        eigens=eigens,
-        vulnerability=v,
+        degrees=metrics['degree'],
+        eigens=metrics['eigenvector'],
+        vulnerability=metrics['vulnerability'],
+        estimate=utils.approximate(gr, compute=False),
+        jobs=pending
     )
 
 
@@ -109,10 +151,13 @@ def random():
 @app.route('/map')
 @app.route('/map/<departure_code>/<destination_code>')
 def map(departure_code=None, destination_code=None):
-    return jsonify(
-        **vega.BareMap().get_json(
-            **{'src': departure_code, 'dst': destination_code}
-        )
+    return Response(
+        vega.BareMap().to_json(**{
+            'src': departure_code,
+            'dst': destination_code,
+            'bbox': request.args.get('bbox')
+        }),
+        mimetype='application/json'
     )
 
 
@@ -120,8 +165,9 @@ def map(departure_code=None, destination_code=None):
 def histogram(network=None):
     if not network_test(network):
         abort(404)
-    return jsonify(
-        **vega.Scatter().get_json(**{'network': network})
+    return Response(
+        vega.Scatter().to_json(**{'network': network}),
+        mimetype='application/json'
     )
 
 
@@ -134,8 +180,11 @@ def london_map(line=None):
     if line and line not in lines:
         abort(404)
 
-    return jsonify(
-        **vega.LondonMap().get_json(**{'line': line})
+    return Response(
+        vega.LondonMap().to_json(
+            **{'line': line, 'bbox': request.args.get('bbox')}
+        ),
+        mimetype='application/json'
     )
 
 
@@ -145,21 +194,79 @@ def forced(network=None):
         abort(404)
 
     params = request.args.get('params')
+    simulate = request.args.get('simulate', 'full')
+    if simulate not in vega.LondonForced.simulations:
+        abort(404)
 
-    return jsonify(
-        **vega.LondonForced().get_json(
+    return Response(
+        vega.LondonForced().to_json(
             **{
                 'url': 'forcedlayout',
                 'network': network,
-                'params': params
+                'params': params,
+                'simulate': simulate
             }
-        )
+        ),
+        mimetype='application/json'
     )
 
 
 # APIs
+@app.route('/internal/metrics')
+def internal_metrics():
+    """ span and request timings of this process for Prometheus, not
+    found unless INTERNAL_METRICS is set
+    """
+    if not app.config.get('INTERNAL_METRICS'):
+        abort(404)
+    return Response(
+        instrument.registry.exposition(),
+        mimetype='text/plain; version=0.0.4'
+    )
+
+
+@app.route('/jobs/<job_id>')
+def job(job_id=None):
+    """ state of a background metric job, see utils.page_metrics
+    """
+    job = jobs.manager.status(job_id)
+    if job is None:
+        abort(404)
+    return jsonify(**job.as_dict())
+
+
+@app.route('/nearby')
+def nearby():
+    """ nodes of ?network within ?radius km of ?lat and ?lon, or its ?k
+    nearest, nearest first
+    """
+    network = request.args.get('network', 'network')
+    if not network_test(network):
+        abort(404)
+    lat = request.args.get('lat', None, type=float)
+    lon = request.args.get('lon', None, type=float)
+    radius = request.args.get('radius', None, type=float)
+    k = request.args.get('k', None, type=int)
+    if (
+            lat is None or lon is None or not -90 <= lat <= 90 or
+            radius is not None and radius < 0 or
+            k is not None and not 0 < k <= 1000
+    ):
+        abort(400)
+
+    gr = utils.get_graph(session, key=network)
+    found = []
+    for km, node in gr.nearby(lat, lon, radius=radius, k=k):
+        data = dict(gr.graph.node[node])
+        data['node'] = node
+        data['distance'] = km
+        found.append(data)
+    return jsonify(nodes=found)
+
+
 @app.route('/airports', methods=['GET', 'POST'])
 @app.route('/airports/<airport_code>', methods=['GET', 'DELETE'])
+@utils.cached_response()
 def airports(airport_code=None):
     """ get information on an airport or return all airports
     """
@@ -168,71 +275,86 @@ def airports(airport_code=None):
         if airport_code:
             data = gr.get_current_nodes.get(airport_code) or None
             if data:
-                data['degree'] = nx.degree_centrality(
-                    gr.graph
-                )[airport_code]
+                # node data is shared with the base graph
+                data = dict(data)
+                data['degree'] = gr.centrality('degree')[airport_code]
                 # eigenvector centrality sometimes won't converge
                 try:
-                    eigens = nx.eigenvector_centrality(
-                        gr.graph
-                    )[airport_code]
-                except:
+                    eigens = gr.centrality('eigenvector')[airport_code]
+                except Exception:
                     eigens = 0
                 data['eigenvector'] = eigens
                 return jsonify(**data)
             else:
                 abort(404)
-        else:
-            return jsonify(airport_data=gr.get_current_nodes.values())
+        fmt = request.args.get('format')
+        if fmt in columnar.FORMATS:
+            return columnar.response(
+                'airport_data', gr.columns('airports'), fmt
+            )
+        nodes = gr.get_current_nodes
+        if 'projection' in request.args:
+            # placed for a map, see vega.BareMap
+            return jsonify(airport_data=[
+                dict(nodes[code], layout_x=x, layout_y=y)
+                for code, x, y in projected(gr) if code in nodes
+            ])
+        if 'bbox' in request.args or 'tile' in request.args:
+            # only the airports in a map's viewport
+            return jsonify(airport_data=[
+                nodes[code] for code in within_bbox(gr) if code in nodes
+            ])
+        return jsonify(airport_data=nodes.values())
 
     elif request.method == 'DELETE':
-        if airport_code:
-            try:
-                gr.graph.remove_node(airport_code)
-                return Response("Deleted", status=200)
-            except nx.NetworkXError:
-                pass
+        if airport_code and utils.remove_node(session, airport_code):
+            return Response("Deleted", status=200)
         return Response("Nothing to delete", status=204)
 
     elif request.method == 'POST':
-        # using this to refresh the graph
-        if 'network' in session:
-            session.pop('network', None)
-        gr = utils.get_graph(session)
+        # using this to refresh the graph, the base graph is untouched
+        # so dropping the session's removed nodes is enough
+        session.pop('network', None)
+        utils.get_graph(session)
         return Response("Restored", status=200)
 
 
 @app.route('/flights')
 @app.route('/flights/<departure_code>')
 @app.route('/flights/<departure_code>/<destination_code>')
+@utils.cached_response()
 def flights(departure_code=None, destination_code=None):
     gr = utils.get_graph(session)
-    airports = gr.get_current_nodes.keys()
-    if departure_code and departure_code not in airports:
+    if departure_code and departure_code not in gr.graph:
         abort(404)
 
-    if destination_code and destination_code not in airports:
+    if destination_code and destination_code not in gr.graph:
         abort(404)
 
     if departure_code and destination_code:
-        # get shortest paths
-        shortest_paths = []
+        # get the cheapest k routes
         try:
-            paths = nx.all_shortest_paths(
-                gr.graph,
+            paths = gr.routes(
                 departure_code,
-                destination_code
+                destination_code,
+                k=request.args.get('k', 1, type=int),
+                max_hops=request.args.get('max_hops', None, type=int),
+                algorithm=request.args.get('algorithm'),
+                cost=request.args.get('cost', 'distance')
             )
-        except:
-            paths = []
-        for path in paths:
+        except ValueError:
+            abort(400)
+        shortest_paths = []
+        for n, (cost, path) in enumerate(paths):
             # path is [a,b,c] and need [a, b] [
             shortest_paths.extend(
                 [
                     {
                         'origin': path[i],
                         'destination': path[i+1],
-                        'count': 1000
+                        'count': 1000,
+                        'route': n,
+                        'cost': cost
                     }
                     for i, _ in enumerate(path[:-1])
                 ]
@@ -250,48 +372,59 @@ def flights(departure_code=None, destination_code=None):
             for dst in neighbors
         ]
         return jsonify(flight_data=neighbors)
+    elif request.args.get('format') in columnar.FORMATS:
+        return columnar.response(
+            'flight_data', gr.columns('flights'), request.args['format']
+        )
     else:
-        data = []
-        # get all flights
-        edges = gr.graph.edges(data=True)
-        for edge in edges:
-            data.append({
+        # get all flights, encoded as the edges are walked
+        return streaming.response('flight_data', (
+            {
                 'origin': edge[0],
                 'destination': edge[1],
                 'count': edge[2]['weight']
-            })
-        return jsonify(flight_data=data)
+            }
+            for edge in gr.graph.edges_iter(data=True)
+        ))
 
 
 @app.route('/stations', methods=['GET'])
+@utils.cached_response('underground')
 def stations():
     gr = utils.get_graph(session, key='underground')
+    if 'projection' in request.args:
+        return jsonify(stations=[
+            dict(gr.graph.node[node], layout_x=x, layout_y=y)
+            for node, x, y in projected(gr)
+            if 'name' in gr.graph.node[node]
+        ])
+    if 'bbox' in request.args or 'tile' in request.args:
+        return jsonify(stations=[
+            gr.graph.node[node] for node in within_bbox(gr)
+            if 'name' in gr.graph.node[node]
+        ])
     return jsonify(stations=gr.get_current_nodes)
 
 
 @app.route('/lines', methods=['GET'])
 @app.route('/lines/<line>', methods=['GET'])
+@utils.cached_response('underground')
 def lines(line=None):
     gr = utils.get_graph(session, key='underground')
 
-    data = []
-    edges = gr.graph.edges(data=True)
-    for edge in edges:
-        if not line or line in edge[2]['line']:
-            data.append({
-                'source': edge[0],
-                'target': edge[1],
-                'line': edge[2]['line']
-            })
-    try:
-        data = jsonify(lines=data)
-    except:
-        abort(404)
-
-    return data
+    return streaming.response('lines', (
+        {
+            'source': edge[0],
+            'target': edge[1],
+            'line': edge[2]['line']
+        }
+        for edge in gr.graph.edges_iter(data=True)
+        if not line or line in edge[2]['line']
+    ))
 
 
 @app.route('/forcedlayout/<network>', methods=['GET'])
+@utils.cached_response()
 def forcedlayout(network=None):
     if not network:
         abort(404)
@@ -301,41 +434,183 @@ def forcedlayout(network=None):
     else:
         params = urlparse.parse_qs(params)['params'][0].split(',')
 
+    # a size asks for the server side layout, both positive integers
+    size = None
+    if 'width' in request.args or 'height' in request.args:
+        size = (
+            request.args.get('width', type=int),
+            request.args.get('height', type=int)
+        )
+        if None in size or min(size) < 1:
+            abort(400)
+
     gr = utils.get_graph(session, key=network)
 
-    edges, nodes = gr.d3_forced_layout(params)
+    edges, nodes = gr.d3_forced_layout(params, size=size)
 
+    if request.args.get('format') == 'elements':
+        # one list for specs that split it back into nodes and edges
+        elements = [dict(node, group='nodes') for node in nodes]
+        for edge in edges:
+            edge['group'] = 'edges'
+        return jsonify(elements=elements + edges)
     return jsonify(nodes=nodes, edges=edges)
 
 
 @app.route('/degree/<plot_type>/<network>')
+@utils.cached_response()
 def degree(plot_type=None, network=None):
     if not plot_type:
         abort(404)
-    if plot_type not in ['scatter', 'powerlaw']:
+    if plot_type not in ['scatter', 'powerlaw', 'distribution']:
         abort(404)
     if not network_test(network):
         abort(404)
 
     gr = utils.get_graph(session, key=network)
-    data = Counter(nx.degree(gr.graph).values())
+    counts = gr.degree_histogram()
+    scatter = [
+        {"x": int(k), "y": int(counts[k])}
+        for k in np.flatnonzero(counts)
+    ]
+    bestfit = [{"x": x, "y": y} for x, y in gr.degree_fit('loglog')]
     if plot_type == 'scatter':
-        data = [
-            {"x": int(k), "y": int(v)}
-            for k, v in data.iteritems()
-        ]
-        return jsonify(scatter_points=data)
+        return jsonify(scatter_points=scatter)
     elif plot_type == 'powerlaw':
-        x, y = data.keys(), data.values()
-        x = np.array(x)
-        y = np.log(np.array(y))
+        return jsonify(bestfit=bestfit)
+    # both in one list for the Scatter spec, and the power law exponent
+    for point in scatter:
+        point['group'] = 'points'
+    for point in bestfit:
+        point['group'] = 'bestfit'
+    return jsonify(
+        distribution=scatter + bestfit,
+        powerlaw=gr.degree_fit('mle')
+    )
 
-        grad, inter = np.polyfit(np.log(x), y, 1)
-        y = inter + (grad * np.log(x))
 
-        data = [
-            {"x": datum[0], "y": np.exp(datum[1])}
-            for datum in zip(x, y)
-            if not np.isnan(np.exp(datum[1]))
-        ]
-        return jsonify(bestfit=data)
+@app.route('/centrality/<metric>/<network>')
+@utils.cached_response()
+def centrality(metric=None, network=None):
+    """ the top ?limit nodes of a network by degree, eigenvector or
+    betweenness centrality, none if it fails as on the pages
+    """
+    if not network_test(network):
+        abort(404)
+    if metric not in ['degree', 'eigenvector', 'betweenness']:
+        abort(404)
+    limit = request.args.get('limit', 10, type=int)
+    if limit < 1:
+        abort(400)
+
+    gr = utils.get_graph(session, key=network)
+    try:
+        top = gr.centrality(metric).top(limit)
+    except nx.NetworkXException:
+        top = {}
+    return jsonify(
+        metric=metric,
+        nodes=[{'node': node, metric: value}
+               for node, value in top.iteritems()]
+    )
+
+
+@app.route('/journey/<origin>/<destination>')
+@utils.cached_response('underground')
+def journey(origin=None, destination=None):
+    """ the Underground journey between two stations, by name or id,
+    with the fewest stops plus ?penalty stops per change of line
+    """
+    gr = utils.get_graph(session, key='underground')
+    source = gr.planner.resolve(origin)
+    target = gr.planner.resolve(destination)
+    if source not in gr.graph or target not in gr.graph:
+        abort(404)
+
+    penalty = request.args.get('penalty', None, type=float)
+    if penalty is None:
+        penalty = app.config.get('INTERCHANGE_PENALTY', 3)
+    if penalty < 0:
+        abort(400)
+    try:
+        result = gr.journey(source, target, penalty)
+    except routing.NoRoute:
+        abort(404)
+    return jsonify(**result)
+
+
+@app.route('/estimate/<network>')
+@utils.cached_response()
+def estimate(network=None):
+    """ efficiency, closeness and betweenness estimated from sampled
+    sources to within ?epsilon with ?confidence, in at most ?budget
+    seconds, APPROXIMATE_BUDGET by default, with the error bounds
+    achieved
+    """
+    if not network_test(network):
+        abort(404)
+
+    epsilon = request.args.get('epsilon', None, type=float)
+    confidence = request.args.get('confidence', 0.95, type=float)
+    budget = request.args.get(
+        'budget', app.config.get('APPROXIMATE_BUDGET'), type=float
+    )
+    if (
+            not 0 < confidence < 1 or
+            epsilon is not None and not 0 < epsilon < 1 or
+            budget is not None and budget <= 0
+    ):
+        abort(400)
+
+    gr = utils.get_graph(session, key=network)
+    result = gr.estimate(
+        epsilon, confidence, budget,
+        seed=request.args.get('seed', None, type=int)
+    )
+    return jsonify(**result.as_dict(
+        limit=request.args.get('limit', 10, type=int)
+    ))
+
+
+@app.route('/disruption/<network>', methods=['POST'])
+def disrupt(network=None):
+    """ efficiency and largest component after removing each of a list
+    of nodes, or the nodes chosen by a strategy, in turn
+
+    the session's graph is left as it is
+    """
+    if not network_test(network):
+        abort(404)
+
+    gr = utils.get_graph(session, key=network)
+    body = request.get_json(silent=True) or {}
+    if not isinstance(body, dict):
+        abort(400)
+    if 'nodes' in body:
+        if not isinstance(body['nodes'], list) or not all(
+                isinstance(node, basestring) or json_int(node)
+                for node in body['nodes']
+        ):
+            abort(400)
+        nodes = [disruption.resolve(gr, node) for node in body['nodes']]
+        if None in nodes or len(set(nodes)) != len(nodes):
+            abort(400)
+    else:
+        steps = body.get('steps', 5)
+        seed = body.get('seed')
+        if (
+                not json_int(steps) or steps < 1 or
+                seed is not None and not json_int(seed)
+        ):
+            abort(400)
+        steps = min(steps, disruption.MAX_STEPS, len(gr.graph))
+        try:
+            nodes = disruption.order(
+                gr, body.get('strategy', 'degree'), steps,
+                network=network, seed=seed
+            )
+        except ValueError:
+            abort(400)
+    if len(nodes) > disruption.MAX_STEPS:
+        abort(400)
+    return jsonify(steps=disruption.simulate(gr, nodes))
@@ -0,0 +1,189 @@
+""" exact node vulnerability, (E - E_without_node) / E
+
+removing every node and recomputing the global efficiency is N all pairs
+computations so the removals are spread over a process pool. Tables can
+be precomputed offline for the airport and underground networks:
+
+    python -m app.vulnerability network underground
+"""
+from __future__ import division
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import time
+
+from collections import OrderedDict
+from operator import itemgetter
+
+from app import efficiency
+from app.cache import LRUCache
+from config import get_network_data as get
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# complete exact tables keyed on graph version, so a finished pool is not
+# started again for the version. One cut short by its deadline is not
+# kept, a later caller may have the time to finish it
+tables = LRUCache(maxsize=16)
+
+# per worker process state, see init_worker
+_graph = None
+_table = None
+
+
+def init_worker(gr):
+    global _graph, _table
+    _graph = gr
+    _table = efficiency.EfficiencyTable.build(gr)
+
+
+def efficiency_without(node):
+    """ global efficiency of the worker's graph without node
+    """
+    overlay = _graph.without([node])
+    table = _table.without(overlay, node, _graph.graph[node])
+    return node, sum(table.efficiencies().values())
+
+
+def rank(V, limit=None):
+    return OrderedDict(
+        sorted(V.iteritems(), key=itemgetter(1), reverse=True)[:limit]
+    )
+
+
+def exact_vulnerability(gr, limit=None, deadline=None, processes=None):
+    """ vulnerability of every node of gr computed over a process pool
+
+    deadline is a time.time() after which the pool is stopped and the
+    top limit of the nodes done so far are returned
+
+    returns (V, complete), V ordered most vulnerable first
+    """
+    E = gr.global_efficiency()
+    nodes = gr.graph.nodes()
+    V = {}
+    complete = True
+
+    if multiprocessing.current_process().daemon:
+        # already in a pool worker, which can't start a pool of its own
+        init_worker(gr)
+        for node in nodes:
+            if deadline is not None and time.time() > deadline:
+                return rank(V, limit), False
+            node, eff = efficiency_without(node)
+            V[node] = (E - eff) / E if E else 0.
+        return rank(V, limit), complete
+
+    processes = processes or multiprocessing.cpu_count()
+    chunksize = max(1, len(nodes) // (4 * processes))
+    pool = multiprocessing.Pool(processes, init_worker, (gr,))
+    try:
+        results = pool.imap_unordered(efficiency_without, nodes, chunksize)
+        for _ in nodes:
+            timeout = None
+            if deadline is not None:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    raise multiprocessing.TimeoutError
+            node, eff = results.next(timeout)
+            V[node] = (E - eff) / E if E else 0.
+    except multiprocessing.TimeoutError:
+        complete = False
+        logger.warning(
+            'vulnerability deadline reached after %d of %d nodes',
+            len(V), len(nodes)
+        )
+    finally:
+        pool.terminate()
+        pool.join()
+
+    return rank(V, limit), complete
+
+
+def cached(gr, network=None, deadline=None):
+    """ the exact vulnerability of every node of gr, from the
+    precomputed table of network when it matches, or of the nodes done
+    by the deadline
+    """
+    V = tables.get(gr.version)
+    if V is not None:
+        return V
+    if network:
+        V = load(gr, network)
+    complete = V is not None
+    if V is None:
+        V, complete = exact_vulnerability(gr, deadline=deadline)
+    if complete:
+        tables.set(gr.version, V)
+    return V
+
+
+def precomputed_path(network):
+    return get('vulnerability_%s' % network)
+
+
+def save(gr, network, V):
+    with open(precomputed_path(network), 'w') as f:
+        json.dump(
+            {'version': gr.version, 'vulnerability': V.items()}, f
+        )
+
+
+def load(gr, network):
+    """ the precomputed table of the network if it matches gr
+    """
+    path = precomputed_path(network)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        data = json.load(f)
+    if data['version'] != gr.version:
+        return None
+    return OrderedDict(
+        (node, v) for node, v in data['vulnerability']
+    )
+
+
+def main(argv=None):
+    from app import utils
+
+    parser = argparse.ArgumentParser(
+        description='precompute exact node vulnerability tables'
+    )
+    parser.add_argument(
+        'networks', nargs='+', choices=['network', 'underground']
+    )
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument(
+        '--timeout', type=float, default=None,
+        help='seconds allowed per network'
+    )
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    for network in args.networks:
+        gr = utils.get_base_graph(network)
+        start = time.time()
+        deadline = None
+        if args.timeout:
+            deadline = start + args.timeout
+        V, complete = exact_vulnerability(
+            gr, deadline=deadline, processes=args.processes
+        )
+        if not complete:
+            logger.error('%s: not saving a partial table', network)
+            continue
+        save(gr, network, V)
+        logger.info(
+            '%s: %d nodes in %.1fs -> %s',
+            network, len(V), time.time() - start,
+            precomputed_path(network)
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,5 @@
+""" timings of the graph metrics and views on synthetic networks
+
+    python -m benchmarks.run --airports 1000 --output results.json
+    python -m benchmarks.run --baseline results.json
+"""
@@ -0,0 +1,94 @@
+""" synthetic data files in the layout of data/
+
+airports are joined by a preferential attachment network, like the hub
+and spoke routes of the real data, and Underground lines are paths
+through shared stations so that lines meet at interchanges
+"""
+import csv
+import json
+import os
+import string
+
+import networkx as nx
+import numpy as np
+
+# roughly the continental US and Greater London
+US = ((25., 49.), (-124., -67.))
+LONDON = ((51.4, 51.65), (-0.45, 0.2))
+
+
+def codes(n):
+    """ n distinct upper case codes, three letters while they last
+    """
+    letters = string.ascii_uppercase
+    width = 3
+    while 26 ** width < n:
+        width += 1
+    out = []
+    for i in xrange(n):
+        code = []
+        for _ in xrange(width):
+            i, r = divmod(i, 26)
+            code.append(letters[r])
+        out.append(''.join(reversed(code)))
+    return out
+
+
+def points(rng, n, box):
+    (lat0, lat1), (lon0, lon1) = box
+    return rng.uniform(lat0, lat1, n), rng.uniform(lon0, lon1, n)
+
+
+def write_airports(path, n, m=2, seed=0):
+    """ flights.csv and airports.csv for n airports each joining m
+    earlier ones
+    """
+    rng = np.random.RandomState(seed)
+    names = codes(n)
+    lats, lons = points(rng, n, US)
+    graph = nx.barabasi_albert_graph(n, m, seed=seed)
+
+    with open(os.path.join(path, 'flights.csv'), 'w') as f:
+        writer = csv.writer(f)
+        for u, v in graph.edges_iter():
+            writer.writerow([names[u], names[v], rng.randint(1, 1000)])
+
+    with open(os.path.join(path, 'airports.csv'), 'w') as f:
+        writer = csv.writer(f)
+        writer.writerow(
+            ['iata', 'airport', 'city', 'state', 'country', 'lat', 'long']
+        )
+        for i, code in enumerate(names):
+            writer.writerow([
+                code, '%s Airport' % code, '%s City' % code, 'ZZ', 'USA',
+                '%.6f' % lats[i], '%.6f' % lons[i]
+            ])
+    return names
+
+
+def write_underground(path, n, lines=11, seed=0):
+    """ lines.csv and stations.json for n stations on a number of lines
+    """
+    rng = np.random.RandomState(seed)
+    names = ['Station %d' % i for i in xrange(n)]
+    lats, lons = points(rng, n, LONDON)
+    # every line visits about a fifth of the stations, west to east
+    size = max(2, n // 5)
+
+    with open(os.path.join(path, 'lines.csv'), 'w') as f:
+        writer = csv.writer(f)
+        for line in xrange(lines):
+            stops = rng.choice(n, size, replace=False)
+            stops = stops[np.argsort(lons[stops])]
+            for u, v in zip(stops, stops[1:]):
+                writer.writerow([names[u], names[v], 'Line %d' % line])
+
+    with open(os.path.join(path, 'stations.json'), 'w') as f:
+        json.dump(
+            [
+                {'name': name, 'coordinates': [lons[i], lats[i]]}
+                for i, name in enumerate(names)
+            ],
+            f
+        )
+    return names
@@ -0,0 +1,286 @@
+""" time the graph metrics and every view on synthetic networks
+
+    python -m benchmarks.run --airports 1000 --stations 300 \
+        --output results.json
+    python -m benchmarks.run --airports 1000 --stations 300 \
+        --baseline results.json
+
+with a baseline the run exits non zero if any median is slower than the
+baseline's by more than the threshold
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import urllib
+
+import networkx as nx
+import numpy as np
+
+from app import (
+    app, centrality, degrees, efficiency, journey, layout, projection,
+    routing, sampling, utils, vulnerability
+)
+from app.graph import N_degree_partition
+from benchmarks import networks
+
+logger = logging.getLogger(__name__)
+
+METRICS = (
+    ('calculate_global_efficiencies', lambda gr: (
+        gr.calculate_global_efficiencies()
+    )),
+    ('vulnerability', lambda gr: gr.vulnerability(limit=5)),
+    ('degree_centrality', lambda gr: gr.degree_centrality()),
+    ('eigenvector_centrality', lambda gr: gr.eigenvector_centrality()),
+    ('betweenness_centrality', lambda gr: gr.betweenness_centrality()),
+    ('d3_forced_layout', lambda gr: gr.d3_forced_layout()),
+)
+
+# {a} and {b} are airports with a route between them, {line} a line
+VIEWS = (
+    '/',
+    '/route',
+    '/london',
+    '/random',
+    '/map',
+    '/map/{a}/{b}',
+    '/histogram/network',
+    '/london_map',
+    '/london_map/{line}',
+    '/forced/underground',
+    '/forced/underground?simulate=none',
+    '/airports',
+    '/airports?format=columnar',
+    '/airports?projection=albersUsa&scale=1200&translate=450,280'
+    '&resolution=1',
+    '/airports/{a}',
+    '/flights',
+    '/flights?format=columnar',
+    '/flights/{a}',
+    '/flights/{a}/{b}',
+    '/stations',
+    '/stations?projection=mercator&scale=41000&translate=480,43350',
+    '/nearby?lat=51.5&lon=-0.1&k=5&network=underground',
+    '/lines',
+    '/lines/{line}',
+    '/forcedlayout/underground?params=params%3Dline',
+    '/forcedlayout/random',
+    '/degree/scatter/network',
+    '/degree/powerlaw/network',
+    '/degree/scatter/underground',
+    '/centrality/betweenness/network',
+)
+
+
+def clear_caches():
+    """ forget every per version result so each run starts cold
+    """
+    efficiency.engine.tables.clear()
+    centrality.cache.rankings.clear()
+    degrees.cache.items.clear()
+    layout.layouts.clear()
+    routing.routers.clear()
+    journey.planners.clear()
+    projection.projected.clear()
+    sampling.estimates.clear()
+    vulnerability.tables.clear()
+    utils.overlays.clear()
+    utils.responses.clear()
+    for gr in utils.base_graphs.itervalues():
+        gr.clear_caches()
+
+
+def summary(samples):
+    """ seconds per run, percentiles over the runs
+    """
+    samples = np.array(samples)
+    p50, p90, p99 = np.percentile(samples, [50, 90, 99])
+    return {
+        'runs': len(samples),
+        'mean': float(samples.mean()),
+        'min': float(samples.min()),
+        'max': float(samples.max()),
+        'p50': float(p50),
+        'p90': float(p90),
+        'p99': float(p99),
+    }
+
+
+def measure(func, repeat, setup=None):
+    samples = []
+    try:
+        for _ in xrange(repeat):
+            if setup is not None:
+                setup()
+            start = time.time()
+            func()
+            samples.append(time.time() - start)
+    except Exception as e:
+        return {'error': '%s: %s' % (e.__class__.__name__, e)}
+    return summary(samples)
+
+
+def random_network(size, parts, p):
+    return type('RandomNetwork', (N_degree_partition,), {
+        'nodes': [size] * parts,
+        'p': p
+    })
+
+
+def bench_graphs(repeat):
+    results = {}
+    for key in sorted(utils.NETWORKS):
+        cls = utils.NETWORKS[key]
+        results['%s.build_graph' % key] = measure(
+            lambda: cls(use_snapshot=False), repeat
+        )
+        gr = utils.get_base_graph(key)
+        for name, func in METRICS:
+            if name == 'd3_forced_layout' and not gr.d3:
+                continue
+            results['%s.%s' % (key, name)] = measure(
+                lambda: func(gr), repeat, setup=clear_caches
+            )
+    return results
+
+
+def bench_views(repeat):
+    from session import session_opts, session_setup
+
+    # sessions are kept in process rather than in memcached
+    session_opts['session.type'] = 'memory'
+    client = session_setup(app).test_client()
+
+    graph = utils.get_base_graph('network').graph
+    a = max(graph, key=graph.degree)
+    b = list(nx.bfs_tree(graph, a))[-1]
+    line = sorted(utils.get_base_graph('underground').get_current_lines)[0]
+    args = {'a': a, 'b': b, 'line': urllib.quote(line)}
+
+    # cold runs start from empty caches, warm ones are served from them
+    results = {}
+    for view in VIEWS:
+        url = view.format(**args)
+        statuses = set()
+
+        def get():
+            statuses.add(client.get(url).status_code)
+        for name, setup in (('cold', clear_caches), ('warm', get)):
+            result = measure(get, repeat, setup=setup)
+            result['status'] = sorted(statuses)
+            results['GET %s %s' % (view, name)] = result
+    return results
+
+
+def compare(results, baseline, threshold=0.2):
+    """ [(name, baseline p50, p50)] of the results whose median is more
+    than threshold slower than the baseline's
+    """
+    regressions = []
+    for name, result in sorted(results.iteritems()):
+        base = baseline.get(name)
+        if not base or 'p50' not in base or 'p50' not in result:
+            continue
+        if result['p50'] > base['p50'] * (1 + threshold):
+            regressions.append((name, base['p50'], result['p50']))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='time the graph metrics and views'
+    )
+    parser.add_argument('--airports', type=int, default=300)
+    parser.add_argument(
+        '--routes', type=int, default=2,
+        help='routes from each new airport to earlier ones'
+    )
+    parser.add_argument('--stations', type=int, default=200)
+    parser.add_argument('--lines', type=int, default=11)
+    parser.add_argument(
+        '--random', type=int, default=50,
+        help='nodes per partition of the random network'
+    )
+    parser.add_argument('--parts', type=int, default=3)
+    parser.add_argument('--p', type=float, default=0.1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help='write the results here')
+    parser.add_argument('--baseline', help='results to compare with')
+    parser.add_argument('--threshold', type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    cwd = os.getcwd()
+    output = args.output and os.path.abspath(args.output)
+    baseline = args.baseline and os.path.abspath(args.baseline)
+    networks_before = dict(utils.NETWORKS)
+
+    # the app reads data/ relative to the working directory
+    tmp = tempfile.mkdtemp()
+    try:
+        os.mkdir(os.path.join(tmp, 'data'))
+        networks.write_airports(
+            os.path.join(tmp, 'data'), args.airports, args.routes, args.seed
+        )
+        networks.write_underground(
+            os.path.join(tmp, 'data'), args.stations, args.lines, args.seed
+        )
+        os.chdir(tmp)
+        app.config.from_object('config.BaseConfig')
+        app.config['RANDOM_SEED'] = args.seed
+        utils.NETWORKS['random'] = random_network(
+            args.random, args.parts, args.p
+        )
+        utils.base_graphs.clear()
+
+        results = bench_graphs(args.repeat)
+        results.update(bench_views(args.repeat))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(tmp)
+        utils.NETWORKS.update(networks_before)
+        utils.base_graphs.clear()
+
+    report = {
+        'meta': {
+            'time': time.time(),
+            'python': platform.python_version(),
+            'networkx': nx.__version__,
+            'numpy': np.__version__,
+            'backend': app.config.get('GRAPH_BACKEND'),
+            'args': vars(args),
+        },
+        'results': results
+    }
+    if output:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+
+    if baseline:
+        with open(baseline) as f:
+            regressions = compare(
+                results, json.load(f)['results'], args.threshold
+            )
+        for name, before, after in regressions:
+            sys.stderr.write(
+                'REGRESSION %s: %.4fs -> %.4fs (%+.0f%%)\n' % (
+                    name, before, after, 100 * (after / before - 1)
+                )
+            )
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,6 +1,37 @@
 class BaseConfig(object):
     DEBUG = False
     TESTING = False
+    # rank nodes by removing them rather than by their own efficiency
+    EXACT_VULNERABILITY = False
+    # seconds allowed for an exact vulnerability ranking in a request
+    VULNERABILITY_TIMEOUT = 5
+    # 'sparse' runs the metrics on a CSR copy of each graph, needs scipy
+    GRAPH_BACKEND = 'networkx'
+    # seed for the random network and sampling, fixed so every worker
+    # builds the same random network, None for a new one per worker
+    RANDOM_SEED = 0
+    # bytes of serialised JSON responses kept per process
+    RESPONSE_CACHE_BYTES = 64 * 1024 * 1024
+    # compute page metrics in a process pool and serve the latest values
+    # while they run, see app/jobs.py
+    BACKGROUND_METRICS = False
+    # serve /internal/metrics, leave off unless only Prometheus can reach
+    # the app
+    INTERNAL_METRICS = False
+    # let ?profile=1 (cProfile) and ?profile=flamegraph (collapsed stacks)
+    # replace a response with its profile
+    PROFILE_REQUESTS = False
+    # above this many nodes the pages rank vulnerability by efficiencies
+    # estimated from sampled sources, see app/sampling.py
+    APPROXIMATE_ABOVE = 2000
+    # target error of each estimated value, with this confidence
+    APPROXIMATE_EPSILON = 0.1
+    APPROXIMATE_CONFIDENCE = 0.95
+    # and at most this many seconds spent sampling, on the order of a
+    # minute at epsilon 0.1 on 8000 nodes otherwise
+    APPROXIMATE_BUDGET = 2
+    # stops a change of line is worth in /journey
+    INTERCHANGE_PENALTY = 3
 
 
 class DevelopmentConfig(BaseConfig):
@@ -26,7 +57,26 @@ def get_network_data(data):
         return 'data/airports.csv'
 
     if data == 'lines':
+        if app.testing:
+            return 'data/test/lines.csv'
         return 'data/lines.csv'
 
     if data == 'stations':
+        if app.testing:
+            return 'data/test/stations.json'
         return 'data/stations.json'
+
+    if data.startswith('vulnerability_'):
+        if app.testing:
+            return 'data/test/%s.json' % data
+        return 'data/%s.json' % data
+
+    if data.startswith('routing_'):
+        if app.testing:
+            return 'data/test/%s.npz' % data
+        return 'data/%s.npz' % data
+
+    if data.startswith('snapshot_'):
+        if app.testing:
+            return 'data/test/snapshot/%s' % data[len('snapshot_'):]
+        return 'data/snapshot/%s' % data[len('snapshot_'):]
@@ -1,4 +1,6 @@
 #!/home/vagrant/venv/site/bin/python
+import logging
+
 from app import app
 from session import session_setup
 from wdb.ext import WdbMiddleware
@@ -6,6 +8,7 @@ from wdb.ext import WdbMiddleware
 app.wsgi_app = WdbMiddleware(app.wsgi_app)
 app = session_setup(app)
 app.config.from_object('config.DevelopmentConfig')
+logging.basicConfig(level=logging.INFO)
 
 
 if __name__ == "__main__":